@@ -8,6 +8,7 @@ __credits__ = ["EverythingSuckz", "Elias Benbourenane", "AlkenD"]
 
 import logging
 import os.path
+import multiprocessing
 from os import makedirs
 from datetime import datetime, timezone
 
@@ -17,19 +18,22 @@ if not os.path.isdir("logs"):
 if not os.path.isdir("cache"):
     makedirs("cache")
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    datefmt="%Y/%m/%d %H:%M:%S",
-    format="[%(asctime)s][%(levelname)s] ==> %(message)s",
-    handlers=[
-        logging.StreamHandler(),
+handlers = [logging.StreamHandler()]
+# Metadata workers import the app too, only the server writes the log file
+if multiprocessing.parent_process() is None:
+    handlers.append(
         logging.FileHandler(
             "logs/{}.log".format(
                 datetime.now(timezone.utc).strftime("%Y-%m-%d_%H%M%S")
             ),
             mode="w",
-        ),
-    ],
+        )
+    )
+logging.basicConfig(
+    level=logging.DEBUG,
+    datefmt="%Y/%m/%d %H:%M:%S",
+    format="[%(asctime)s][%(levelname)s] ==> %(message)s",
+    handlers=handlers,
 )
 logging.getLogger("oauth2client").setLevel(logging.WARNING)
 logging.getLogger("googleapiclient").setLevel(logging.WARNING)
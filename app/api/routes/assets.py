@@ -2,6 +2,7 @@ from httpx import AsyncClient
 from time import perf_counter
 from app.models import DResponse
 from fastapi import Path, APIRouter
+from app.core.outbound import outbound
 from fastapi.responses import StreamingResponse
 from starlette.background import BackgroundTask
 
@@ -11,7 +12,7 @@ router = APIRouter(
     tags=["internals"],
 )
 
-client = AsyncClient()
+client = AsyncClient(timeout=outbound("images").httpx_timeout)
 
 
 @router.get("/image/{quality}/{filename}", status_code=200)
@@ -21,7 +22,7 @@ async def image_path(
 ):
     path = f"https://image.tmdb.org/t/p/{quality}/{filename}"
     req = client.build_request("GET", path)
-    r = await client.send(req, stream=True)
+    r = await outbound("images").acall(client.send, req, stream=True)
     return StreamingResponse(
         r.aiter_raw(), background=BackgroundTask(r.aclose), headers=r.headers
     )
@@ -44,7 +45,7 @@ async def image_path(
             404, "No thumbnail is available for this file.", False, None, init_time
         ).__dict__()
     req = client.build_request("GET", thumb_url)
-    r = await client.send(req, stream=True)
+    r = await outbound("images").acall(client.send, req, stream=True)
     return StreamingResponse(
         r.aiter_raw(), background=BackgroundTask(r.aclose), headers=r.headers
     )
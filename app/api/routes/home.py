@@ -16,6 +16,7 @@ unwanted_keys = {
     "crew": 0,
     "seasons": 0,
     "file_name": 0,
+    "hashes": 0,
     "subtitles": 0,
     "external_ids": 0,
     "genres": 0,
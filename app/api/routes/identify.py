@@ -0,0 +1,59 @@
+from time import perf_counter
+from app.models import DResponse
+from app.core.identify import IdentifyCache
+from fastapi import Request, Response, APIRouter
+
+
+router = APIRouter(
+    prefix="/identify",
+    tags=["internals"],
+)
+
+
+@router.post("", response_model=dict, status_code=200)
+async def pin(request: Request, response: Response) -> dict:
+    init_time = perf_counter()
+    from main import mongo
+
+    data = await request.json()
+    title = data.get("title")
+    data_type = data.get("type", "movies")
+    tmdb_id = data.get("tmdb_id")
+    if not title or data_type not in ("movies", "series") or not tmdb_id:
+        response.status_code = 400
+        return DResponse(
+            400, "A title, a type and a tmdb_id are required.", False, None, init_time
+        ).__dict__()
+    key = IdentifyCache(mongo.identify_cache_col).pin(
+        title, data_type, int(tmdb_id), data.get("year"), data.get("adult", False)
+    )
+
+    return DResponse(
+        200,
+        f"'{title}' will be identified as {tmdb_id} from the next scan on.",
+        True,
+        {"key": key},
+        init_time,
+    ).__dict__()
+
+
+@router.delete("", response_model=dict, status_code=200)
+async def unpin(request: Request, response: Response) -> dict:
+    init_time = perf_counter()
+    from main import mongo
+
+    data = await request.json()
+    title = data.get("title")
+    data_type = data.get("type", "movies")
+    removed = IdentifyCache(mongo.identify_cache_col).unpin(
+        title or "", data_type, data.get("year"), data.get("adult", False)
+    )
+    if not removed:
+        response.status_code = 404
+        return DResponse(
+            404, f"No pinned match for '{title}'.", False, None, init_time
+        ).__dict__()
+
+    return DResponse(
+        200, f"Removed the pinned match for '{title}'.", True, None, init_time
+    ).__dict__()
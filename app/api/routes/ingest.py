@@ -0,0 +1,43 @@
+from time import perf_counter
+from app.models import DResponse
+from app.core.cron import ingest_paths
+from fastapi import Request, Response, APIRouter, BackgroundTasks
+
+
+router = APIRouter(
+    prefix="/ingest",
+    tags=["internals"],
+)
+
+
+@router.post("", response_model=dict, status_code=200)
+async def ingest(
+    request: Request, response: Response, background_tasks: BackgroundTasks
+) -> dict:
+    init_time = perf_counter()
+    from main import rclone
+
+    data = await request.json()
+    rclone_index = data.get("rclone_index")
+    paths = data.get("paths") or []
+    if isinstance(paths, str):
+        paths = [paths]
+    if rclone_index not in rclone:
+        response.status_code = 404
+        return DResponse(
+            404, f"No category with the index {rclone_index}.", False, None, init_time
+        ).__dict__()
+    if len(paths) == 0:
+        response.status_code = 400
+        return DResponse(
+            400, "At least one path is required.", False, None, init_time
+        ).__dict__()
+    background_tasks.add_task(ingest_paths, rclone_index, paths)
+
+    return DResponse(
+        200,
+        f"Ingestion of {len(paths)} path(s) started in background.",
+        True,
+        None,
+        init_time,
+    ).__dict__()
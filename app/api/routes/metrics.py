@@ -0,0 +1,18 @@
+from fastapi import APIRouter
+from time import perf_counter
+from app.models import DResponse
+from app.core.outbound import outbound_metrics
+
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["internals"],
+)
+
+
+@router.get("/outbound", response_model=dict, status_code=200)
+def outbound() -> dict:
+    init_time = perf_counter()
+    return DResponse(
+        200, "Outbound dependency metrics", True, outbound_metrics(), init_time
+    ).__dict__()
@@ -11,9 +11,9 @@ router = APIRouter(
 
 
 @router.get("", response_model=dict, status_code=200)
-async def rebuild(background_tasks: BackgroundTasks) -> dict:
+async def rebuild(background_tasks: BackgroundTasks, incremental: bool = False) -> dict:
     init_time = perf_counter()
-    background_tasks.add_task(fetch_metadata)
+    background_tasks.add_task(fetch_metadata, None, incremental)
 
     return DResponse(
         200, "Metadata building task started in background.", True, None, init_time
@@ -29,7 +29,27 @@ async def settings_post(
     from main import mongo
 
     data = await request.json()
-    condition = mongo.set_config(data)
+    # Category changes, and saves that start a pending rebuild, rewrite the
+    # metadata a running rebuild is replacing; other settings never wait
+    if (
+        mongo.is_metadata_init
+        and data.get("categories", []) == mongo.config["categories"]
+    ):
+        condition = mongo.set_config(data)
+    elif not mongo.metadata_lock.acquire(blocking=False):
+        response.status_code = 409
+        return DResponse(
+            409,
+            "A metadata rebuild is running, try again later.",
+            False,
+            None,
+            init_time,
+        ).__dict__()
+    else:
+        try:
+            condition = mongo.set_config(data)
+        finally:
+            mongo.metadata_lock.release()
     if condition == 0:
         response.status_code = 409
         return DResponse(
@@ -40,7 +60,7 @@ async def settings_post(
             200, "Config successfully uploaded to database.", True, None, init_time
         ).__dict__()
     elif condition == 2:
-        background_tasks.add_task(fetch_metadata)
+        background_tasks.add_task(fetch_metadata, mongo.changed_categories)
         return DResponse(
             200,
             "Config successfully uploaded to database. Metadata generation started.",
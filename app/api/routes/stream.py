@@ -1,6 +1,9 @@
+import os
 import requests
 from fastapi import Request, APIRouter
-from fastapi.responses import StreamingResponse
+from app.utils.sendfile import RangeFileResponse
+from app.core.outbound import CircuitOpenError, outbound
+from fastapi.responses import UJSONResponse, StreamingResponse
 
 
 router = APIRouter(
@@ -30,14 +33,25 @@ def query(request: Request, full_path: str, rclone_index: int):
 
     rc = rclone[rclone_index]
     stream_url = rc.stream(full_path)
-
-    result = requests.request(
-        method=request.method,
-        url=stream_url,
-        headers=request.headers,
-        allow_redirects=True,
-        stream=True,
-    )
+    if rc.provider == "local":
+        if stream_url is None or not os.path.isfile(stream_url):
+            return UJSONResponse(
+                status_code=404, content={"ok": False, "message": "File not found."}
+            )
+        return RangeFileResponse(stream_url, request.headers.get("range"))
+
+    try:
+        result = outbound(f"stream-{rc.shard}").request(
+            request.method,
+            stream_url,
+            headers=request.headers,
+            allow_redirects=True,
+            stream=True,
+        )
+    except (CircuitOpenError, requests.RequestException):
+        return UJSONResponse(
+            status_code=503, content={"ok": False, "message": "Remote unavailable."}
+        )
     headers = result.headers
     headers["content-disposition"] = "inline"
 
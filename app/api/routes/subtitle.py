@@ -0,0 +1,102 @@
+import os
+import time
+import hashlib
+import requests
+from glob import glob
+from app.settings import settings
+from email.utils import formatdate
+from app.core.outbound import outbound
+from app.utils.subtitles import srt_to_vtt
+from fastapi.responses import UJSONResponse
+from fastapi import Request, Response, APIRouter
+
+
+router = APIRouter(
+    prefix="/subtitle",
+    tags=["internals"],
+)
+
+cache_dir = os.path.join("cache", "subtitles")
+
+
+def decode(content: bytes) -> str:
+    for encoding in ("utf-8-sig", "cp1252"):
+        try:
+            return content.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return content.decode("latin-1")
+
+
+def read_subtitle(rc, full_path: str) -> bytes:
+    source = rc.stream(full_path)
+    if source is None:
+        raise FileNotFoundError(full_path)
+    if rc.provider == "local":
+        with open(source, "rb") as r:
+            return r.read()
+    result = outbound(f"stream-{rc.shard}").request("GET", source)
+    result.raise_for_status()
+    return result.content
+
+
+@router.get("/{rclone_index}/{full_path:path}", status_code=200)
+def subtitle(request: Request, rclone_index: int, full_path: str):
+    from main import rclone
+
+    rc = rclone.get(rclone_index)
+    if rc is None or not full_path.lower().endswith((".srt", ".vtt")):
+        return UJSONResponse(
+            status_code=404, content={"ok": False, "message": "Subtitle not found."}
+        )
+    try:
+        source = rc.rc_stat(full_path)
+    except (OSError, requests.RequestException):
+        source = None
+    if source is None:
+        return UJSONResponse(
+            status_code=404, content={"ok": False, "message": "Subtitle not found."}
+        )
+    key = hashlib.sha1(f"{rc.fs}{full_path}".encode("utf-8")).hexdigest()
+    # A sidecar replaced at the source gets a new conversion
+    version = hashlib.sha1(f"{source['ModTime']}-{source['Size']}".encode("utf-8"))
+    cache_path = os.path.join(cache_dir, f"{key}-{version.hexdigest()[:16]}.vtt")
+    if (
+        not os.path.isfile(cache_path)
+        or time.time() - os.path.getmtime(cache_path) > settings.SUBTITLE_CACHE_TTL
+    ):
+        try:
+            content = decode(read_subtitle(rc, full_path))
+        except (OSError, requests.RequestException):
+            return UJSONResponse(
+                status_code=404,
+                content={"ok": False, "message": "Subtitle not found."},
+            )
+        if full_path.lower().endswith(".srt"):
+            content = srt_to_vtt(content)
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write then rename so readers never see a partial file
+        with open(f"{cache_path}.tmp", "w", encoding="utf-8") as w:
+            w.write(content)
+        os.replace(f"{cache_path}.tmp", cache_path)
+        for stale in glob(os.path.join(cache_dir, f"{key}-*.vtt")):
+            if stale != cache_path:
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+
+    with open(cache_path, "rb") as r:
+        body = r.read()
+    mtime = os.path.getmtime(cache_path)
+    headers = {
+        "etag": f'"{hashlib.sha1(body).hexdigest()}"',
+        "last-modified": formatdate(mtime, usegmt=True),
+        "cache-control": f"public, max-age={settings.SUBTITLE_CACHE_TTL}",
+    }
+    if request.headers.get("if-none-match") == headers["etag"] or (
+        "if-none-match" not in request.headers
+        and request.headers.get("if-modified-since") == headers["last-modified"]
+    ):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="text/vtt; charset=utf-8", headers=headers)
@@ -1,3 +1,11 @@
 from .tmdb import TMDB
 from .mongodb import MongoDB  # noqa
-from .rclone import RCloneAPI, build_config  # noqa
+from .rcd import RClonePool  # noqa
+from .local import LocalAPI  # noqa
+from .rclone import (  # noqa
+    RCloneAPI,
+    build_config,
+    build_remote,
+    CATEGORY_SCAN_FIELDS,
+    build_streaming_profile,
+)
@@ -12,6 +12,7 @@ from dataclasses import dataclass
 from typing import Any, Dict, Optional
 from fastapi.responses import UJSONResponse
 from httpx import HTTPError, InvalidURL, RequestError
+from app.core.outbound import IDEMPOTENT_METHODS, outbound
 
 
 @dataclass
@@ -49,7 +50,7 @@ class Auth0Manager:
             self.api_identifier = (
                 f"http{'s' if not fqdn.startswith('localhost') else ''}://{fqdn}"
             )
-        self.httpx = httpx.Client()
+        self.httpx = httpx.Client(timeout=outbound("auth0").httpx_timeout)
         self.token = self.get_access_token()
         self.httpx.headers.update(
             {
@@ -70,7 +71,9 @@ class Auth0Manager:
                     "client_secret": self.mtm_client_secret,
                     "audience": self.audience,
                 }
-                response = self.httpx.post(f"{self.base_url}/oauth/token", data=data)
+                response = self.request(
+                    "POST", f"{self.base_url}/oauth/token", idempotent=True, data=data
+                )
                 res = response.json()
             except (HTTPError, RequestError, InvalidURL) as e:
                 raise e
@@ -101,28 +104,38 @@ class Auth0Manager:
         self.token = token
         return token
 
+    def request(
+        self, method: str, url: str, idempotent: Optional[bool] = None, **kwargs
+    ) -> httpx.Response:
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        return outbound("auth0").call(
+            self.httpx.request, method, url, idempotent=idempotent, **kwargs
+        )
+
     @property
     def clients(self) -> Dict[str, Any]:
-        response = self.httpx.get(f"{self.base_url}/api/v2/clients")
+        response = self.request("GET", f"{self.base_url}/api/v2/clients")
         return response.json()
 
     def get_client(self, client_id: str) -> Dict[str, Any]:
-        response = self.httpx.get(f"{self.base_url}/api/v2/clients/{client_id}")
+        response = self.request("GET", f"{self.base_url}/api/v2/clients/{client_id}")
         return response.json()
 
     def create_client(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        response = self.httpx.post(f"{self.base_url}/api/v2/clients", json=data)
+        response = self.request("POST", f"{self.base_url}/api/v2/clients", json=data)
         return response.json()
 
     def update_client(self, client_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
-        response = self.httpx.patch(
-            f"{self.base_url}/api/v2/clients/{client_id}", json=data
+        response = self.request(
+            "PATCH", f"{self.base_url}/api/v2/clients/{client_id}", json=data
         )
         return response.json()
 
     @property
     def client_grants(self):
-        response = self.httpx.get(
+        response = self.request(
+            "GET",
             f"{self.base_url}/api/v2/client-grants",
             params={
                 "client_id": self.mtm_client_id,
@@ -132,45 +145,49 @@ class Auth0Manager:
         return response.json()
 
     def create_client_grant(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        response = self.httpx.post(f"{self.base_url}/api/v2/client-grants", json=data)
+        response = self.request(
+            "POST", f"{self.base_url}/api/v2/client-grants", json=data
+        )
         return response.json()
 
     def update_client_grant(
         self, client_grant_id: str, data: Dict[str, Any]
     ) -> Dict[str, Any]:
-        response = self.httpx.patch(
-            f"{self.base_url}/api/v2/client-grants/{client_grant_id}", json=data
+        response = self.request(
+            "PATCH",
+            f"{self.base_url}/api/v2/client-grants/{client_grant_id}",
+            json=data,
         )
         return response.json()
 
     def delete_client_grant(self, client_grant_id: str):
-        response = self.httpx.delete(
-            f"{self.base_url}/api/v2/client-grants/{client_grant_id}"
+        response = self.request(
+            "DELETE", f"{self.base_url}/api/v2/client-grants/{client_grant_id}"
         )
         return response.json()
 
     @property
     def resource_servers(self):
-        response = self.httpx.get(f"{self.base_url}/api/v2/resource-servers")
+        response = self.request("GET", f"{self.base_url}/api/v2/resource-servers")
         return response.json()
 
     def get_resource_server(self, server_id: str) -> Dict[str, Any]:
-        response = self.httpx.get(
-            f"{self.base_url}/api/v2/resource-servers/{server_id}"
+        response = self.request(
+            "GET", f"{self.base_url}/api/v2/resource-servers/{server_id}"
         )
         return response.json()
 
     def create_resource_server(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        response = self.httpx.post(
-            f"{self.base_url}/api/v2/resource-servers", json=data
+        response = self.request(
+            "POST", f"{self.base_url}/api/v2/resource-servers", json=data
         )
         return response.json()
 
     def update_resource_server(
         self, server_id: str, data: Dict[str, Any]
     ) -> Dict[str, Any]:
-        response = self.httpx.patch(
-            f"{self.base_url}/api/v2/resource-servers/{server_id}", json=data
+        response = self.request(
+            "PATCH", f"{self.base_url}/api/v2/resource-servers/{server_id}", json=data
         )
         return response.json()
 
@@ -1,44 +1,390 @@
+import asyncio
 from app import logger
+from time import sleep
 from app.core import TMDB
-from pymongo import TEXT, DESCENDING
-from app.utils import generate_movie_metadata, generate_series_metadata
+from threading import Thread
+from app.settings import settings
+from app.models import Movie, Serie
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List, Tuple, Optional
+from pymongo import DeleteOne, InsertOne, ReplaceOne, UpdateOne, UpdateMany
+from app.core.pipeline import MOVIE_FILE_FIELDS, file_values, rebuild_metadata
+from app.utils import run_sync, generate_movie_metadata, generate_series_metadata
 
 
-def fetch_metadata():
+def fetch_metadata(
+    rclone_indexes: Optional[List[int]] = None, incremental: bool = False
+):
+    from main import mongo
+
+    if rclone_indexes is not None and len(rclone_indexes) == 0:
+        # No category needs a rebuild, renames and streaming settings were
+        # already applied in place by rclone_update
+        logger.info("No category needs its metadata rebuilt")
+        mongo.set_is_metadata_init(True)
+        return
+    with mongo.metadata_lock:
+        if incremental:
+            # The stored documents are updated in place
+            movies_col, series_col = mongo.movies_col, mongo.series_col
+            mongo.create_metadata_indexes(movies_col, series_col)
+        else:
+            # Readers keep the current library until the new one is complete
+            movies_col, series_col = mongo.shadow_metadata(rclone_indexes)
+        try:
+            written = run_sync(
+                rebuild_metadata(movies_col, series_col, rclone_indexes, incremental)
+            )
+        except BaseException:
+            if not incremental:
+                movies_col.drop()
+                series_col.drop()
+            raise
+        if not incremental:
+            mongo.swap_metadata(movies_col, series_col)
+        logger.info(f"Wrote {written['movies']} movies and {written['series']} series")
+        mongo.set_is_metadata_init(True)
+        start_warmup(rclone_indexes)
+
+
+async def generate_metadata(
+    listings: Dict[int, List[Dict[str, Any]]]
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Identify scanned items and build their metadata documents
+
+    Args:
+        listings (dict): The scanned items of each category
+
+    Returns:
+        tuple: The movie documents and the series documents
+    """
     from main import mongo, rclone
 
-    tmdb = TMDB(api_key=mongo.config["tmdb"]["api_key"])
-    series_metadata = []
     movies_metadata = []
-    for key, category in rclone.items():
-        category_id = category.data.get("id") or category.data.get("drive_id")
-        category_metadata = {
-            "id": category_id,
-            "type": category.data.get("type", "movies"),
-            "name": category.data.get("name"),
-            "include_in_homepage": category.data.get("include_in_homepage", True),
-        }
-        logger.info("Generating metadata: " + category_metadata["name"])
-        logger.debug("Category type: " + category_metadata["type"])
-        if category_metadata["type"] == "series":
-            series_metadata.extend(
-                generate_series_metadata(tmdb, rclone[key].fetch_series(), key)
+    series_metadata = []
+    async with TMDB(api_key=mongo.config["tmdb"]["api_key"]) as tmdb:
+        for key, data in listings.items():
+            language = rclone[key].data.get("language")
+            if rclone[key].data.get("type", "movies") == "series":
+                series_metadata.extend(
+                    await generate_series_metadata(tmdb, data, key, language)
+                )
+            else:
+                movies_metadata.extend(
+                    await generate_movie_metadata(tmdb, data, key, language)
+                )
+    refreshed_at = datetime.now(timezone.utc)
+    for doc in movies_metadata + series_metadata:
+        doc["refreshed_at"] = refreshed_at
+    return movies_metadata, series_metadata
+
+
+def ingest_paths(rclone_index: int, paths: List[str]) -> Dict[str, int]:
+    """Scan, identify and upsert only the given paths of a category
+
+    Args:
+        rclone_index (int): The category to ingest into
+        paths (list): Files or directories relative to the category root
+
+    Returns:
+        dict: The number of movies and series upserted
+    """
+    from main import mongo, rclone
+
+    with mongo.metadata_lock:
+        rc = rclone[rclone_index]
+        result = {"movies": 0, "series": 0}
+        if rc.data.get("type", "movies") == "series":
+            data = rc.fetch_series(paths)
+            _, series_metadata = run_sync(generate_metadata({rclone_index: data}))
+            bulk_action = [
+                ReplaceOne(
+                    {"rclone_index": rclone_index, "path": doc["path"]},
+                    doc,
+                    upsert=True,
+                )
+                for doc in series_metadata
+            ]
+            if len(bulk_action) > 0:
+                mongo.series_col.bulk_write(bulk_action, ordered=False)
+            result["series"] = len(bulk_action)
+            dirs = [serie["path"] for serie in data]
+        else:
+            data = rc.fetch_movies(paths)
+            movies_metadata, _ = run_sync(generate_metadata({rclone_index: data}))
+            bulk_action = []
+            for doc in movies_metadata:
+                existing = mongo.movies_col.find_one(
+                    {"rclone_index": rclone_index, "tmdb_id": doc["tmdb_id"]},
+                    {field: 1 for field in MOVIE_FILE_FIELDS},
+                )
+                if existing is None:
+                    bulk_action.append(InsertOne(doc))
+                    continue
+                files = {
+                    field: file_values(existing, field) for field in MOVIE_FILE_FIELDS
+                }
+                for i, file_id in enumerate(doc["id"]):
+                    if file_id in files["id"]:
+                        position = files["id"].index(file_id)
+                        for field in MOVIE_FILE_FIELDS:
+                            files[field][position] = doc[field][i]
+                    else:
+                        for field in MOVIE_FILE_FIELDS:
+                            files[field].append(doc[field][i])
+                files["number_of_files"] = len(files["id"])
+                bulk_action.append(UpdateOne({"_id": existing["_id"]}, {"$set": files}))
+            if len(bulk_action) > 0:
+                mongo.movies_col.bulk_write(bulk_action, ordered=False)
+            result["movies"] = len(bulk_action)
+            dirs = [movie["parent"]["path"] for movie in data if movie.get("parent")]
+        # The VFS directory cache would hide the new files until it expires
+        Thread(target=warmup_dirs, args=(rc, sorted(set(dirs))), daemon=True).start()
+        logger.info(
+            f"Ingested {result['movies']} movies and {result['series']} series "
+            f"into category {rclone_index}"
+        )
+        return result
+
+
+def remove_paths(rclone_index: int, paths: List[str]):
+    """Drop deleted files / directories of a category from the metadata
+
+    Args:
+        rclone_index (int): The category the paths belong to
+        paths (list): Removed files or directories relative to the category root
+    """
+    from main import mongo, rclone
+
+    with mongo.metadata_lock:
+        rc = rclone[rclone_index]
+        paths = [path.strip("/") for path in paths]
+        if rc.data.get("type", "movies") == "series":
+            folders = list(dict.fromkeys(path.split("/")[0] for path in paths))
+            gone = [folder for folder in folders if rc.rc_stat(folder) is None]
+            mongo.series_col.delete_many(
+                {"rclone_index": rclone_index, "path": {"$in": gone}}
             )
+            # Series that only lost some episodes are ingested again
+            remaining = [folder for folder in folders if folder not in gone]
+            if remaining:
+                ingest_paths(rclone_index, remaining)
+            return
+
+        def is_removed(file_path: str) -> bool:
+            return any(
+                file_path == path or file_path.startswith(path + "/") for path in paths
+            )
+
+        bulk_action = []
+        for doc in mongo.movies_col.find(
+            {"rclone_index": rclone_index},
+            {field: 1 for field in MOVIE_FILE_FIELDS},
+        ):
+            keep = [i for i, path in enumerate(doc["path"]) if not is_removed(path)]
+            if len(keep) == len(doc["path"]):
+                continue
+            if len(keep) == 0:
+                bulk_action.append(DeleteOne({"_id": doc["_id"]}))
+                continue
+            files = {field: file_values(doc, field) for field in MOVIE_FILE_FIELDS}
+            files = {
+                field: [values[i] for i in keep] for field, values in files.items()
+            }
+            files["number_of_files"] = len(keep)
+            bulk_action.append(UpdateOne({"_id": doc["_id"]}, {"$set": files}))
+        if len(bulk_action) > 0:
+            mongo.movies_col.bulk_write(bulk_action, ordered=False)
+        logger.info(f"Removed {len(paths)} path(s) from category {rclone_index}")
+
+
+def warmup_cache(rclone_indexes: Optional[List[int]] = None):
+    """Prime the rclone directory cache for every directory holding indexed media
+
+    Args:
+        rclone_indexes (list): Only warm up these categories
+    """
+    from main import mongo, rclone
+
+    jobs = []
+    for key, rc in list(rclone.items()):
+        if rclone_indexes is not None and key not in rclone_indexes:
+            continue
+        if rc.data.get("type", "movies") == "series":
+            dirs = mongo.series_col.distinct("path", {"rclone_index": key})
         else:
-            movies_metadata.extend(
-                generate_movie_metadata(tmdb, rclone[key].fetch_movies(), key)
+            dirs = mongo.movies_col.distinct("parent.path", {"rclone_index": key})
+        dirs = sorted(d for d in dirs if d)
+        for i in range(0, len(dirs), 16):
+            jobs.append((rc, dirs[i : i + 16]))
+    if len(jobs) == 0:
+        return
+    logger.debug(f"Warming up rclone directory cache ({len(jobs)} batches)")
+    with ThreadPoolExecutor(
+        max_workers=settings.RCLONE_WARMUP_CONCURRENCY,
+        thread_name_prefix="warmup",
+    ) as executor:
+        for rc, dirs in jobs:
+            executor.submit(warmup_dirs, rc, dirs)
+    logger.debug("Finished warming up rclone directory cache")
+
+
+def warmup_dirs(rc, dirs: List[str]):
+    try:
+        rc.rc_vfs_refresh(dirs)
+    except Exception as e:
+        logger.debug(f"Directory cache warmup failed for {rc.fs}: {e}")
+
+
+def start_warmup(rclone_indexes: Optional[List[int]] = None):
+    Thread(target=warmup_cache, args=(rclone_indexes,), daemon=True).start()
+
+
+# The fields of a document that come from TMDB and can be refreshed
+# without touching the files or the seasons of a title
+MEDIA_FIELDS = {
+    "movies": [
+        field
+        for field in Movie.__slots__[Movie.__slots__.index("tmdb_id") :]
+        if field != "thumbnail_path"
+    ],
+    "series": [
+        field
+        for field in Serie.__slots__[Serie.__slots__.index("tmdb_id") :]
+        if field != "seasons"
+    ],
+}
+STUB_FILE = {
+    "id": "",
+    "name": "",
+    "path": "",
+    "parent": {},
+    "modified_time": "1970-01-01T00:00:00+00:00",
+    "seasons": {},
+}
+
+
+def refresh_interval(doc: Dict[str, Any], data_type: str) -> timedelta:
+    """How long the TMDB data of a title is trusted without a refresh"""
+    if data_type == "series":
+        if doc.get("status") in ("Ended", "Canceled"):
+            return timedelta(days=30)
+        if doc.get("status") in ("Returning Series", "In Production", "Planned"):
+            return timedelta(days=1)
+        return timedelta(days=7)
+    release_date = doc.get("release_date")
+    if release_date is None or release_date > datetime.now():
+        return timedelta(days=1)
+    if datetime.now() - release_date > timedelta(days=365):
+        return timedelta(days=30)
+    return timedelta(days=7)
+
+
+async def refresh_metadata():
+    """Refetch the titles TMDB reports as changed, and those due a refresh
+
+    Only the media fields whose values differ are written back, together
+    with the new refreshed_at time.
+    """
+    from main import mongo, rclone
+
+    async with TMDB(api_key=mongo.config["tmdb"]["api_key"]) as tmdb:
+        for data_type, col in (
+            ("movies", mongo.movies_col),
+            ("series", mongo.series_col),
+        ):
+            now = datetime.now(timezone.utc)
+            # The changes feed covers at most 14 days
+            since = mongo.get_changes_polled(data_type) or now - timedelta(days=1)
+            since = max(since.replace(tzinfo=timezone.utc), now - timedelta(days=14))
+            changed = await tmdb.get_changes(data_type, since)
+            # Titles are refetched once per language they are shown in
+            due: Dict[Tuple[int, Optional[str]], List[Any]] = {}
+            for doc in col.find(
+                {},
+                {
+                    "tmdb_id": 1,
+                    "rclone_index": 1,
+                    "status": 1,
+                    "release_date": 1,
+                    "refreshed_at": 1,
+                },
+            ):
+                refreshed_at = doc.get("refreshed_at")
+                if (
+                    doc["tmdb_id"] in changed
+                    or refreshed_at is None
+                    or now - refreshed_at.replace(tzinfo=timezone.utc)
+                    > refresh_interval(doc, data_type)
+                ):
+                    category = rclone.get(doc.get("rclone_index"))
+                    language = category.data.get("language") if category else None
+                    due.setdefault((doc["tmdb_id"], language), []).append(doc["_id"])
+            details = await asyncio.gather(
+                *(
+                    tmdb.get_details(
+                        tmdb_id, data_type, seasons=[], fresh=True, language=language
+                    )
+                    for tmdb_id, language in due
+                ),
+                return_exceptions=True,
             )
-    mongo.movies_col.delete_many({})
-    if len(movies_metadata) > 0:
-        mongo.movies_col.bulk_write(movies_metadata)
-    mongo.movies_col.create_index([("title", TEXT)], background=True, name="title")
-    mongo.series_col.delete_many({})
-    if len(series_metadata) > 0:
-        mongo.series_col.bulk_write(series_metadata)
-    mongo.series_col.create_index([("title", TEXT)], background=True, name="title")
-    mongo.series_col.create_index(
-        [("seasons.episodes.modified_time", DESCENDING)],
-        background=True,
-        name="modified_time",
-    )
-    mongo.set_is_metadata_init(True)
+            bulk_action = []
+            for ((tmdb_id, _), ids), media_metadata in zip(due.items(), details):
+                if isinstance(media_metadata, Exception):
+                    logger.warning(
+                        f"Could not refresh {data_type} {tmdb_id}: {media_metadata}"
+                    )
+                    # Due again on the next run, the poll mark moves on anyway
+                    bulk_action.append(
+                        UpdateMany(
+                            {"_id": {"$in": ids}}, {"$unset": {"refreshed_at": ""}}
+                        )
+                    )
+                    continue
+                try:
+                    if data_type == "series":
+                        media = Serie(STUB_FILE, media_metadata, -1).__dict__()
+                    else:
+                        media = Movie(STUB_FILE, media_metadata, -1).__dict__()
+                except (KeyError, TypeError, ValueError) as e:
+                    logger.warning(f"Could not refresh {data_type} {tmdb_id}: {e}")
+                    continue
+                for doc in col.find(
+                    {"_id": {"$in": ids}},
+                    {field: 1 for field in MEDIA_FIELDS[data_type]},
+                ):
+                    changes = {
+                        field: media[field]
+                        for field in MEDIA_FIELDS[data_type]
+                        if doc.get(field) != media[field]
+                    }
+                    changes["refreshed_at"] = now
+                    bulk_action.append(
+                        UpdateOne({"_id": doc["_id"]}, {"$set": changes})
+                    )
+            if len(bulk_action) > 0:
+                col.bulk_write(bulk_action, ordered=False)
+            mongo.set_changes_polled(data_type, now)
+            logger.info(
+                f"Refreshed {len(due)} {data_type} ({len(changed)} changed on TMDB)"
+            )
+
+
+def schedule_refresh():
+    """Run refresh_metadata every METADATA_REFRESH_INTERVAL seconds"""
+    from main import mongo
+
+    def run():
+        while True:
+            sleep(settings.METADATA_REFRESH_INTERVAL)
+            if mongo.is_metadata_init is not True:
+                continue
+            try:
+                with mongo.metadata_lock:
+                    run_sync(refresh_metadata())
+            except Exception as e:
+                logger.error(f"Metadata refresh failed: {e}")
+
+    Thread(target=run, daemon=True).start()
@@ -0,0 +1,95 @@
+import re
+from app.settings import settings
+from typing import Any, Dict, Optional
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timezone, timedelta
+
+
+def normalize_title(title: str) -> str:
+    """Reduce a title to lowercase words, so spelling variants share a key"""
+    from app.utils.data import clean_file_name
+
+    title = clean_file_name((title or "").lower().strip())
+    return re.sub(r"[\W_]+", " ", title).strip()
+
+
+def identify_key(
+    title: str, data_type: str, year: Optional[int] = None, adult: bool = False
+) -> str:
+    return f"{data_type}:{int(bool(adult))}:{year or ''}:{normalize_title(title)}"
+
+
+class IdentifyCache:
+    """Results of title identification persisted in MongoDB
+
+    Matches are kept for IDENTIFY_CACHE_TTL seconds and misses for the
+    shorter IDENTIFY_MISS_TTL, so new TMDB entries are picked up. Pinned
+    entries are set by an admin and never expire.
+    """
+
+    def __init__(self, collection):
+        self.col = collection
+        self.col.create_index("expires_at", expireAfterSeconds=0, name="expires_at")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self.col.find_one({"_id": key})
+        if entry is None or entry.get("pinned"):
+            return entry
+        expires_at = entry["expires_at"].replace(tzinfo=timezone.utc)
+        return entry if expires_at > datetime.now(timezone.utc) else None
+
+    def set(self, key: str, tmdb_id: Optional[int]):
+        ttl = settings.IDENTIFY_CACHE_TTL if tmdb_id else settings.IDENTIFY_MISS_TTL
+        try:
+            self.col.update_one(
+                {"_id": key, "pinned": {"$ne": True}},
+                {
+                    "$set": {
+                        "tmdb_id": tmdb_id,
+                        "expires_at": datetime.now(timezone.utc)
+                        + timedelta(seconds=ttl),
+                    }
+                },
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # Pinned in the meantime, the pin wins
+            pass
+
+    def pin(
+        self,
+        title: str,
+        data_type: str,
+        tmdb_id: int,
+        year: Optional[int] = None,
+        adult: bool = False,
+    ) -> str:
+        """Always identify a title as the given TMDB ID
+
+        Returns:
+            str: The key of the pinned entry
+        """
+        key = identify_key(title, data_type, year, adult)
+        self.col.replace_one(
+            {"_id": key},
+            {
+                "title": normalize_title(title),
+                "type": data_type,
+                "year": year,
+                "adult": adult,
+                "tmdb_id": tmdb_id,
+                "pinned": True,
+            },
+            upsert=True,
+        )
+        return key
+
+    def unpin(
+        self,
+        title: str,
+        data_type: str,
+        year: Optional[int] = None,
+        adult: bool = False,
+    ) -> bool:
+        key = identify_key(title, data_type, year, adult)
+        return self.col.delete_one({"_id": key, "pinned": True}).deleted_count > 0
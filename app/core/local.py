@@ -0,0 +1,271 @@
+import os
+import re
+import ctypes
+import select
+import struct
+import ctypes.util
+from app import logger
+from mimetypes import guess_type
+from app.settings import settings
+from threading import Event, Thread
+from app.core.rclone import RCloneAPI
+from datetime import datetime, timezone
+from typing import Any, Set, Dict, List, Tuple, Optional
+
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+SAMPLE_RE = re.compile(r"(?:^|/)sample/|[-.]sample\.[^/]+$", flags=re.I)
+
+
+class LocalAPI(RCloneAPI):
+    """A category stored on the server's own disks
+
+    It exposes the same interface as RCloneAPI, but scans with os.scandir,
+    streams straight from disk and follows changes with inotify.
+    """
+
+    def __init__(self, data: Dict[str, Any], index: int, shard: int = 0):
+        self.data: Dict[str, Any] = data
+        self.index: int = index
+        self.shard: int = shard
+        self.id: str = data.get("id") or data.get("path") or ""
+        self.fs: str = "".join(c for c in self.id if c.isalnum()) + ":"
+        self.provider: str = "local"
+        self.root: str = os.path.realpath(data.get("path") or "")
+        self.hash_types: List[str] = []
+        self.jobs: Set[int] = set()
+        self.serve_id: Optional[str] = None
+        self.serve_addr: Optional[str] = None
+        self.watcher: Optional[InotifyWatcher] = None
+        if settings.LOCAL_WATCH:
+            self.watcher = InotifyWatcher(self)
+            self.watcher.start()
+
+    def local_path(self, path: str) -> Optional[str]:
+        """Resolve a path of the category to a path on disk
+
+        Returns:
+            Optional[str]: None if the path escapes the category root
+        """
+        full_path = os.path.realpath(os.path.join(self.root, path.lstrip("/")))
+        if full_path != self.root and not full_path.startswith(self.root + os.sep):
+            return None
+        return full_path
+
+    def to_item(self, entry_path: str, stat: os.stat_result, is_dir: bool):
+        path = os.path.relpath(entry_path, self.root).replace(os.sep, "/")
+        name = os.path.basename(entry_path)
+        return {
+            "ID": f"{stat.st_dev}-{stat.st_ino}",
+            "Name": name,
+            "Path": path,
+            "IsDir": is_dir,
+            "MimeType": "inode/directory"
+            if is_dir
+            else (guess_type(name)[0] or "application/octet-stream"),
+            "ModTime": datetime.fromtimestamp(stat.st_mtime, timezone.utc).isoformat(),
+            "Size": -1 if is_dir else stat.st_size,
+        }
+
+    def rc_ls(
+        self,
+        options: Optional[dict] = {},
+        remote: str = "",
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        base = self.local_path(remote)
+        if base is None or not os.path.isdir(base):
+            raise RuntimeError(f"Listing {self.root}/{remote} failed: not a directory")
+        filters = filters or {}
+        extensions: Tuple[str, ...] = filters.get("extensions", ())
+        max_depth: int = (
+            options.get("maxDepth", -1) if options.get("recurse", False) else 1
+        )
+        result: List[Dict[str, Any]] = []
+        stack: List[Tuple[str, int]] = [(base, 1)]
+        while stack:
+            directory, depth = stack.pop()
+            try:
+                entries = sorted(os.scandir(directory), key=lambda e: e.name)
+            except OSError as e:
+                logger.warning(f"Could not scan {directory}: {e}")
+                continue
+            for entry in entries:
+                is_dir = entry.is_dir()
+                if not is_dir:
+                    if extensions and not entry.name.lower().endswith(extensions):
+                        continue
+                    if SAMPLE_RE.search(entry.path.replace(os.sep, "/")):
+                        continue
+                stat = entry.stat()
+                if is_dir and SAMPLE_RE.search(entry.name + "/"):
+                    continue
+                result.append(self.to_item(entry.path, stat, is_dir))
+                if is_dir and (max_depth < 0 or depth < max_depth):
+                    stack.append((entry.path, depth + 1))
+        # Parents have to come before their children, like rclone lists them
+        result.sort(key=lambda item: item["Path"].count("/"))
+        return result
+
+    def rc_stat(self, path: str) -> Optional[Dict[str, Any]]:
+        full_path = self.local_path(path)
+        if full_path is None or not os.path.exists(full_path):
+            return None
+        return self.to_item(full_path, os.stat(full_path), os.path.isdir(full_path))
+
+    def scan_filters(self, extensions: Tuple[str, ...]) -> Dict[str, Any]:
+        return {"extensions": extensions}
+
+    def rc_conf(self) -> Dict[str, Any]:
+        return {"type": "local", "token": {}}
+
+    def rc_serve(self) -> Optional[str]:
+        return None
+
+    def rc_vfs_refresh(self, dirs: List[str]):
+        return
+
+    def cancel_jobs(self):
+        return
+
+    def close(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
+    def stream(self, path: str):
+        return self.local_path(path)
+
+    def thumbnail(self, id) -> Optional[str]:
+        return ""
+
+
+class InotifyWatcher:
+    """Follow a local category with inotify and upsert what changed
+
+    Events are collected until the tree has been quiet for
+    LOCAL_WATCH_DEBOUNCE seconds, then handed to the ingestion API.
+    """
+
+    def __init__(self, api: LocalAPI):
+        self.api: LocalAPI = api
+        self.fd: int = -1
+        self.watches: Dict[int, str] = {}
+        self.pending: Dict[str, bool] = {}
+        self.stopped: Event = Event()
+        self.libc = None
+
+    def start(self):
+        if not os.path.isdir(self.api.root):
+            logger.warning(f"Local category path {self.api.root} does not exist")
+            return
+        try:
+            self.libc = ctypes.CDLL(
+                ctypes.util.find_library("c") or "libc.so.6", use_errno=True
+            )
+            self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            self.fd = -1
+        if self.fd < 0:
+            logger.warning(
+                f"inotify is not available, {self.api.root} will not be watched"
+            )
+            return
+        self.add_tree(self.api.root)
+        Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def add_watch(self, path: str):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            logger.warning(f"Could not watch {path}: errno {ctypes.get_errno()}")
+            return
+        self.watches[wd] = path
+
+    def add_tree(self, path: str):
+        self.add_watch(path)
+        for root, dirs, _ in os.walk(path):
+            for name in dirs:
+                self.add_watch(os.path.join(root, name))
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                ready, _, _ = select.select(
+                    [self.fd], [], [], settings.LOCAL_WATCH_DEBOUNCE
+                )
+                if ready:
+                    self.read_events(os.read(self.fd, 64 * 1024))
+                elif self.pending:
+                    self.flush()
+        finally:
+            os.close(self.fd)
+
+    def read_events(self, buffer: bytes):
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buffer):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(buffer[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, only a rescan of the category is safe
+                from app.core.cron import fetch_metadata
+
+                logger.warning(f"inotify queue overflow for {self.api.root}")
+                self.pending.clear()
+                Thread(
+                    target=fetch_metadata, args=([self.api.index],), daemon=True
+                ).start()
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None or not name:
+                continue
+            full_path = os.path.join(directory, name)
+            path = os.path.relpath(full_path, self.api.root).replace(os.sep, "/")
+            if mask & (IN_CREATE | IN_MOVED_TO) and mask & IN_ISDIR:
+                self.add_tree(full_path)
+            if mask & (IN_DELETE | IN_MOVED_FROM | IN_DELETE_SELF):
+                self.pending[path] = False
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) or (
+                mask & IN_CREATE and mask & IN_ISDIR
+            ):
+                self.pending[path] = True
+
+    def flush(self):
+        from app.core.cron import ingest_paths, remove_paths
+
+        upserts = [path for path, exists in self.pending.items() if exists]
+        removals = [path for path, exists in self.pending.items() if not exists]
+        self.pending = {}
+        try:
+            if removals:
+                remove_paths(self.api.index, removals)
+            if upserts:
+                ingest_paths(self.api.index, upserts)
+        except Exception as e:
+            logger.error(f"Could not apply changes from {self.api.root}: {e}")
@@ -1,7 +1,12 @@
 import certifi
+from app import logger
+from threading import RLock
 from croniter import croniter
 from datetime import datetime, timezone
-from pymongo import TEXT, UpdateOne, MongoClient
+from pymongo.errors import PyMongoError
+from pymongo.collection import Collection
+from typing import Dict, List, Tuple, Optional
+from pymongo import TEXT, ASCENDING, DESCENDING, UpdateOne, MongoClient
 
 
 class MongoDB:
@@ -26,7 +31,13 @@ class MongoDB:
         self.movies_cache_col = self.metadata["movies_cache"]
         self.series_col = self.metadata["series"]
         self.series_cache_col = self.metadata["series_cache"]
+        self.tmdb_cache_col = self.metadata["tmdb_cache"]
+        self.identify_cache_col = self.metadata["identify_cache"]
 
+        self.changed_categories: Optional[List[int]] = None
+        # Held by rebuilds and by every writer of the metadata collections,
+        # whose changes would otherwise be lost when the shadows are swapped
+        self.metadata_lock = RLock()
         self.config = {
             "app": {},
             "auth0": {},
@@ -93,6 +104,34 @@ class MongoDB:
         self.is_series_cache_init = result["is_series_cache_init"]
         return result["is_series_cache_init"]
 
+    def get_metadata_swap(self) -> Optional[List[List[str]]]:
+        result = self.other_col.find_one({"metadata_swap": {"$exists": True}}) or {
+            "metadata_swap": None
+        }
+        return result["metadata_swap"]
+
+    def set_metadata_swap(self, pending: Optional[List[List[str]]]):
+        self.other_col.update_one(
+            {"metadata_swap": {"$exists": True}},
+            {"$set": {"metadata_swap": pending}},
+            upsert=True,
+        )
+
+    def get_export_checkpoint(self, data_type: str) -> Optional[dict]:
+        key = f"{data_type}_export_checkpoint"
+        result = self.other_col.find_one({key: {"$exists": True}}) or {key: None}
+        return result[key]
+
+    def get_export_synced(self, data_type: str) -> Optional[str]:
+        key = f"{data_type}_export_synced"
+        result = self.other_col.find_one({key: {"$exists": True}}) or {key: None}
+        return result[key]
+
+    def get_changes_polled(self, data_type: str) -> Optional[datetime]:
+        key = f"{data_type}_changes_polled"
+        result = self.other_col.find_one({key: {"$exists": True}}) or {key: None}
+        return result[key]
+
     def get_is_build_time(self) -> bool:
         build_config = self.config_col.find_one({"build": {"$exists": True}}) or {
             "build": {"cron": "*/120 * * * *"}
@@ -134,6 +173,7 @@ class MongoDB:
     def set_config(self, data: dict) -> int:
         from app.core import build_config
 
+        metadata_was_init: bool = self.is_metadata_init
         bulk_action: list = []
         config_app: dict = data.get("app", {})
         config_auth0: dict = data.get("auth0", {})
@@ -164,9 +204,13 @@ class MongoDB:
         self.set_is_config_init(True)
 
         if self.is_metadata_init is False:
-            from main import rclone_setup
+            from main import rclone, rclone_setup, rclone_update
 
-            rclone_setup(self.config["categories"])
+            if metadata_was_init and len(rclone) > 0:
+                self.changed_categories = rclone_update(self.config["categories"])
+            else:
+                rclone_setup(self.config["categories"])
+                self.changed_categories = None
             return 2
         return 1
 
@@ -196,18 +240,24 @@ class MongoDB:
         return update_action
 
     def set_categories(self, data: list):
+        from app.core.rclone import streaming_overrides
+
         update_data: list = []
         for item in data:
             update_data.append(
                 {
                     "drive_id": item.get("drive_id"),
                     "id": item.get("id"),
+                    "path": item.get("path"),
                     "name": item.get("name"),
                     "type": item.get("type", "movies"),
                     "provider": item.get("provider"),
                     "language": item.get("language", "en"),
                     "adult": item.get("adult", False),
                     "anime": item.get("anime", False),
+                    "shard": item.get("shard"),
+                    "min_size": item.get("min_size"),
+                    "streaming": streaming_overrides(item),
                 }
             )
         update_action: UpdateOne = UpdateOne(
@@ -259,6 +309,147 @@ class MongoDB:
         self.config["rclone"] = update_data
         return update_action
 
+    def delete_metadata(self, rclone_indexes: List[int]):
+        self.movies_col.delete_many({"rclone_index": {"$in": rclone_indexes}})
+        self.series_col.delete_many({"rclone_index": {"$in": rclone_indexes}})
+
+    def reindex_metadata(self, mapping: Dict[int, int]):
+        """Move metadata to new rclone indexes after categories were reordered
+
+        Args:
+            mapping (dict): Old rclone index to new rclone index
+        """
+        # Go through temporary negative indexes so a move never lands
+        # on documents that still have to be moved themselves
+        for old, new in mapping.items():
+            temporary = -new - 1
+            self.movies_col.update_many(
+                {"rclone_index": old},
+                [
+                    {
+                        "$set": {
+                            "rclone_index": temporary,
+                            "thumbnail_path": {
+                                "$replaceOne": {
+                                    "input": "$thumbnail_path",
+                                    "find": f"/thumbnail/{old}/",
+                                    "replacement": f"/thumbnail/{new}/",
+                                }
+                            },
+                        }
+                    }
+                ],
+            )
+            self.series_col.update_many(
+                {"rclone_index": old}, {"$set": {"rclone_index": temporary}}
+            )
+        for new in mapping.values():
+            for col in (self.movies_col, self.series_col):
+                col.update_many(
+                    {"rclone_index": -new - 1}, {"$set": {"rclone_index": new}}
+                )
+
+    def create_metadata_indexes(self, movies_col: Collection, series_col: Collection):
+        """Create the indexes the metadata is written and queried with"""
+        movies_col.create_index(
+            [("rclone_index", ASCENDING), ("tmdb_id", ASCENDING)], name="rclone_tmdb_id"
+        )
+        series_col.create_index(
+            [("rclone_index", ASCENDING), ("path", ASCENDING)], name="rclone_path"
+        )
+        movies_col.create_index([("title", TEXT)], name="title")
+        series_col.create_index([("title", TEXT)], name="title")
+        series_col.create_index(
+            [("seasons.episodes.modified_time", DESCENDING)], name="modified_time"
+        )
+
+    def shadow_metadata(
+        self, rclone_indexes: Optional[List[int]] = None
+    ) -> Tuple[Collection, Collection]:
+        """Prepare empty, fully indexed copies of the metadata collections
+
+        When only some categories are rebuilt, the documents of the other
+        ones are copied over first so the copies hold a whole library.
+
+        Args:
+            rclone_indexes (list): The categories about to be rebuilt
+
+        Returns:
+            tuple: The shadow movies and series collections
+        """
+        # Shadows of an interrupted swap hold the newer library
+        self.finish_metadata_swap()
+        shadows = []
+        for col in (self.movies_col, self.series_col):
+            shadow = self.metadata[col.name + "_shadow"]
+            # Left behind by a rebuild that failed
+            shadow.drop()
+            if rclone_indexes is not None:
+                col.aggregate(
+                    [
+                        {"$match": {"rclone_index": {"$nin": rclone_indexes}}},
+                        {"$out": shadow.name},
+                    ]
+                )
+            shadows.append(shadow)
+        self.create_metadata_indexes(*shadows)
+        return shadows[0], shadows[1]
+
+    def swap_metadata(self, movies_shadow: Collection, series_shadow: Collection):
+        """Replace the live metadata collections with their rebuilt shadows
+
+        Each rename swaps a collection and its indexes at once, so readers
+        go straight from the old library to the new one. The swap is
+        recorded before the first rename; if one fails, the library stays
+        split until finish_metadata_swap completes it.
+        """
+        self.set_metadata_swap(
+            [
+                [movies_shadow.name, self.movies_col.name],
+                [series_shadow.name, self.series_col.name],
+            ]
+        )
+        self.finish_metadata_swap()
+
+    def finish_metadata_swap(self):
+        """Rename the shadows a recorded swap has not renamed yet"""
+        pending = self.get_metadata_swap()
+        if not pending:
+            return
+        names = self.metadata.list_collection_names()
+        for shadow, live in pending:
+            if shadow not in names:
+                continue
+            try:
+                self.metadata[shadow].rename(live, dropTarget=True)
+            except PyMongoError as e:
+                logger.error(
+                    f"Could not rename {shadow} to {live}, the library is split "
+                    "between two rebuilds until the next startup or rebuild "
+                    f"finishes the swap {pending}: {e}"
+                )
+                raise
+            logger.info(f"Swapped {shadow} in as {live}")
+        self.set_metadata_swap(None)
+
+    def set_export_checkpoint(self, data_type: str, checkpoint: Optional[dict]):
+        key = f"{data_type}_export_checkpoint"
+        self.other_col.update_one(
+            {key: {"$exists": True}}, {"$set": {key: checkpoint}}, upsert=True
+        )
+
+    def set_export_synced(self, data_type: str, date: str):
+        key = f"{data_type}_export_synced"
+        self.other_col.update_one(
+            {key: {"$exists": True}}, {"$set": {key: date}}, upsert=True
+        )
+
+    def set_changes_polled(self, data_type: str, polled_at: datetime):
+        key = f"{data_type}_changes_polled"
+        self.other_col.update_one(
+            {key: {"$exists": True}}, {"$set": {key: polled_at}}, upsert=True
+        )
+
     def set_is_config_init(self, is_config_init: bool):
         if is_config_init != self.is_config_init:
             self.other_col.update_one(
@@ -289,7 +480,7 @@ class MongoDB:
                 {"$set": {"is_movies_cache_init": is_movies_cache_init}},
                 upsert=True,
             )
-            self.is_metadata_init = is_movies_cache_init
+            self.is_movies_cache_init = is_movies_cache_init
         return
 
     def set_is_series_cache_init(self, is_series_cache_init: bool):
@@ -0,0 +1,263 @@
+import httpx
+import random
+import asyncio
+import requests
+from app import logger
+from collections import deque
+from threading import Lock
+from app.settings import settings
+from time import sleep, monotonic, perf_counter
+from typing import Any, Dict, Tuple, Callable, Optional
+
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+TRANSPORT_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    httpx.TransportError,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+class CircuitOpenError(ConnectionError):
+    """A call was refused because its dependency is considered down"""
+
+
+class CircuitBreaker:
+    """Stop calling a dependency after repeated failures
+
+    After `threshold` consecutive failures the breaker opens and every
+    call fails fast for `reset_timeout` seconds. Then a single trial call
+    is let through (half open); its outcome closes or reopens the breaker.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold: int = threshold
+        self.reset_timeout: float = reset_timeout
+        self.failures: int = 0
+        self.opened_at: Optional[float] = None
+        self.trial: bool = False
+        self.lock: Lock = Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.trial:
+                self.trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def release(self):
+        """Give the trial back after a call that ended without an outcome"""
+        with self.lock:
+            self.trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.threshold:
+                self.opened_at = monotonic()
+            self.trial = False
+
+
+class Dependency:
+    """Timeouts, retries and a circuit breaker for one outbound dependency
+
+    Args:
+        name (str): Shown in logs and metrics
+        timeout (tuple): Connect and read timeouts in seconds
+        retries (int): Extra attempts for idempotent calls
+        failure_statuses (tuple): HTTP statuses that count as a failure
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timeout: Tuple[float, float],
+        retries: int,
+        failure_statuses: Tuple[int, ...] = (500, 502, 503, 504),
+    ):
+        self.name: str = name
+        self.timeout: Tuple[float, float] = timeout
+        self.retries: int = retries
+        self.failure_statuses: Tuple[int, ...] = failure_statuses
+        self.breaker: CircuitBreaker = CircuitBreaker(
+            settings.OUTBOUND_BREAKER_THRESHOLD, settings.OUTBOUND_BREAKER_RESET
+        )
+        self.session: requests.Session = requests.Session()
+        self.calls: int = 0
+        self.failures: int = 0
+        self.retried: int = 0
+        self.rejected: int = 0
+        self.latencies: deque = deque(maxlen=500)
+
+    @property
+    def httpx_timeout(self) -> httpx.Timeout:
+        connect, read = self.timeout
+        return httpx.Timeout(read, connect=connect, pool=None)
+
+    def backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, min(settings.OUTBOUND_BACKOFF * 2**attempt, 10))
+
+    def failed(self, result: Any) -> bool:
+        return getattr(result, "status_code", None) in self.failure_statuses
+
+    def check(self):
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise CircuitOpenError(f"{self.name} is unavailable, not calling it")
+
+    def record(self, started: float, failed: bool):
+        self.latencies.append(perf_counter() - started)
+        self.calls += 1
+        if failed:
+            self.failures += 1
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def call(self, fn: Callable, *args, idempotent: bool = True, **kwargs) -> Any:
+        """Call a blocking function that talks to this dependency
+
+        Transport errors and failure statuses are retried with jittered
+        backoff if the call is idempotent; the last error is raised, or
+        the last failed response returned. Any other error is a failure
+        that is raised at once, and a cancelled call only gives back the
+        half open trial it may hold.
+        """
+        attempts = self.retries + 1 if idempotent else 1
+        for attempt in range(attempts):
+            self.check()
+            started = perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except TRANSPORT_ERRORS as e:
+                self.record(started, True)
+                if attempt == attempts - 1:
+                    raise
+                logger.debug(f"{self.name} call failed ({e}), retrying")
+            except Exception:
+                self.record(started, True)
+                raise
+            except BaseException:
+                # Cancelled, which says nothing about the dependency
+                self.breaker.release()
+                raise
+            else:
+                failed = self.failed(result)
+                self.record(started, failed)
+                if not failed or attempt == attempts - 1:
+                    return result
+                if hasattr(result, "close"):
+                    result.close()
+            self.retried += 1
+            sleep(self.backoff(attempt))
+
+    async def acall(
+        self, fn: Callable, *args, idempotent: bool = True, **kwargs
+    ) -> Any:
+        """The async version of call, for coroutine functions"""
+        attempts = self.retries + 1 if idempotent else 1
+        for attempt in range(attempts):
+            self.check()
+            started = perf_counter()
+            try:
+                result = await fn(*args, **kwargs)
+            except TRANSPORT_ERRORS as e:
+                self.record(started, True)
+                if attempt == attempts - 1:
+                    raise
+                logger.debug(f"{self.name} call failed ({e}), retrying")
+            except Exception:
+                self.record(started, True)
+                raise
+            except BaseException:
+                # Cancelled, which says nothing about the dependency
+                self.breaker.release()
+                raise
+            else:
+                failed = self.failed(result)
+                self.record(started, failed)
+                if not failed or attempt == attempts - 1:
+                    return result
+                if hasattr(result, "aclose"):
+                    await result.aclose()
+            self.retried += 1
+            await asyncio.sleep(self.backoff(attempt))
+
+    def request(
+        self, method: str, url: str, idempotent: Optional[bool] = None, **kwargs
+    ) -> requests.Response:
+        """Send a request with the pooled requests session of this dependency"""
+        kwargs.setdefault("timeout", self.timeout)
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        return self.call(
+            self.session.request, method, url, idempotent=idempotent, **kwargs
+        )
+
+    def metrics(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+
+        def percentile(p: float) -> float:
+            return round(latencies[int((len(latencies) - 1) * p)] * 1000, 2)
+
+        return {
+            "state": self.breaker.state,
+            "calls": self.calls,
+            "failures": self.failures,
+            "retries": self.retried,
+            "rejected": self.rejected,
+            "latency_ms": {
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "max": percentile(1),
+            }
+            if latencies
+            else None,
+        }
+
+
+# Connect / read timeouts and retries of every kind of dependency
+DEPENDENCIES: Dict[str, Dict[str, Any]] = {
+    "tmdb": {"timeout": (5, 30), "retries": 3},
+    "tmdb_export": {"timeout": (10, 120), "retries": 2},
+    "images": {"timeout": (5, 30), "retries": 2},
+    "auth0": {"timeout": (5, 15), "retries": 2},
+    # rc commands answer errors with a 500, those are not outages
+    "rclone": {"timeout": (3, 60), "retries": 2, "failure_statuses": ()},
+    "stream": {"timeout": (5, 60), "retries": 1},
+}
+registry: Dict[str, Dependency] = {}
+registry_lock = Lock()
+
+
+def outbound(name: str) -> Dependency:
+    """Get the dependency of a name, e.g. "tmdb" or "rclone-0" for a shard"""
+    with registry_lock:
+        if name not in registry:
+            options = DEPENDENCIES[name.split("-")[0]]
+            registry[name] = Dependency(name, **options)
+        return registry[name]
+
+
+def outbound_metrics() -> Dict[str, Dict[str, Any]]:
+    return {name: dependency.metrics() for name, dependency in registry.items()}
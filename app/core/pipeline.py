@@ -0,0 +1,460 @@
+import asyncio
+import hashlib
+import calendar
+from app import logger
+from app.core.tmdb import TMDB
+from app.settings import settings
+from collections import defaultdict
+from datetime import datetime, timezone
+from dateutil.parser import isoparse
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
+from app.utils.process_pool import map_batches
+from typing import Any, Dict, List, Tuple, Union, Optional
+from app.utils.data import (
+    built,
+    identify,
+    index_hashes,
+    build_movies,
+    build_series,
+    find_duplicates,
+    fetch_movie_details,
+    fetch_series_details,
+)
+
+
+MOVIE_FILE_FIELDS = (
+    "id",
+    "file_name",
+    "path",
+    "parent",
+    "modified_time",
+    "mime_type",
+    "size",
+    "hashes",
+    "subtitles",
+)
+
+
+def file_values(doc: Dict[str, Any], field: str) -> List[Any]:
+    """Get a per-file field of a movie document, padded to its number of files"""
+    values = list(doc.get(field) or [])
+    return values + [None] * (len(doc["id"]) - len(values))
+
+
+def epoch_ms(value: Any) -> Optional[int]:
+    """A scanned or stored modification time in milliseconds
+
+    MongoDB keeps datetimes as naive UTC with millisecond precision, so
+    both sides are brought down to that before they are compared.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = isoparse(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return calendar.timegm(value.utctimetuple()) * 1000 + value.microsecond // 1000
+
+
+def file_signature(record: Dict[str, Any]) -> Tuple[Any, ...]:
+    """What a file has to keep for its metadata to stay valid
+
+    Renames change the path, rewrites the time or the size, and added or
+    removed sidecars the subtitles.
+    """
+    return (
+        record.get("path"),
+        epoch_ms(record.get("modified_time")),
+        record.get("size", -1),
+        tuple(sorted(subtitle["id"] for subtitle in record.get("subtitles") or [])),
+    )
+
+
+def folder_signature(serie: Dict[str, Any]) -> str:
+    """A digest of every episode of a scanned series directory"""
+    files = sorted(
+        (episode["id"], *file_signature(episode))
+        for season in serie["seasons"].values()
+        for episode in season["episodes"]
+    )
+    return hashlib.sha1(repr(files).encode()).hexdigest()
+
+
+def season_signatures(serie: Dict[str, Any]) -> Dict[str, str]:
+    """A digest of the episodes of every season of a scanned series"""
+    return {
+        key: hashlib.sha1(
+            repr(
+                sorted(
+                    (episode["id"], *file_signature(episode))
+                    for episode in season["episodes"]
+                )
+            ).encode()
+        ).hexdigest()
+        for key, season in serie["seasons"].items()
+    }
+
+
+def diff_movies(
+    movies_col, rclone_index: int, items: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """Drop removed and modified files from the stored movies of a category
+
+    Returns:
+        list: The scanned files that are new or modified
+    """
+    scanned = {item["id"]: item for item in items}
+    unchanged = set()
+    bulk_action = []
+    for doc in movies_col.find(
+        {"rclone_index": rclone_index}, {field: 1 for field in MOVIE_FILE_FIELDS}
+    ):
+        files = {field: file_values(doc, field) for field in MOVIE_FILE_FIELDS}
+        keep = [
+            i
+            for i, file_id in enumerate(files["id"])
+            if file_id in scanned
+            and file_signature(scanned[file_id])
+            == file_signature({field: files[field][i] for field in files})
+        ]
+        unchanged.update(files["id"][i] for i in keep)
+        if len(keep) == len(files["id"]):
+            continue
+        if len(keep) == 0:
+            bulk_action.append(DeleteOne({"_id": doc["_id"]}))
+            continue
+        files = {field: [values[i] for i in keep] for field, values in files.items()}
+        files["number_of_files"] = len(keep)
+        bulk_action.append(UpdateOne({"_id": doc["_id"]}, {"$set": files}))
+    if len(bulk_action) > 0:
+        movies_col.bulk_write(bulk_action, ordered=False)
+    changed = [item for item in items if item["id"] not in unchanged]
+    logger.info(
+        f"Category {rclone_index}: {len(unchanged)} unchanged movie files, "
+        f"{len(changed)} new or modified, {len(bulk_action)} movies trimmed"
+    )
+    return changed
+
+
+def diff_series(
+    series_col, rclone_index: int, items: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """Drop the stored series of a category whose directory is gone
+
+    A stored series whose seasons changed comes back with only those
+    seasons and a "stored" key, so just they are fetched and written
+    into the stored document. The others are built from scratch.
+
+    Returns:
+        list: The scanned series that are new or have changed episodes
+    """
+    stored = {
+        doc["path"]: doc
+        for doc in series_col.find(
+            {"rclone_index": rclone_index},
+            {"path": 1, "tmdb_id": 1, "scan_signature": 1, "season_signatures": 1},
+        )
+    }
+    scanned = {serie["path"] for serie in items}
+    removed = [path for path in stored if path not in scanned]
+    if len(removed) > 0:
+        series_col.delete_many({"rclone_index": rclone_index, "path": {"$in": removed}})
+    changed = []
+    patched = 0
+    for serie in items:
+        doc = stored.get(serie["path"])
+        signature = folder_signature(serie)
+        if doc is not None and doc.get("scan_signature") == signature:
+            continue
+        # Stored before seasons had their own signatures
+        if doc is None or doc.get("season_signatures") is None:
+            changed.append(serie)
+            continue
+        signatures = season_signatures(serie)
+        seasons = {
+            key: season
+            for key, season in serie["seasons"].items()
+            if doc["season_signatures"].get(key) != signatures[key]
+        }
+        changed.append(
+            {
+                **serie,
+                "seasons": seasons,
+                "stored": {
+                    "_id": doc["_id"],
+                    "tmdb_id": doc["tmdb_id"],
+                    "seasons": list(seasons),
+                    "removed": [
+                        key for key in doc["season_signatures"] if key not in signatures
+                    ],
+                    "scan_signature": signature,
+                    "season_signatures": signatures,
+                },
+            }
+        )
+        patched += 1
+    logger.info(
+        f"Category {rclone_index}: {len(items) - len(changed)} unchanged series, "
+        f"{len(changed) - patched} new or rebuilt, {patched} with changed seasons, "
+        f"{len(removed)} removed"
+    )
+    return changed
+
+
+def season_update(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """The update writing the changed seasons of a series into the stored one"""
+    stored = doc["stored"]
+    update: Dict[str, Any] = {
+        "$set": {
+            **{f"seasons.{key}": season for key, season in doc["seasons"].items()},
+            **{field: doc[field] for field in ("id", "file_name", "parent")},
+            "modified_time": doc["modified_time"],
+            "scan_signature": stored["scan_signature"],
+            "season_signatures": stored["season_signatures"],
+        }
+    }
+    # Seasons gone from disk, and changed ones TMDB no longer knows
+    unset = stored["removed"] + [
+        key for key in stored["seasons"] if key not in doc["seasons"]
+    ]
+    if len(unset) > 0:
+        update["$unset"] = {f"seasons.{key}": "" for key in unset}
+    return update
+
+
+def movie_update(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """The upsert adding the files of a movie document to the stored one"""
+    return {
+        "$setOnInsert": {
+            field: value
+            for field, value in doc.items()
+            if field not in MOVIE_FILE_FIELDS and field != "number_of_files"
+        },
+        "$push": {field: {"$each": doc[field]} for field in MOVIE_FILE_FIELDS},
+        "$inc": {"number_of_files": doc["number_of_files"]},
+    }
+
+
+def merge_movie_update(update: Dict[str, Any], doc: Dict[str, Any]):
+    for field in MOVIE_FILE_FIELDS:
+        update["$push"][field]["$each"].extend(doc[field])
+    update["$inc"]["number_of_files"] += doc["number_of_files"]
+
+
+async def list_stage(
+    rclone_indexes: Optional[List[int]],
+    output: asyncio.Queue,
+    movies_col=None,
+    series_col=None,
+) -> List[Dict[str, Any]]:
+    """Scan the categories and queue their items in batches
+
+    Given the collections, only the items that differ from the stored
+    documents are queued, after the stale files have been dropped.
+
+    Returns:
+        dict: The (category, path) pairs of the scanned files by content
+    """
+    from main import rclone
+
+    hashes: Dict[tuple, List[Tuple[int, str]]] = defaultdict(list)
+    for key, category in list(rclone.items()):
+        if rclone_indexes is not None and key not in rclone_indexes:
+            continue
+        data_type = category.data.get("type", "movies")
+        logger.info("Generating metadata: " + category.data.get("name"))
+        logger.debug("Category type: " + data_type)
+        if data_type == "series":
+            items = await asyncio.to_thread(category.fetch_series)
+            for serie in items:
+                for season in serie["seasons"].values():
+                    index_hashes(hashes, season["episodes"], key)
+            if series_col is not None:
+                items = await asyncio.to_thread(diff_series, series_col, key, items)
+        else:
+            items = await asyncio.to_thread(category.fetch_movies)
+            # Files of one movie usually share a directory, keep them together
+            items.sort(key=lambda item: item["path"])
+            index_hashes(hashes, items, key)
+            if movies_col is not None:
+                items = await asyncio.to_thread(diff_movies, movies_col, key, items)
+        size = settings.METADATA_BATCH
+        for i in range(0, len(items), size):
+            await output.put(
+                {
+                    "rclone_index": key,
+                    "type": data_type,
+                    "language": category.data.get("language"),
+                    "items": items[i : i + size],
+                }
+            )
+    await output.put(None)
+    return hashes
+
+
+async def identify_stage(tmdb: TMDB, source: asyncio.Queue, output: asyncio.Queue):
+    while (batch := await source.get()) is not None:
+        # Series updated in place keep the TMDB ID they were stored with
+        pending = [item for item in batch["items"] if "stored" not in item]
+        found = iter(await identify(tmdb, pending, batch["type"]) if pending else [])
+        batch["tmdb_ids"] = [
+            item["stored"]["tmdb_id"] if "stored" in item else next(found)
+            for item in batch["items"]
+        ]
+        await output.put(batch)
+    await output.put(None)
+
+
+async def details_stage(tmdb: TMDB, source: asyncio.Queue, output: asyncio.Queue):
+    while (batch := await source.get()) is not None:
+        fetch = (
+            fetch_series_details if batch["type"] == "series" else fetch_movie_details
+        )
+        batch["details"] = await fetch(
+            tmdb, batch.pop("items"), batch.pop("tmdb_ids"), batch["language"]
+        )
+        await output.put(batch)
+    await output.put(None)
+
+
+async def build_stage(source: asyncio.Queue, output: asyncio.Queue):
+    while (batch := await source.get()) is not None:
+        build = build_series if batch["type"] == "series" else build_movies
+        details = batch.pop("details")
+        docs = built(details, await map_batches(build, details, batch["rclone_index"]))
+        if batch["type"] == "series":
+            # Lets the next incremental rebuild skip the unchanged ones
+            for drive_meta, doc in docs:
+                if "stored" in drive_meta:
+                    doc["stored"] = drive_meta["stored"]
+                    continue
+                doc["scan_signature"] = folder_signature(drive_meta)
+                doc["season_signatures"] = season_signatures(drive_meta)
+        batch["docs"] = [doc for _, doc in docs]
+        refreshed_at = datetime.now(timezone.utc)
+        for doc in batch["docs"]:
+            doc["refreshed_at"] = refreshed_at
+        await output.put(batch)
+    await output.put(None)
+
+
+async def write_stage(
+    source: asyncio.Queue, movies_col, series_col, written: Dict[str, int]
+):
+    """Write the built documents in unordered bulk batches
+
+    Movies are upserted by category and TMDB ID, so files of one movie
+    found in different batches end up in the same document. Updates of
+    the same movie are merged before a batch is written, as unordered
+    upserts of one key could otherwise race each other. New files of a
+    stored movie are pushed onto it the same way. A new series replaces
+    any stored document of its directory, and one with changed seasons
+    only has those set in the stored document.
+    """
+    movies: Dict[Tuple[int, int], Dict[str, Any]] = {}
+    series: List[Union[ReplaceOne, UpdateOne]] = []
+
+    async def flush():
+        if movies:
+            await asyncio.to_thread(
+                movies_col.bulk_write,
+                [
+                    UpdateOne(
+                        {"rclone_index": rclone_index, "tmdb_id": tmdb_id},
+                        update,
+                        upsert=True,
+                    )
+                    for (rclone_index, tmdb_id), update in movies.items()
+                ],
+                ordered=False,
+            )
+        if series:
+            await asyncio.to_thread(series_col.bulk_write, series, ordered=False)
+        written["movies"] += len(movies)
+        written["series"] += len(series)
+        logger.debug(f"Wrote {written['movies']} movies and {written['series']} series")
+        movies.clear()
+        series.clear()
+
+    while (batch := await source.get()) is not None:
+        for doc in batch["docs"]:
+            if batch["type"] == "series" and "stored" in doc:
+                series.append(
+                    UpdateOne({"_id": doc["stored"]["_id"]}, season_update(doc))
+                )
+                continue
+            if batch["type"] == "series":
+                series.append(
+                    ReplaceOne(
+                        {"rclone_index": doc["rclone_index"], "path": doc["path"]},
+                        doc,
+                        upsert=True,
+                    )
+                )
+                continue
+            key = (doc["rclone_index"], doc["tmdb_id"])
+            if key in movies:
+                merge_movie_update(movies[key], doc)
+            else:
+                movies[key] = movie_update(doc)
+        if len(movies) + len(series) >= settings.METADATA_WRITE_BATCH:
+            await flush()
+    await flush()
+
+
+async def rebuild_metadata(
+    movies_col,
+    series_col,
+    rclone_indexes: Optional[List[int]] = None,
+    incremental: bool = False,
+) -> Dict[str, int]:
+    """Scan, identify, fetch, build and write the library as a stream
+
+    Every stage works on METADATA_BATCH items at a time and hands them to
+    the next one through a queue holding at most METADATA_QUEUE_SIZE
+    batches, and documents are written while later batches are still being
+    identified. Besides those batches, only the listing of the category
+    being scanned and a small content key per file are held, so memory
+    follows the largest category rather than the whole library. Titles
+    TMDB does not know or whose documents fail are logged and skipped; if
+    TMDB cannot be reached, the rebuild stops instead.
+
+    Args:
+        movies_col: The collection movie documents are written to
+        series_col: The collection series documents are written to
+        rclone_indexes (list): Only rebuild these categories
+        incremental (bool): Compare the scan with the stored documents and
+            only process new, removed and modified files
+
+    Returns:
+        dict: The number of movie and series documents written
+    """
+    from main import mongo
+
+    written = {"movies": 0, "series": 0}
+    stored = (movies_col, series_col) if incremental else ()
+    queues = [asyncio.Queue(settings.METADATA_QUEUE_SIZE) for _ in range(4)]
+    async with TMDB(api_key=mongo.config["tmdb"]["api_key"]) as tmdb:
+        # Each stage ends the stream of the next one when it is done; if
+        # one fails, every other stage is cancelled instead
+        tasks = [
+            asyncio.create_task(list_stage(rclone_indexes, queues[0], *stored)),
+            asyncio.create_task(identify_stage(tmdb, queues[0], queues[1])),
+            asyncio.create_task(details_stage(tmdb, queues[1], queues[2])),
+            asyncio.create_task(build_stage(queues[2], queues[3])),
+            asyncio.create_task(
+                write_stage(queues[3], movies_col, series_col, written)
+            ),
+        ]
+        try:
+            hashes, *_ = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+    for group in find_duplicates(hashes):
+        logger.info(
+            "Duplicate files: "
+            + ", ".join(f"[{rclone_index}] {path}" for rclone_index, path in group)
+        )
+    return written
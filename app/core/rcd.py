@@ -0,0 +1,187 @@
+import os
+import time
+import zlib
+import shlex
+import signal
+import ujson as json
+from app import logger
+from shutil import which
+from sys import platform
+from io import TextIOWrapper
+from threading import Thread
+from app.core.rclone import RCLONE
+from app.core.outbound import outbound
+from typing import Any, Dict, List, Callable, Optional
+from subprocess import PIPE, STDOUT, DEVNULL, Popen, TimeoutExpired, run
+
+
+class RCloneDaemon:
+    def __init__(self, index: int, port: int):
+        self.index: int = index
+        self.port: int = port
+        self.url: str = f"http://localhost:{port}"
+        self.process: Optional[Popen] = None
+
+    def kill(self):
+        """Stop the daemon, and anything else still holding its port
+
+        A daemon left over from an earlier run of the app is not ours to
+        wait on, so it is found by its port and signalled directly.
+        """
+        if self.is_alive():
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+        if platform in ["win32", "cygwin", "msys"]:
+            run(
+                shlex.split(
+                    f"powershell.exe Stop-Process -Id (Get-NetTCPConnection -LocalPort {self.port}).OwningProcess -Force"
+                ),
+                stdout=DEVNULL,
+                stderr=STDOUT,
+            )
+        elif platform in ["linux", "linux2", "darwin"]:
+            pids = self.port_pids()
+            for pid in pids:
+                logger.info(f"Killing process {pid} holding rclone port {self.port}")
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    continue
+            # The new daemon cannot bind before the port is released
+            deadline = time.monotonic() + 5
+            while pids and time.monotonic() < deadline:
+                time.sleep(0.1)
+                pids = self.port_pids()
+        else:
+            exit("Unsupported platform")
+
+    def port_pids(self) -> List[int]:
+        """The IDs of the processes listening on the port of the daemon"""
+        try:
+            result = run(
+                ["lsof", "-t", f"-iTCP:{self.port}", "-sTCP:LISTEN"],
+                stdout=PIPE,
+                stderr=DEVNULL,
+                text=True,
+            )
+        except FileNotFoundError:
+            logger.warning(f"lsof not found, cannot free rclone port {self.port}")
+            return []
+        return [int(pid) for pid in result.stdout.split() if pid.isdigit()]
+
+    def start(self):
+        rclone_bin = which("rclone")
+        self.process = Popen(
+            shlex.split(
+                f"{rclone_bin} rcd --rc-no-auth --rc-serve --rc-addr localhost:{self.port} --config rclone.conf --cache-dir cache/rclone",
+                posix=(platform not in ["win32", "cygwin", "msys"]),
+            ),
+            stdout=PIPE,
+            stderr=STDOUT,
+        )
+        output = TextIOWrapper(self.process.stdout, encoding="utf-8")
+        for line in output:
+            if "Serving remote control on" in line:
+                time.sleep(1)
+                break
+        # Keep reading so a full pipe never blocks the daemon
+        Thread(target=self.drain, args=(output,), daemon=True).start()
+
+    def drain(self, output: TextIOWrapper):
+        for line in output:
+            if "ERROR" in line:
+                logger.debug(f"rclone[{self.index}]: {line.rstrip()}")
+
+    def restart(self):
+        self.kill()
+        self.start()
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def rc(self, command: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        return (
+            outbound(f"rclone-{self.index}")
+            .request(
+                "POST",
+                "%s/%s" % (self.url, command),
+                data=json.dumps(data),
+                headers={"Content-Type": "application/json"},
+            )
+            .json()
+        )
+
+
+class RClonePool:
+    def __init__(self, size: int, base_port: int):
+        self.daemons: List[RCloneDaemon] = [
+            RCloneDaemon(i, base_port + i) for i in range(max(size, 1))
+        ]
+        self.on_restart: List[Callable[[int], Any]] = []
+        self.watcher: Optional[Thread] = None
+
+    def shard_for(self, category: Dict[str, Any]) -> int:
+        """Get the shard a category is assigned to
+
+        Args:
+            category (dict): The category settings
+
+        Returns:
+            int: The explicit "shard" of the category if valid,
+            otherwise a stable hash of its remote name
+        """
+        shard = category.get("shard")
+        if isinstance(shard, int) and 0 <= shard < len(self.daemons):
+            return shard
+        remote_id = category.get("id") or category.get("drive_id") or ""
+        remote_name = "".join(c for c in remote_id if c.isalnum())
+        return zlib.crc32(remote_name.encode("utf-8")) % len(self.daemons)
+
+    def set_remote(self, name: str, parameters: Dict[str, str], create: bool):
+        """Create or update a remote on every running shard
+
+        Every shard shares rclone.conf, so all of them must hold the same
+        remotes or the next config write from one shard would drop the others.
+        """
+        parameters = dict(parameters)
+        rc_data: Dict[str, Any] = {
+            "name": name,
+            "parameters": parameters,
+            "opt": {"nonInteractive": True, "obscure": False},
+        }
+        if create:
+            rc_data["type"] = parameters.pop("type")
+        else:
+            parameters.pop("type", None)
+        for daemon in self.daemons:
+            daemon.rc(RCLONE["createConfig" if create else "updateConfig"], rc_data)
+
+    def delete_remote(self, name: str):
+        for daemon in self.daemons:
+            daemon.rc(RCLONE["deleteConfig"], {"name": name})
+
+    def restart(self):
+        for daemon in self.daemons:
+            daemon.restart()
+        if self.watcher is None:
+            self.watcher = Thread(target=self.watch, daemon=True)
+            self.watcher.start()
+
+    def watch(self, interval: float = 5):
+        while True:
+            time.sleep(interval)
+            for daemon in self.daemons:
+                if daemon.process is None or daemon.is_alive():
+                    continue
+                logger.warning(f"rclone shard {daemon.index} exited. Restarting...")
+                try:
+                    daemon.start()
+                    for callback in self.on_restart:
+                        callback(daemon.index)
+                except Exception as e:
+                    logger.error(f"Could not restart rclone shard {daemon.index}: {e}")
@@ -1,154 +1,533 @@
 import re
-import requests
 import ujson as json
+from app import logger
 from httplib2 import Http
+from time import time, sleep
 from app.settings import settings
-from typing import Any, Dict, List, Optional
+from app.core.outbound import outbound
+from app.utils.subtitles import match_subtitles
+from typing import Any, Set, Dict, List, Tuple, Optional
 from oauth2client.client import GoogleCredentials
 
 
+STREAMING_PROFILES: Dict[str, Dict[str, Any]] = {
+    # Feature films: long sequential reads, so grow chunks aggressively
+    # and keep a deep read-ahead to absorb bitrate spikes.
+    "movies": {
+        "vfs_cache_mode": "full",
+        "vfs_cache_max_size": "20G",
+        "vfs_cache_max_age": "24h",
+        "vfs_read_chunk_size": "64M",
+        "vfs_read_chunk_size_limit": "2G",
+        "buffer_size": "32M",
+        "vfs_read_ahead": "256M",
+    },
+    # Episodes: smaller files with frequent seeks (intros, recaps), so
+    # start with small chunks to keep the first byte fast.
+    "series": {
+        "vfs_cache_mode": "full",
+        "vfs_cache_max_size": "10G",
+        "vfs_cache_max_age": "72h",
+        "vfs_read_chunk_size": "32M",
+        "vfs_read_chunk_size_limit": "512M",
+        "buffer_size": "16M",
+        "vfs_read_ahead": "128M",
+    },
+    "anime": {
+        "vfs_cache_mode": "full",
+        "vfs_cache_max_size": "10G",
+        "vfs_cache_max_age": "72h",
+        "vfs_read_chunk_size": "16M",
+        "vfs_read_chunk_size_limit": "256M",
+        "buffer_size": "16M",
+        "vfs_read_ahead": "64M",
+    },
+}
+
+
+VIDEO_EXTENSIONS = (
+    ".mp4",
+    ".mkv",
+    ".avi",
+    ".mov",
+    ".webm",
+    ".flv",
+    ".m4v",
+    ".wmv",
+    ".ts",
+    ".m2ts",
+    ".mpg",
+    ".mpeg",
+)
+SUBTITLE_EXTENSIONS = (".srt", ".vtt")
+# The category settings a library scan and its identification depend on
+CATEGORY_SCAN_FIELDS = (
+    "provider",
+    "id",
+    "drive_id",
+    "path",
+    "type",
+    "language",
+    "min_size",
+)
+SIZE_RE = re.compile(r"^(\d+(?:\.\d+)?)\s*([bkmgtp]?)i?b?$", flags=re.I)
+
+# Backends that can list a whole tree in a few calls (--fast-list)
+LISTR_PROVIDERS = ("gdrive",)
+
+# Hashes each backend stores alongside the object, so listing them is free
+HASH_TYPES: Dict[str, List[str]] = {
+    "gdrive": ["md5", "sha1"],
+    "onedrive": ["sha1", "quickxor"],
+    "sharepoint": ["quickxor"],
+}
+
+
+def default_streaming_profile(category: Dict[str, Any]) -> Dict[str, Any]:
+    """The streaming profile of a category type, before any overrides"""
+    if category.get("anime", False):
+        profile_name = "anime"
+    elif category.get("type", "movies") == "series":
+        profile_name = "series"
+    else:
+        profile_name = "movies"
+    return dict(STREAMING_PROFILES[profile_name])
+
+
+def streaming_overrides(category: Dict[str, Any]) -> Dict[str, Any]:
+    """The keys of category["streaming"] that differ from the defaults
+
+    Only these are stored, so a category follows its type and the shipped
+    defaults for everything it does not override.
+    """
+    streaming = category.get("streaming") or {}
+    # Categories saved by older versions hold a whole resolved profile
+    if streaming in STREAMING_PROFILES.values():
+        return {}
+    defaults = default_streaming_profile(category)
+    return {
+        key: value
+        for key, value in streaming.items()
+        if key in defaults and value is not None and value != defaults[key]
+    }
+
+
+def build_streaming_profile(category: Dict[str, Any]) -> Dict[str, Any]:
+    """Resolve the VFS streaming profile of a category
+
+    Args:
+        category (dict): The category settings
+
+    Returns:
+        dict: The default profile for the category type,
+        overridden by any known keys set in category["streaming"]
+    """
+    return {**default_streaming_profile(category), **streaming_overrides(category)}
+
+
+RCLONE: Dict[str, str] = {
+    "mkdir": "operations/mkdir",
+    "purge": "operations/purge",
+    "deleteFile": "operations/deletefile",
+    "createPublicLink": "operations/publiclink",
+    "stats": "core/stats",
+    "bwlimit": "core/bwlimit",
+    "moveDir": "sync/move",
+    "moveFile": "operations/movefile",
+    "copyDir": "sync/copy",
+    "copyFile": "operations/copyfile",
+    "cleanUpRemote": "operations/cleanup",
+    "noopAuth": "rc/noopauth",
+    "getRcloneVersion": "core/version",
+    "getRcloneMemStats": "core/memstats",
+    "getOptions": "options/get",
+    "getProviders": "config/providers",
+    "getConfigDump": "config/dump",
+    "getRunningJobs": "job/list",
+    "getStatusForJob": "job/status",
+    "getConfigForRemote": "config/get",
+    "createConfig": "config/create",
+    "updateConfig": "config/update",
+    "getFsInfo": "operations/fsinfo",
+    "listRemotes": "config/listremotes",
+    "getFilesList": "operations/list",
+    "getAbout": "operations/about",
+    "deleteConfig": "config/delete",
+    "stopJob": "job/stop",
+    "backendCommand": "backend/command",
+    "coreCommand": "core/command",
+    "transferred": "core/transferred",
+    "getSize": "operations/size",
+    "getFileInfo": "operations/stat",
+    "statsDelete": "core/stats-delete",
+    "statsReset": "core/stats-reset",
+    "startServe": "serve/start",
+    "stopServe": "serve/stop",
+    "refreshVfs": "vfs/refresh",
+}
+
+
+def parse_size(size: Any) -> int:
+    """Parse an rclone style size like "50M" into bytes"""
+    if isinstance(size, (int, float)):
+        return int(size)
+    match = SIZE_RE.match(str(size).strip())
+    if not match:
+        return 0
+    exponent = " bkmgtp".index(match.group(2).lower() or "b") - 1
+    return int(float(match.group(1)) * 1024 ** max(exponent, 0))
+
+
+def build_remote(
+    category: Dict[str, Any], config: Dict[str, Any]
+) -> Optional[Tuple[str, Dict[str, str]]]:
+    """Build the rclone remote of a category
+
+    Args:
+        category (dict): The category settings
+        config (dict): The whole config holding the provider credentials
+
+    Returns:
+        Optional[tuple]: The remote name and its parameters, "type" included
+    """
+    provider = category.get("provider") or "gdrive"
+    if provider == "gdrive":
+        token = json.dumps(
+            {
+                "access_token": config["gdrive"]["access_token"],
+                "token_type": "Bearer",
+                "refresh_token": config["gdrive"]["refresh_token"],
+                "expiry": "2022-03-27T00:00:00.000+00:00",
+            },
+        )
+        id = category["id"]
+        safe_fs = "".join(c for c in id if c.isalnum())
+        return safe_fs, {
+            "type": "drive",
+            "client_id": config["gdrive"]["client_id"],
+            "client_secret": config["gdrive"]["client_secret"],
+            "scope": "drive",
+            "root_folder_id": id,
+            "token": token,
+            "team_drive": category["drive_id"],
+        }
+    elif provider == "onedrive":
+        token = json.dumps(
+            {
+                "access_token": config["onedrive"]["access_token"],
+                "token_type": "Bearer",
+                "refresh_token": config["onedrive"]["refresh_token"],
+                "expiry": "2022-03-27T00:00:00.000+00:00",
+            },
+        )
+        id = category["id"]
+        safe_fs = "".join(c for c in id if c.isalnum())
+        return safe_fs, {
+            "type": "onedrive",
+            "scope": "drive",
+            "root_folder_id": id,
+            "token": token,
+            "drive_id": category["drive_id"],
+            "drive_type": "personal",
+        }
+    elif provider == "sharepoint":
+        token = json.dumps(
+            {
+                "access_token": config["sharepoint"]["access_token"],
+                "token_type": "Bearer",
+                "refresh_token": config["sharepoint"]["refresh_token"],
+                "expiry": "2022-03-27T00:00:00.000+00:00",
+            },
+        )
+        id = category.get("id")
+        drive_id = category.get("drive_id")
+        if id is not None and drive_id is not None:
+            safe_fs = "".join(c for c in id if c.isalnum())
+            return safe_fs, {
+                "type": "onedrive",
+                "root_folder_id": id,
+                "token": token,
+                "drive_id": drive_id,
+                "drive_type": "documentLibrary",
+            }
+        elif drive_id is not None:
+            safe_fs = "".join(c for c in drive_id if c.isalnum())
+            return safe_fs, {
+                "type": "onedrive",
+                "token": token,
+                "drive_id": drive_id,
+                "drive_type": "documentLibrary",
+            }
+    return None
+
+
 def build_config(config) -> List[str]:
     rclone_conf = []
     for category in config["categories"]:
-        provider = category.get("provider", "gdrive")
-        if provider == "gdrive":
-            provider = "drive"
-            client_id = config["gdrive"]["client_id"]
-            client_secret = config["gdrive"]["client_secret"]
-            token = json.dumps(
-                {
-                    "access_token": config["gdrive"]["access_token"],
-                    "token_type": "Bearer",
-                    "refresh_token": config["gdrive"]["refresh_token"],
-                    "expiry": "2022-03-27T00:00:00.000+00:00",
-                },
-            )
-            id = category["id"]
-            safe_fs = "".join(c for c in id if c.isalnum())
-            drive_id = category["drive_id"]
-            rclone_conf.append(
-                f"[{safe_fs}]\ntype = drive\nclient_id = {client_id}\nclient_secret = {client_secret}\nscope = drive\nroot_folder_id = {id}\ntoken = {token}\nteam_drive = {drive_id}\n"
-            )
-        elif provider == "onedrive":
-            token = json.dumps(
-                {
-                    "access_token": config["onedrive"]["access_token"],
-                    "token_type": "Bearer",
-                    "refresh_token": config["onedrive"]["refresh_token"],
-                    "expiry": "2022-03-27T00:00:00.000+00:00",
-                },
-            )
-            id = category["id"]
-            safe_fs = "".join(c for c in id if c.isalnum())
-            drive_id = category["drive_id"]
-            rclone_conf.append(
-                f"[{safe_fs}]\ntype = onedrive\nscope = drive\nroot_folder_id = {id}\ntoken = {token}\ndrive_id = {drive_id}\ndrive_type = personal"
-            )
-        elif provider == "sharepoint":
-            token = json.dumps(
-                {
-                    "access_token": config["sharepoint"]["access_token"],
-                    "token_type": "Bearer",
-                    "refresh_token": config["sharepoint"]["refresh_token"],
-                    "expiry": "2022-03-27T00:00:00.000+00:00",
-                },
-            )
-            id = category.get("id")
-            drive_id = category.get("drive_id")
-            if id is not None and drive_id is not None:
-                safe_fs = "".join(c for c in id if c.isalnum())
-                rclone_conf.append(
-                    f"[{safe_fs}]\ntype = onedrive\nroot_folder_id = {id}\ntoken = {token}\ndrive_id = {drive_id}\ndrive_type = documentLibrary"
-                )
-            elif drive_id is not None:
-                safe_fs = "".join(c for c in drive_id if c.isalnum())
-                rclone_conf.append(
-                    f"[{safe_fs}]\ntype = onedrive\ntoken = {token}\ndrive_id = {drive_id}\ndrive_type = documentLibrary"
-                )
+        remote = build_remote(category, config)
+        if remote is None:
+            continue
+        name, parameters = remote
+        lines = [f"[{name}]"] + [f"{k} = {v}" for k, v in parameters.items()]
+        rclone_conf.append("\n".join(lines) + "\n")
     return rclone_conf
 
 
 class RCloneAPI:
-    def __init__(self, data: Dict[str, Any], index: int):
+    def __init__(self, data: Dict[str, Any], index: int, shard: int = 0):
         self.data: Dict[str, Any] = data
         self.index: int = index
+        self.shard: int = shard
         self.id: str = data.get("id") or data.get("drive_id") or ""
         self.fs: str = "".join(c for c in self.id if c.isalnum()) + ":"
         self.provider: str = data.get("provider") or "gdrive"
-        self.RCLONE_RC_URL: str = "http://localhost:35530"
-        self.RCLONE: Dict[str, str] = {
-            "mkdir": "operations/mkdir",
-            "purge": "operations/purge",
-            "deleteFile": "operations/deletefile",
-            "createPublicLink": "operations/publiclink",
-            "stats": "core/stats",
-            "bwlimit": "core/bwlimit",
-            "moveDir": "sync/move",
-            "moveFile": "operations/movefile",
-            "copyDir": "sync/copy",
-            "copyFile": "operations/copyfile",
-            "cleanUpRemote": "operations/cleanup",
-            "noopAuth": "rc/noopauth",
-            "getRcloneVersion": "core/version",
-            "getRcloneMemStats": "core/memstats",
-            "getOptions": "options/get",
-            "getProviders": "config/providers",
-            "getConfigDump": "config/dump",
-            "getRunningJobs": "job/list",
-            "getStatusForJob": "job/status",
-            "getConfigForRemote": "config/get",
-            "createConfig": "config/create",
-            "updateConfig": "config/update",
-            "getFsInfo": "operations/fsinfo",
-            "listRemotes": "config/listremotes",
-            "getFilesList": "operations/list",
-            "getAbout": "operations/about",
-            "deleteConfig": "config/delete",
-            "stopJob": "job/stop",
-            "backendCommand": "backend/command",
-            "coreCommand": "core/command",
-            "transferred": "core/transferred",
-            "getSize": "operations/size",
-            "getFileInfo": "operations/stat",
-            "statsDelete": "core/stats-delete",
-            "statsReset": "core/stats-reset",
-        }
+        self.RCLONE_RC_URL: str = (
+            f"http://localhost:{settings.RCLONE_LISTEN_PORT + shard}"
+        )
+        self.RCLONE: Dict[str, str] = RCLONE
         self.fs_conf: Dict[str, Any] = self.rc_conf()
+        self.hash_types: List[str] = HASH_TYPES.get(self.provider, [])
+        self.jobs: Set[int] = set()
+        self.serve_id: Optional[str] = None
+        self.serve_addr: Optional[str] = None
+        self.rc_serve()
+
+    def rc(
+        self, command: str, data: Dict[str, Any], idempotent: bool = True
+    ) -> Dict[str, Any]:
+        """Run an rc command on the rcd of this remote
 
-    def rc_ls(self, options: Optional[dict] = {}) -> List[Dict[str, Any]]:
+        Args:
+            command (str): The key of the command in RCLONE
+            data (dict): The parameters of the command
+            idempotent (bool): Whether the command may be retried
+
+        Returns:
+            dict: The decoded response
+        """
+        return (
+            outbound(f"rclone-{self.shard}")
+            .request(
+                "POST",
+                "%s/%s" % (self.RCLONE_RC_URL, self.RCLONE[command]),
+                idempotent=idempotent,
+                data=json.dumps(data),
+                headers={"Content-Type": "application/json"},
+            )
+            .json()
+        )
+
+    def rc_ls(
+        self,
+        options: Optional[dict] = {},
+        remote: str = "",
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """List a path of the remote as an async rc job
+
+        Args:
+            options (dict): The operations/list options
+            remote (str): The path to list, relative to the remote root
+            filters (dict): rclone filter options applied by rclone itself
+
+        Returns:
+            list: The listed items
+        """
         rc_data: Dict[str, Any] = {
             "fs": self.fs,
-            "remote": "",
+            "remote": remote,
             "opt": options,
+            "_async": True,
         }
-        result = requests.post(
-            "%s/%s" % (self.RCLONE_RC_URL, self.RCLONE["getFilesList"]),
-            data=json.dumps(rc_data),
-            headers={"Content-Type": "application/json"},
-        ).json()
-        return result["list"]
+        if filters:
+            rc_data["_filter"] = filters
+        if self.provider in LISTR_PROVIDERS:
+            rc_data["_config"] = {"UseListR": True}
+        result = self.rc("getFilesList", rc_data, idempotent=False)
+        if "jobid" not in result:
+            raise RuntimeError(
+                f"Listing {self.fs}{remote} failed: {result.get('error')}"
+            )
+        return self.rc_job_wait(result["jobid"])["list"]
+
+    def rc_job_wait(
+        self, jobid: int, timeout: float = settings.RCLONE_JOB_TIMEOUT
+    ) -> Dict[str, Any]:
+        """Poll an async rc job until it finishes
+
+        Args:
+            jobid (int): The job ID returned by an "_async" call
+            timeout (float): Seconds before the job is stopped
+
+        Returns:
+            dict: The output of the job
+        """
+        self.jobs.add(jobid)
+        deadline = time() + timeout
+        interval = 0.25
+        try:
+            while True:
+                status = self.rc("getStatusForJob", {"jobid": jobid})
+                if status.get("finished"):
+                    if not status.get("success"):
+                        raise RuntimeError(
+                            f"rclone job {jobid} failed: {status.get('error')}"
+                        )
+                    return status.get("output") or {}
+                if time() > deadline:
+                    self.rc_job_stop(jobid)
+                    raise TimeoutError(f"rclone job {jobid} timed out")
+                sleep(interval)
+                interval = min(interval * 2, 5)
+        finally:
+            self.jobs.discard(jobid)
+
+    def rc_job_stop(self, jobid: int):
+        self.rc("stopJob", {"jobid": jobid})
+
+    def rc_vfs_refresh(self, dirs: List[str]):
+        """Prime the directory cache of the VFS server for some directories
+
+        Args:
+            dirs (list): Directories relative to the remote root
+        """
+        if self.serve_addr is None or len(dirs) == 0:
+            return
+        rc_data: Dict[str, Any] = {
+            "fs": self.fs,
+            "recursive": True,
+            "_async": True,
+        }
+        for n, path in enumerate(dirs, start=1):
+            rc_data["dir" if n == 1 else f"dir{n}"] = path
+        result = self.rc("refreshVfs", rc_data, idempotent=False)
+        if "jobid" in result:
+            self.rc_job_wait(result["jobid"])
+
+    def cancel_jobs(self):
+        for jobid in list(self.jobs):
+            self.rc_job_stop(jobid)
+
+    def close(self):
+        self.cancel_jobs()
+        self.rc_serve_stop()
+
+    def scan_filters(self, extensions: Tuple[str, ...]) -> Dict[str, Any]:
+        """Build the rclone filters used by library scans
+
+        Args:
+            extensions (tuple): The file extensions to keep
+
+        Returns:
+            dict: The "_filter" options of an rc call
+        """
+        # rclone tries include rules before exclude ones, so the sample
+        # exclusions only win in a single ordered list
+        return {
+            "IgnoreCase": True,
+            "FilterRule": [
+                "- sample/**",
+                "- *-sample.*",
+                "- *.sample.*",
+                "+ *.{%s}" % ",".join(ext.lstrip(".") for ext in extensions),
+                "- **",
+            ],
+        }
+
+    def too_small(self, item: Dict[str, Any]) -> bool:
+        """Whether a video is under the min_size of the category
+
+        rclone's MinSize would also drop the subtitles, so videos are
+        checked here instead.
+        """
+        return 0 <= item["Size"] < parse_size(self.data.get("min_size") or 0)
 
     def rc_conf(self) -> Dict[str, Any]:
         rc_data: Dict[str, str] = {"name": self.fs[:-1]}
-        result = requests.post(
-            "%s/%s" % (self.RCLONE_RC_URL, self.RCLONE["getConfigForRemote"]),
-            data=json.dumps(rc_data),
-            headers={"Content-Type": "application/json"},
-        ).json()
+        result = self.rc("getConfigForRemote", rc_data)
         result["token"] = json.loads(result.get("token", "{}"))
         return result
 
-    def fetch_movies(self) -> List[Dict[str, Any]]:
-        rc_ls_result = self.rc_ls({"recurse": True, "filesOnly": False})
+    def rc_serve(self) -> Optional[str]:
+        """Start a VFS backed HTTP server for this remote on the rcd
+        using the category streaming profile
+
+        Returns:
+            Optional[str]: The address the server listens on
+        """
+        profile = build_streaming_profile(self.data)
+        buffer_size = profile.pop("buffer_size", None)
+        rc_data: Dict[str, Any] = {
+            "type": "http",
+            "fs": self.fs,
+            "addr": "localhost:0",
+            **profile,
+        }
+        if buffer_size:
+            rc_data["_config"] = {"BufferSize": buffer_size}
+        result = self.rc("startServe", rc_data, idempotent=False)
+        if "addr" not in result:
+            logger.warning(
+                f"Could not start VFS server for {self.fs} - {result.get('error')}"
+            )
+            return None
+        self.serve_id = result.get("id")
+        self.serve_addr = result["addr"].replace("[::]", "localhost")
+        return self.serve_addr
+
+    def rc_serve_stop(self):
+        if self.serve_id is None:
+            return
+        self.rc("stopServe", {"id": self.serve_id})
+        self.serve_id = None
+        self.serve_addr = None
+
+    def fetch_movies(self, paths: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """List the movies of the remote
+
+        Args:
+            paths (list): Only list these files / directories
+
+        Returns:
+            list: The file records of every movie found
+        """
+        options = {
+            "recurse": True,
+            "filesOnly": False,
+            "showHash": len(self.hash_types) > 0,
+            "hashTypes": self.hash_types,
+        }
+        filters = self.scan_filters(VIDEO_EXTENSIONS + SUBTITLE_EXTENSIONS)
+        if paths is None:
+            return self.build_movies(self.rc_ls(options, filters=filters))
+        metadata: List[Dict[str, Any]] = []
+        for path in paths:
+            path = path.strip("/")
+            item = self.rc_stat(path)
+            if item is None:
+                logger.warning(f"Could not find {self.fs}{path}")
+                continue
+            if item["IsDir"] is True:
+                items = [item] + self.rc_ls(options, remote=path, filters=filters)
+            elif "/" in path:
+                parent = self.rc_stat(path.rpartition("/")[0])
+                items = [parent, item] if parent else [item]
+            else:
+                items = [item]
+            metadata.extend(self.build_movies(items))
+        return metadata
+
+    def build_movies(self, rc_ls_result: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         metadata: List[Dict[str, Any]] = []
+        subtitles: List[Dict[str, Any]] = []
         dirs = {}
         for item in rc_ls_result:
             if item["IsDir"] is False and (
                 "video" in item["MimeType"]
-                or item["Name"]
-                .lower()
-                .endswith((".mp4", ".mkv", ".avi", ".mov", ".webm", ".flv"))
+                or item["Name"].lower().endswith(VIDEO_EXTENSIONS)
             ):
+                if self.too_small(item):
+                    continue
                 parent_path = item["Path"].replace("/" + item["Name"], "")
                 parent = dirs.get(parent_path)
                 metadata.append(
@@ -159,6 +538,8 @@ class RCloneAPI:
                         "parent": parent,
                         "mime_type": item["MimeType"],
                         "modified_time": item["ModTime"],
+                        "size": item["Size"],
+                        "hashes": item.get("Hashes", {}),
                     }
                 )
             elif item["IsDir"] is True:
@@ -167,13 +548,50 @@ class RCloneAPI:
                     "name": item["Name"],
                     "path": item["Path"],
                 }
-            elif item["IsDir"] is False and item["Name"].endswith((".srt", ".vtt")):
-                # Subtitle management
-                pass
+            elif item["IsDir"] is False and item["Name"].lower().endswith(
+                SUBTITLE_EXTENSIONS
+            ):
+                subtitles.append(
+                    {
+                        "id": item["ID"],
+                        "name": item["Name"],
+                        "path": item["Path"],
+                        "modified_time": item["ModTime"],
+                    }
+                )
+        match_subtitles(metadata, subtitles)
         return metadata
 
-    def fetch_series(self) -> List[Dict[str, Any]]:
-        rc_ls_result = self.rc_ls({"recurse": True, "maxDepth": 2})
+    def fetch_series(self, paths: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """List the series of the remote
+
+        Args:
+            paths (list): Only list the series holding these paths
+
+        Returns:
+            list: The directory records of every series found
+        """
+        options = {
+            "recurse": True,
+            "maxDepth": 2,
+            "showHash": len(self.hash_types) > 0,
+            "hashTypes": self.hash_types,
+        }
+        filters = self.scan_filters(VIDEO_EXTENSIONS + SUBTITLE_EXTENSIONS)
+        if paths is None:
+            return self.build_series(self.rc_ls(options, filters=filters))
+        metadata: List[Dict[str, Any]] = []
+        # Series are the top level directories of a category
+        for path in dict.fromkeys(p.strip("/").split("/")[0] for p in paths):
+            item = self.rc_stat(path)
+            if item is None or item["IsDir"] is False:
+                logger.warning(f"Could not find series directory {self.fs}{path}")
+                continue
+            items = [item] + self.rc_ls(options, remote=path, filters=filters)
+            metadata.extend(self.build_series(items))
+        return metadata
+
+    def build_series(self, rc_ls_result: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         metadata: List[Dict[str, Any]] = []
         parent_dirs: Dict[str, Dict[str, Any]] = {
             "": {
@@ -189,7 +607,21 @@ class RCloneAPI:
                 parent_path = item["Path"].replace("/" + item["Name"], "")
             parent = parent_dirs[parent_path]
             if item["IsDir"] is False:
-                if parent["depth"] == 2:
+                if parent["depth"] == 2 and item["Name"].lower().endswith(
+                    SUBTITLE_EXTENSIONS
+                ):
+                    season_metadata = eval("metadata" + parent["json_path"])
+                    season_metadata["subtitles"].append(
+                        {
+                            "id": item["ID"],
+                            "name": item["Name"],
+                            "path": item["Path"],
+                            "modified_time": item["ModTime"],
+                        }
+                    )
+                elif parent["depth"] == 2:
+                    if self.too_small(item):
+                        continue
                     season_metadata = eval("metadata" + parent["json_path"])
                     season_metadata["episodes"].append(
                         {
@@ -199,6 +631,8 @@ class RCloneAPI:
                             "parent": parent,
                             "mime_type": item["MimeType"],
                             "modified_time": item["ModTime"],
+                            "size": item["Size"],
+                            "hashes": item.get("Hashes", {}),
                         }
                     )
             else:
@@ -238,11 +672,15 @@ class RCloneAPI:
                         "mime_type": item["MimeType"],
                         "modified_time": item["ModTime"],
                         "episodes": [],
+                        "subtitles": [],
                         "json_path": parent["json_path"] + f'["{season}"]',
                     }
                     parent_dirs[item["Path"]]["json_path"] = (
                         parent["json_path"] + f'["seasons"]["{season}"]'
                     )
+        for serie in metadata:
+            for season in serie["seasons"].values():
+                match_subtitles(season["episodes"], season.pop("subtitles"))
         return metadata
 
     def refresh(self) -> Dict:
@@ -264,27 +702,22 @@ class RCloneAPI:
         }
         return result
 
-    def size(self, path: str) -> int:
-        options = {
-            "no-modtime": True,
-            "no-mimetype": True,
-        }
+    def rc_stat(self, path: str) -> Optional[Dict[str, Any]]:
         rc_data: Dict[str, Any] = {
             "fs": self.fs,
             "remote": path,
-            "opt": options,
+            "opt": {
+                "showHash": len(self.hash_types) > 0,
+                "hashTypes": self.hash_types,
+            },
         }
-        result = requests.post(
-            "%s/%s" % (self.RCLONE_RC_URL, self.RCLONE["getFileInfo"]),
-            data=json.dumps(rc_data),
-            headers={"Content-Type": "application/json"},
-        ).json()
-        return result["item"]["Size"]
+        result = self.rc("getFileInfo", rc_data)
+        return result.get("item")
 
     def stream(self, path: str):
-        stream_url = (
-            f"http://localhost:{settings.RCLONE_LISTEN_PORT}/[{self.fs}]/{path}"
-        )
+        if self.serve_addr:
+            return f"http://{self.serve_addr}/{path}"
+        stream_url = f"{self.RCLONE_RC_URL}/[{self.fs}]/{path}"
         return stream_url
 
     def thumbnail(self, id) -> Optional[str]:
@@ -0,0 +1,210 @@
+import os
+import time
+import zlib
+import shutil
+import numpy as np
+from app import logger
+from threading import Lock
+from difflib import SequenceMatcher
+from typing import Dict, List, Tuple, Optional
+from app.core.identify import normalize_title
+
+
+index_dir = os.path.join("cache", "title_index")
+# Trigrams found in more titles than this carry almost no signal and
+# are only used when a query has nothing rarer
+COMMON_TRIGRAM = 20000
+
+
+def trigrams(title: str) -> List[str]:
+    padded = f" {title} "
+    return list(dict.fromkeys(padded[i : i + 3] for i in range(len(padded) - 2)))
+
+
+def trigram_hashes(title: str) -> np.ndarray:
+    return np.array([zlib.crc32(t.encode()) for t in trigrams(title)], dtype=np.uint32)
+
+
+class TitleIndex:
+    """A read-only index of every title in a TMDB ID export
+
+    The normalized titles are stored sorted, next to their TMDB IDs,
+    popularity and a trigram posting list, as .npy files that are memory
+    mapped. Exact titles are found by binary search and anything else
+    through the trigrams, without touching the database or the API.
+    """
+
+    def __init__(self, path: str):
+        self.path: str = path
+        self.titles: np.ndarray = self.load("titles")
+        self.offsets: np.ndarray = self.load("offsets")
+        self.ids: np.ndarray = self.load("ids")
+        self.popularity: np.ndarray = self.load("popularity")
+        self.trigram_counts: np.ndarray = self.load("trigram_counts")
+        self.trigram_keys: np.ndarray = self.load("trigram_keys")
+        self.trigram_starts: np.ndarray = self.load("trigram_starts")
+        self.postings: np.ndarray = self.load("postings")
+
+    def load(self, name: str) -> np.ndarray:
+        return np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, i: int) -> str:
+        return bytes(self.titles[self.offsets[i] : self.offsets[i + 1]]).decode()
+
+    def exact(self, title: str) -> List[int]:
+        """Positions of the entries with exactly this normalized title"""
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self[mid] < title:
+                lo = mid + 1
+            else:
+                hi = mid
+        matches = []
+        while lo < len(self) and self[lo] == title:
+            matches.append(lo)
+            lo += 1
+        return matches
+
+    def candidates(self, title: str, limit: int = 20) -> np.ndarray:
+        """Positions of the entries sharing the most trigrams with a title"""
+        hashes = trigram_hashes(title)
+        keys = np.searchsorted(self.trigram_keys, hashes)
+        keys = keys[keys < len(self.trigram_keys)]
+        keys = keys[np.isin(self.trigram_keys[keys], hashes)]
+        if len(keys) == 0:
+            return np.empty(0, dtype=np.uint32)
+        sizes = self.trigram_starts[keys + 1] - self.trigram_starts[keys]
+        if (sizes <= COMMON_TRIGRAM).any():
+            keys = keys[sizes <= COMMON_TRIGRAM]
+        postings = np.concatenate(
+            [
+                self.postings[self.trigram_starts[k] : self.trigram_starts[k + 1]]
+                for k in keys
+            ]
+        )
+        positions, shared = np.unique(postings, return_counts=True)
+        # Dice coefficient over the trigram sets
+        scores = 2 * shared / (len(hashes) + self.trigram_counts[positions])
+        best = np.argsort(-scores, kind="stable")[:limit]
+        return positions[best]
+
+    def lookup(self, title: str, cutoff: float = 0.85) -> Optional[int]:
+        """Find the TMDB ID of a title
+
+        Args:
+            title (str): The title to look up
+            cutoff (float): The lowest similarity accepted for inexact matches
+
+        Returns:
+            Optional[int]: The ID of the most popular of the best matches
+        """
+        title = normalize_title(title)
+        if not title:
+            return None
+        exact = self.exact(title)
+        if exact:
+            return int(self.ids[max(exact, key=lambda i: self.popularity[i])])
+        matcher = SequenceMatcher(b=title)
+        best: Tuple[float, float] = (cutoff, -1.0)
+        match = None
+        for i in self.candidates(title):
+            matcher.set_seq1(self[i])
+            score = (matcher.ratio(), float(self.popularity[i]))
+            if score >= best:
+                best, match = score, int(self.ids[i])
+        return match
+
+
+def build_title_index(data_type: str) -> Optional[str]:
+    """Write the title index of a type from its cache collection
+
+    Every build goes to a new directory; the "current" pointer file is
+    swapped last, so readers never see a half written index.
+
+    Returns:
+        Optional[str]: The directory of the new index
+    """
+    from main import mongo
+
+    if data_type == "series":
+        cache_col = mongo.series_cache_col
+    else:
+        cache_col = mongo.movies_cache_col
+    rows: List[Tuple[str, int, float]] = []
+    for doc in cache_col.find(
+        {},
+        {"_id": 0, "id": 1, "original_title": 1, "original_name": 1, "popularity": 1},
+    ):
+        title = normalize_title(doc.get("original_title") or doc.get("original_name"))
+        if title:
+            rows.append((title, doc["id"], doc.get("popularity") or 0.0))
+    if len(rows) == 0:
+        return None
+    rows.sort()
+    encoded = [row[0].encode() for row in rows]
+    offsets = np.zeros(len(rows) + 1, dtype=np.uint64)
+    np.cumsum([len(title) for title in encoded], out=offsets[1:])
+    trigram_counts = np.zeros(len(rows), dtype=np.uint16)
+    pair_hashes: List[np.ndarray] = []
+    for position, (title, _, _) in enumerate(rows):
+        hashes = trigram_hashes(title)
+        trigram_counts[position] = len(hashes)
+        pair_hashes.append(hashes)
+    positions = np.repeat(np.arange(len(rows), dtype=np.uint32), trigram_counts)
+    hashes = np.concatenate(pair_hashes)
+    order = np.argsort(hashes, kind="stable")
+    hashes, postings = hashes[order], positions[order]
+    trigram_keys, trigram_starts = np.unique(hashes, return_index=True)
+    trigram_starts = np.append(trigram_starts, len(postings)).astype(np.uint64)
+
+    path = os.path.join(index_dir, f"{data_type}-{int(time.time())}")
+    os.makedirs(path, exist_ok=True)
+    arrays = {
+        "titles": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        "offsets": offsets,
+        "ids": np.array([row[1] for row in rows], dtype=np.uint32),
+        "popularity": np.array([row[2] for row in rows], dtype=np.float32),
+        "trigram_counts": trigram_counts,
+        "trigram_keys": trigram_keys,
+        "trigram_starts": trigram_starts,
+        "postings": postings,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), array)
+    pointer = os.path.join(index_dir, f"{data_type}.current")
+    with open(pointer + ".tmp", "w") as f:
+        f.write(os.path.basename(path))
+    os.replace(pointer + ".tmp", pointer)
+    for name in os.listdir(index_dir):
+        old = os.path.join(index_dir, name)
+        if name.startswith(f"{data_type}-") and old != path:
+            shutil.rmtree(old, ignore_errors=True)
+    logger.info(f"Built the {data_type} title index with {len(rows)} titles")
+    return path
+
+
+loaded: Dict[str, TitleIndex] = {}
+loaded_lock = Lock()
+
+
+def get_title_index(data_type: str) -> Optional[TitleIndex]:
+    """The newest title index of a type, None if none was built yet"""
+    pointer = os.path.join(index_dir, f"{data_type}.current")
+    try:
+        with open(pointer) as f:
+            path = os.path.join(index_dir, f.read().strip())
+    except OSError:
+        return None
+    with loaded_lock:
+        index = loaded.get(data_type)
+        if index is None or index.path != path:
+            try:
+                index = loaded[data_type] = TitleIndex(path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not load the {data_type} title index: {e}")
+                return None
+        return index
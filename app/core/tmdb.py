@@ -1,75 +1,709 @@
-import gzip
+import zlib
 import httpx
+import asyncio
 import ujson as json
-from math import ceil
 from app import logger
-from pymongo import InsertOne
+from array import array
+from hashlib import sha1
+from itertools import compress
+from bisect import bisect_left
+from time import sleep, monotonic
+from app.settings import settings
+from threading import Lock, Thread
 from difflib import SequenceMatcher
-from typing import Any, Dict, Optional
+from urllib.parse import urlsplit, urlencode
+from email.utils import parsedate_to_datetime
 from datetime import datetime, timezone, timedelta
+from pymongo import ASCENDING, InsertOne, UpdateOne
+from app.core.outbound import CircuitOpenError, outbound
+from app.core.identify import IdentifyCache, identify_key
+from pymongo.errors import BulkWriteError, OperationFailure
+from app.core.title_index import get_title_index, build_title_index
+from typing import Any, Set, Dict, List, Tuple, Iterable, Iterator, Optional
+
+
+class SearchError(Exception):
+    """TMDB answered a search or lookup with an error instead of results"""
+
+
+class TokenBucket:
+    """Spread requests evenly over time to stay under a rate limit
+
+    Args:
+        rate (float): Tokens added per second
+        capacity (int): The largest burst allowed after being idle
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate: float = rate
+        self.capacity: float = float(capacity)
+        self.tokens: float = float(capacity)
+        self.updated_at: float = monotonic()
+        self.blocked_until: float = 0.0
+        self.lock: asyncio.Lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def block(self, seconds: float):
+        """Hold back every request for a while, e.g. after a 429"""
+        self.blocked_until = max(self.blocked_until, monotonic() + seconds)
+        self.tokens = 0
+
+
+def retry_after(value: Optional[str]) -> float:
+    """Parse a Retry-After header given in seconds or as an HTTP date"""
+    if not value:
+        return 1.0
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return 1.0
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+DAY = 24 * 60 * 60
+
+
+def cache_ttl(url: str, status: int, body: Dict[str, Any]) -> Optional[int]:
+    """How long a TMDB response stays fresh, in seconds
+
+    Titles that can no longer change (ended shows, movies released more
+    than a year ago) are kept much longer than airing or upcoming ones.
+
+    Returns:
+        Optional[int]: None if the response must not be cached
+    """
+    if status == 404:
+        return DAY
+    if status != 200:
+        return None
+    path = urlsplit(url).path
+    if path.endswith("/configuration"):
+        return 3 * DAY
+    if "/search/" in path:
+        return 7 * DAY if body.get("results") else DAY
+    if "/season/" in path:
+        return 7 * DAY
+    if "/tv/" in path:
+        return 90 * DAY if body.get("status") in ("Ended", "Canceled") else DAY
+    if "/movie/" in path:
+        try:
+            released = datetime.strptime(body.get("release_date") or "", "%Y-%m-%d")
+        except ValueError:
+            return DAY
+        age = datetime.now() - released
+        if age > timedelta(days=365):
+            return 90 * DAY
+        return 7 * DAY if age > timedelta(0) else DAY
+    return DAY
+
+
+class ResponseCache:
+    """TMDB responses persisted in MongoDB
+
+    Entries are keyed by the normalized url and query parameters (without
+    the api key). Expired entries are kept around for a while so they can
+    be revalidated with If-None-Match / If-Modified-Since.
+    """
+
+    def __init__(self, collection):
+        self.col = collection
+        self.col.create_index(
+            "expires_at",
+            expireAfterSeconds=settings.TMDB_CACHE_GRACE,
+            name="expires_at",
+        )
+
+    @staticmethod
+    def key(url: str, params: Optional[dict] = None) -> str:
+        parts = urlsplit(url)
+        query = sorted(
+            (k, str(v).lower().strip() if k == "query" else str(v))
+            for k, v in (params or {}).items()
+            if v is not None and k != "api_key"
+        )
+        normalized = (
+            f"{parts.netloc.lower()}{parts.path.rstrip('/')}?{urlencode(query)}"
+        )
+        return sha1(normalized.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self.col.find_one({"_id": key})
+        if entry is not None:
+            entry["expires_at"] = entry["expires_at"].replace(tzinfo=timezone.utc)
+        return entry
+
+    def set(
+        self,
+        key: str,
+        url: str,
+        status: int,
+        body: Dict[str, Any],
+        headers: httpx.Headers,
+    ):
+        ttl = cache_ttl(url, status, body)
+        if ttl is None:
+            return
+        now = datetime.now(timezone.utc)
+        self.col.replace_one(
+            {"_id": key},
+            {
+                "url": url,
+                "status": status,
+                "body": body,
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "fetched_at": now,
+                "expires_at": now + timedelta(seconds=ttl),
+            },
+            upsert=True,
+        )
+
+    def touch(self, key: str, entry: Dict[str, Any]):
+        """Extend the life of an entry the API reported as not modified"""
+        ttl = cache_ttl(entry["url"], entry["status"], entry["body"]) or DAY
+        self.col.update_one(
+            {"_id": key},
+            {
+                "$set": {
+                    "expires_at": datetime.now(timezone.utc) + timedelta(seconds=ttl)
+                }
+            },
+        )
+
+
+def export_date() -> str:
+    """The date of the newest TMDB ID export that is surely published"""
+    return (datetime.now(timezone.utc) - timedelta(days=1)).strftime("%m_%d_%Y")
+
+
+def export_url(data_type: str, date: str) -> str:
+    type_name = "tv_series" if data_type == "series" else "movie"
+    return f"http://files.tmdb.org/p/exports/{type_name}_ids_{date}.json.gz"
+
+
+def fingerprint(row: Dict[str, Any]) -> int:
+    """A checksum of an export row, used to detect changed rows"""
+    row = {k: v for k, v in row.items() if k != "_id"}
+    return zlib.crc32(json.dumps(row, sort_keys=True).encode())
+
+
+def export_lines(url: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Stream a gzipped, newline delimited file and yield its lines"""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    pending = b""
+    dependency = outbound("tmdb_export")
+    with httpx.Client(timeout=dependency.httpx_timeout) as client:
+        request = client.build_request("GET", url)
+        response = dependency.call(client.send, request, stream=True)
+        try:
+            response.raise_for_status()
+            for chunk in response.iter_bytes(chunk_size):
+                pending += decompressor.decompress(chunk)
+                *lines, pending = pending.split(b"\n")
+                yield from (line for line in lines if line.strip())
+        finally:
+            response.close()
+    pending += decompressor.flush()
+    yield from (line for line in pending.split(b"\n") if line.strip())
+
+
+def export_cache(data_type: str):
+    """The cache collection of an export, with the ID index its syncs rely on
+
+    Caches imported before the index existed can hold an ID twice, those
+    extra rows are dropped so the unique index can be built.
+    """
+    from main import mongo
+
+    if data_type == "series":
+        cache_col = mongo.series_cache_col
+    else:
+        cache_col = mongo.movies_cache_col
+    try:
+        cache_col.create_index("id", unique=True, name="id")
+    except OperationFailure as e:
+        if e.code != 11000:
+            raise
+        duplicates = cache_col.aggregate(
+            [
+                {"$group": {"_id": "$id", "rows": {"$push": "$_id"}}},
+                {"$match": {"rows.1": {"$exists": True}}},
+            ],
+            allowDiskUse=True,
+        )
+        for group in duplicates:
+            cache_col.delete_many({"_id": {"$in": group["rows"][1:]}})
+        cache_col.create_index("id", unique=True, name="id")
+    return cache_col
+
+
+def insert_ignoring_duplicates(collection, bulk_action: List[InsertOne]):
+    """Write a batch unordered, skipping rows that are already imported"""
+    if len(bulk_action) == 0:
+        return
+    try:
+        collection.bulk_write(bulk_action, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(error.get("code") != 11000 for error in errors):
+            raise
+
+
+export_lock = Lock()
+
+
+def import_exports():
+    """Import the TMDB ID exports that are not in the database yet
+    and bring the imported ones up to date with the newest export"""
+    from main import mongo
+
+    if not export_lock.acquire(blocking=False):
+        return
+    try:
+        for data_type in ("series", "movies"):
+            if getattr(mongo, f"is_{data_type}_cache_init") is False:
+                TMDB.export_data(data_type)
+            elif mongo.get_export_synced(data_type) != export_date():
+                TMDB.sync_export(data_type)
+            elif get_title_index(data_type) is not None:
+                continue
+            build_title_index(data_type)
+    except Exception as e:
+        logger.error(f"TMDB ID export import failed: {e}")
+    finally:
+        export_lock.release()
+
+
+def start_export_import():
+    Thread(target=import_exports, daemon=True).start()
+
+
+def schedule_export_sync():
+    """Check for a new TMDB ID export every TMDB_EXPORT_SYNC_INTERVAL seconds"""
+
+    def run():
+        while True:
+            import_exports()
+            sleep(settings.TMDB_EXPORT_SYNC_INTERVAL)
+
+    Thread(target=run, daemon=True).start()
+
+
+DETAIL_APPENDS = (
+    "credits",
+    "images",
+    "external_ids",
+    "videos",
+    "reviews",
+    "translations",
+)
+MAX_APPENDS = 20
+# The language TMDB answers in when none is asked for
+BASE_LANGUAGE = "en"
+TRANSLATED_FIELDS = ("title", "name", "overview", "tagline")
+
+
+def plan_details(
+    data_type: str, seasons: Optional[Iterable[int]] = None
+) -> List[List[str]]:
+    """Split what a title needs into as few detail requests as possible
+
+    append_to_response takes at most 20 items, so the first request carries
+    the base appends and as many seasons as fit, and the remaining seasons
+    are spread over full batches of 20.
+
+    Args:
+        data_type (str): The type of the title
+        seasons (list, optional): The season numbers of a series
+
+    Returns:
+        list: The append_to_response items of each request
+    """
+    appends = list(DETAIL_APPENDS)
+    if data_type == "series":
+        appends.extend(f"season/{n}" for n in sorted(set(seasons or [])))
+    return [appends[i : i + MAX_APPENDS] for i in range(0, len(appends), MAX_APPENDS)]
+
+
+def is_base_language(language: Optional[str]) -> bool:
+    return not language or language.split("-")[0].lower() == BASE_LANGUAGE
+
+
+def translate(details: Dict[str, Any], language: str) -> Dict[str, Any]:
+    """Replace the translated fields of some details by those of a language
+
+    Args:
+        details (dict): The details, with the translations appended
+        language (str): An ISO 639-1 code, optionally with a region ("pt-BR")
+
+    Returns:
+        dict: A copy of the details, fields without a translation are kept
+    """
+    code, _, region = language.partition("-")
+    translations = details.get("translations", {}).get("translations", [])
+    matches = [t for t in translations if t.get("iso_639_1") == code.lower()]
+    # "fr" prefers the French of France, then any other French
+    matches.sort(key=lambda t: t.get("iso_3166_1") != (region or code).upper())
+    details = dict(details)
+    if matches:
+        for field, value in matches[0].get("data", {}).items():
+            if field in TRANSLATED_FIELDS and value:
+                details[field] = value
+    return details
 
 
 class TMDB:
+    """Async TMDB client
+
+    All requests share one HTTP/2 connection pool and go through a token
+    bucket, so many of them can be awaited at once. Use it as an async
+    context manager to load the server config and close the pool.
+    """
+
     def __init__(self, api_key: str):
         from main import mongo
 
-        if mongo.is_series_cache_init is False:
-            mongo.series_cache_col.delete_many({})
-            self.export_data("series")
-        if mongo.is_movies_cache_init is False:
-            mongo.movies_cache_col.delete_many({})
-            self.export_data("movies")
-        self.client = httpx.Client(params={"api_key": api_key})
-        self.config = self.get_server_config()
-        self.image_base_url = self.config["images"]["secure_base_url"]
-
-    def get_server_config(self) -> Dict[str, Any]:
+        if not (mongo.is_series_cache_init and mongo.is_movies_cache_init):
+            start_export_import()
+        self.client = httpx.AsyncClient(
+            params={"api_key": api_key},
+            http2=True,
+            timeout=outbound("tmdb").httpx_timeout,
+            limits=httpx.Limits(
+                max_connections=settings.TMDB_CONCURRENCY,
+                max_keepalive_connections=settings.TMDB_CONCURRENCY,
+            ),
+        )
+        self.limiter = TokenBucket(settings.TMDB_RATE_LIMIT, settings.TMDB_CONCURRENCY)
+        self.cache: Optional[ResponseCache] = None
+        if settings.TMDB_CACHE:
+            self.cache = ResponseCache(mongo.tmdb_cache_col)
+        self.requests: int = 0
+        self.cache_hits: int = 0
+        self.identify_cache = IdentifyCache(mongo.identify_cache_col)
+        self.resolved: Dict[str, Optional[int]] = {}
+        self.config: Dict[str, Any] = {}
+        self.image_base_url: Optional[str] = None
+
+    async def __aenter__(self) -> "TMDB":
+        self.config = await self.get_server_config()
+        self.image_base_url = self.config.get("images", {}).get("secure_base_url")
+        return self
+
+    async def __aexit__(self, *args):
+        await self.client.aclose()
+        logger.info(
+            f"TMDB: {self.requests} requests sent, {self.cache_hits} served from cache"
+        )
+
+    async def get(
+        self, url: str, params: Optional[dict] = None, headers: Optional[dict] = None
+    ) -> httpx.Response:
+        """Send a rate limited GET request, waiting out 429 responses
+
+        Args:
+            url (str): The API url
+            params (dict, optional): The query parameters
+            headers (dict, optional): Extra request headers
+
+        Returns:
+            httpx.Response: The last response received
+        """
+        for attempt in range(settings.TMDB_MAX_RETRIES + 1):
+            await self.limiter.acquire()
+            self.requests += 1
+            response = await outbound("tmdb").acall(
+                self.client.get, url, params=params, headers=headers
+            )
+            if response.status_code != 429 or attempt == settings.TMDB_MAX_RETRIES:
+                return response
+            delay = retry_after(response.headers.get("Retry-After"))
+            logger.warning(f"TMDB rate limit hit, retrying in {delay:.1f}s")
+            self.limiter.block(delay)
+        return response
+
+    async def get_json(
+        self, url: str, params: Optional[dict] = None, fresh: bool = False
+    ) -> Tuple[int, Dict[str, Any]]:
+        """GET a TMDB resource through the response cache
+
+        Args:
+            url (str): The API url
+            params (dict, optional): The query parameters
+            fresh (bool): Skip the cached copy, the response still replaces it
+
+        Returns:
+            tuple: The status code and the decoded body
+        """
+        if self.cache is None:
+            response = await self.get(url, params=params)
+            return response.status_code, response.json()
+        key = self.cache.key(url, params)
+        entry = None
+        if not fresh:
+            entry = await asyncio.to_thread(self.cache.get, key)
+        if entry is not None and entry["expires_at"] > datetime.now(timezone.utc):
+            self.cache_hits += 1
+            return entry["status"], entry["body"]
+        headers = {}
+        if entry is not None and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry is not None and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        response = await self.get(url, params=params, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            self.cache_hits += 1
+            await asyncio.to_thread(self.cache.touch, key, entry)
+            return entry["status"], entry["body"]
+        body = response.json()
+        await asyncio.to_thread(
+            self.cache.set, key, url, response.status_code, body, response.headers
+        )
+        return response.status_code, body
+
+    async def get_server_config(self) -> Dict[str, Any]:
         """Get the server config from the API
 
         Returns:
             dict: The server config
         """
-        url = "https://api.themoviedb.org/3/configuration"
-        response = self.client.get(url)
-        return response.json()
+        url = f"{settings.TMDB_API_URL}/configuration"
+        _, config = await self.get_json(url)
+        return config
 
     @staticmethod
     def export_data(data_type: str):
+        """Import a TMDB ID export into the cache collection of its type
+
+        The export is streamed and decompressed on the fly and written in
+        batches of TMDB_EXPORT_BATCH rows. The number of lines done is
+        checkpointed, so an interrupted import resumes where it stopped.
+
+        Args:
+            data_type (str): "movies" or "series"
+        """
         from main import mongo
 
-        date_str = (datetime.now(timezone.utc) - timedelta(days=1)).strftime("%m_%d_%Y")
-        type_name = "tv_series" if data_type == "series" else "movie"
-        export_url = (
-            f"http://files.tmdb.org/p/exports/{type_name}_ids_{date_str}.json.gz"
-        )
-        lines = (
-            gzip.decompress(httpx.get(export_url).content).decode("utf-8").splitlines()
-        )
+        cache_col = export_cache(data_type)
+        checkpoint = mongo.get_export_checkpoint(data_type)
+        if checkpoint is None:
+            checkpoint = {"date": export_date(), "lines": 0}
+            cache_col.delete_many({})
+            mongo.set_export_checkpoint(data_type, checkpoint)
+        else:
+            logger.info(
+                f"Resuming {data_type} ID export import at line {checkpoint['lines']}"
+            )
+        url = export_url(data_type, checkpoint["date"])
         bulk_action = []
-        chunks = [lines[i : i + 100000] for i in range(0, len(lines), 100000)]
-        total_chunks = len(chunks)
-        x = 1
-        logger.debug("Splitting %s items into chunks of 100,000 items" % len(lines))
-        for chunk in chunks:
-            for line in chunk:
+        line_number = 0
+        try:
+            for line_number, line in enumerate(export_lines(url), start=1):
+                if line_number <= checkpoint["lines"]:
+                    continue
                 try:
                     bulk_action.append(InsertOne(json.loads(line)))
-                except BaseException:
-                    pass
-            if data_type == "series":
-                mongo.series_cache_col.bulk_write(bulk_action)
-            else:
-                mongo.movies_cache_col.bulk_write(bulk_action)
-            logger.debug(f"Chunk {x}/{total_chunks}")
-            chunks[x - 1] = None
-            x += 1
-            bulk_action = []
+                except ValueError:
+                    continue
+                if len(bulk_action) >= settings.TMDB_EXPORT_BATCH:
+                    insert_ignoring_duplicates(cache_col, bulk_action)
+                    bulk_action = []
+                    checkpoint["lines"] = line_number
+                    mongo.set_export_checkpoint(data_type, checkpoint)
+                    logger.debug(f"Imported {line_number} {data_type} IDs")
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                # The export of the checkpoint is gone, start over next time
+                mongo.set_export_checkpoint(data_type, None)
+            raise
+        insert_ignoring_duplicates(cache_col, bulk_action)
+        logger.info(f"Imported {line_number} {data_type} IDs from the TMDB export")
+        mongo.set_export_checkpoint(data_type, None)
+        mongo.set_export_synced(data_type, checkpoint["date"])
         if data_type == "series":
             mongo.set_is_series_cache_init(True)
         else:
             mongo.set_is_movies_cache_init(True)
 
-    def get_episode_details(
+    @staticmethod
+    def sync_export(data_type: str):
+        """Apply the difference between the newest TMDB ID export and the cache
+
+        The stored rows are loaded as sorted ID / checksum arrays, every row
+        of the export is looked up in them and only new or changed rows are
+        upserted. Rows missing from the export are deleted afterwards, so the
+        collection and its text index stay usable during the whole sync.
+
+        Args:
+            data_type (str): "movies" or "series"
+        """
+        from main import mongo
+
+        cache_col = export_cache(data_type)
+        date = export_date()
+        ids, checksums = array("q"), array("I")
+        for doc in cache_col.find({}, {"_id": 0}).sort("id", ASCENDING):
+            ids.append(doc["id"])
+            checksums.append(fingerprint(doc))
+        seen = bytearray(len(ids))
+        bulk_action = []
+        inserted = updated = 0
+        for line in export_lines(export_url(data_type, date)):
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            i = bisect_left(ids, row["id"])
+            if i < len(ids) and ids[i] == row["id"]:
+                seen[i] = 1
+                if checksums[i] == fingerprint(row):
+                    continue
+                updated += 1
+            else:
+                inserted += 1
+            bulk_action.append(UpdateOne({"id": row["id"]}, {"$set": row}, upsert=True))
+            if len(bulk_action) >= settings.TMDB_EXPORT_BATCH:
+                cache_col.bulk_write(bulk_action, ordered=False)
+                bulk_action = []
+        if len(bulk_action) > 0:
+            cache_col.bulk_write(bulk_action, ordered=False)
+        removed = list(compress(ids, (not flag for flag in seen)))
+        for i in range(0, len(removed), settings.TMDB_EXPORT_BATCH):
+            chunk = removed[i : i + settings.TMDB_EXPORT_BATCH]
+            cache_col.delete_many({"id": {"$in": chunk}})
+        mongo.set_export_synced(data_type, date)
+        logger.info(
+            f"Synced {data_type} IDs with the {date} export: {inserted} new, "
+            f"{updated} changed, {len(removed)} removed"
+        )
+
+    async def identify(
+        self,
+        title: str,
+        data_type: str,
+        year: Optional[int] = None,
+        adult: bool = False,
+    ) -> Optional[int]:
+        """Get the TMDB ID of a title, see identify_many
+
+        Returns:
+            Optional[int]
+        """
+        return (await self.identify_many([(title, year)], data_type, adult))[0]
+
+    async def identify_many(
+        self,
+        queries: List[Tuple[str, Optional[int]]],
+        data_type: str,
+        adult: bool = False,
+    ) -> List[Optional[int]]:
+        """Get the TMDB IDs of many titles, remembering the answers
+
+        Titles are looked up once per rebuild, however many files share them,
+        and every definitive answer (a miss too) is persisted in the
+        identification cache. Titles the API search cannot find are matched
+        against the title index together, in one batch; when the API could
+        not answer at all, that guess is used without being remembered.
+
+        Args:
+            queries (list): (title, release year) pairs
+            data_type (str): The type of the titles
+            adult (bool): If the media is under adult category or not
+
+        Returns:
+            list: The TMDB ID of each query, None where nothing matched
+        """
+        from app.utils.matcher import match_titles
+        from app.utils.process_pool import map_batches
+
+        keys = [identify_key(title, data_type, year, adult) for title, year in queries]
+        pending = {
+            key: query for key, query in zip(keys, queries) if key not in self.resolved
+        }
+        searches = await asyncio.gather(
+            *(
+                self.search(key, title, data_type, year, adult)
+                for key, (title, year) in pending.items()
+            )
+        )
+        results = dict(zip(pending, searches))
+        failed = {key for key, result in results.items() if result is None}
+        for key in failed:
+            results[key] = (False, None)
+        unresolved = [
+            key for key, (cached, tmdb_id) in results.items() if not (cached or tmdb_id)
+        ]
+        if unresolved:
+            titles = [pending[key][0] for key in unresolved]
+            logger.debug(f"Advanced search identifying {len(titles)} title(s)")
+            matches = await map_batches(match_titles, titles, data_type)
+            has_index = get_title_index(data_type) is not None
+            for key, title, ranked in zip(unresolved, titles, matches):
+                tmdb_id = None
+                if ranked:
+                    tmdb_id = ranked[0][0]
+                    logger.debug(
+                        f"Matched '{title}' to {tmdb_id} with a score of {ranked[0][1]}"
+                    )
+                elif not has_index:
+                    tmdb_id = await self.find_media_id(
+                        title, data_type, use_api=False, adult=adult
+                    )
+                results[key] = (False, tmdb_id)
+        answers = {}
+        for key, (cached, tmdb_id) in results.items():
+            answers[key] = tmdb_id
+            if key in failed:
+                continue
+            if not cached:
+                await asyncio.to_thread(self.identify_cache.set, key, tmdb_id)
+            self.resolved[key] = tmdb_id
+        return [answers.get(key, self.resolved.get(key)) for key in keys]
+
+    async def search(
+        self,
+        key: str,
+        title: str,
+        data_type: str,
+        year: Optional[int] = None,
+        adult: bool = False,
+    ) -> Optional[Tuple[bool, Optional[int]]]:
+        """Look a title up in the identification cache, then with the API
+
+        Returns:
+            tuple: Whether the answer came from the cache, and the TMDB ID;
+                None if the API could not answer
+        """
+        entry = await asyncio.to_thread(self.identify_cache.get, key)
+        if entry is not None:
+            return True, entry["tmdb_id"]
+        try:
+            tmdb_id = await self.find_media_id(title, data_type, year=year, adult=adult)
+        except (httpx.HTTPError, CircuitOpenError, SearchError, ValueError) as e:
+            logger.warning(f"API search failed for '{title}': {e}")
+            return None
+        return False, tmdb_id
+
+    async def get_episode_details(
         self, tmdb_id: int, episode_number: int, season_number: int = 1
     ) -> Dict[str, Any]:
         """Get the details of a specific episode from the API
@@ -82,11 +716,11 @@ class TMDB:
         Returns:
             dict: The episode details
         """
-        url = f"https://api.themoviedb.org/3/tv/{tmdb_id}/season/{season_number}/episode/{episode_number}"
-        response = self.client.get(url)
-        return response.json() if response.status_code == 200 else {}
+        url = f"{settings.TMDB_API_URL}/tv/{tmdb_id}/season/{season_number}/episode/{episode_number}"
+        status, response = await self.get_json(url)
+        return response if status == 200 else {}
 
-    def find_media_id(
+    async def find_media_id(
         self,
         title: str,
         data_type: str,
@@ -107,6 +741,9 @@ class TMDB:
 
         Returns:
             Optional[int]
+
+        Raises:
+            SearchError: The API answered the search with an error
         """
         from app.utils.data import clean_file_name
 
@@ -120,8 +757,8 @@ class TMDB:
         if use_api:
             logger.debug(f"Trying search using API for '{title}'")
             type_name = "tv" if data_type == "series" else "movie"
-            resp = self.client.get(
-                f"https://api.themoviedb.org/3/search/{type_name}",
+            status, resp = await self.get_json(
+                f"{settings.TMDB_API_URL}/search/{type_name}",
                 params={
                     "query": title,
                     "primary_release_year": year,
@@ -130,89 +767,210 @@ class TMDB:
                     "language": "en-US",
                 },
             )
-            if resp.status_code == 200:
-                if data := resp.json()["results"]:
+            if status == 200:
+                if data := resp["results"]:
                     return data[0]["id"]
             else:
-                logger.warning(
-                    f"API search failed for '{title}' - The API said '{resp.json()['errors']}' with status code {resp.status_code}"
+                raise SearchError(
+                    f"The API said '{resp.get('errors') or resp.get('status_message')}' with status code {status}"
                 )
-                return
         else:
-            from main import mongo
-
             logger.debug(f"Trying search using key-value search for '{title}'")
-            if data_type == "series":
-                cache_col = mongo.series_cache_col
-            else:
-                cache_col = mongo.movies_cache_col
-            result = cache_col.aggregate(
+            return await asyncio.to_thread(self.search_cache, title, data_type)
+
+    @staticmethod
+    def search_cache(title: str, data_type: str) -> Optional[int]:
+        """Find a title in the exported ID cache
+
+        The local title index answers without any I/O; the database text
+        search is only used until the index is built.
+
+        Args:
+            title (str): The cleaned, lowercase title
+            data_type (str): The type of the title
+
+        Returns:
+            Optional[int]
+        """
+        from main import mongo
+
+        title_index = get_title_index(data_type)
+        if title_index is not None:
+            if tmdb_id := title_index.lookup(title):
+                return tmdb_id
+            logger.debug(f"Title index search failed for '{title}'")
+            return None
+        if data_type == "series":
+            cache_col = mongo.series_cache_col
+        else:
+            cache_col = mongo.movies_cache_col
+        result = list(
+            cache_col.aggregate(
                 [
                     {"$match": {"$text": {"$search": title}}},
                     {"$sort": {"score": {"$meta": "textScore"}, "popularity": -1}},
                     {"$limit": 20},
                 ]
             )
-            for each in result:
-                if title == each.get("original_title", "").lower().strip():
-                    return each["id"]
-            max_ratio, match = 0, None
-            matcher = SequenceMatcher(b=title)
-            for each in result:
-                matcher.set_seq1(each.get("original_title", "").lower().strip())
-                ratio = matcher.ratio()
-                if ratio > 0.99:
-                    return each
-                if ratio > max_ratio and ratio >= 0.85:
-                    max_ratio = ratio
-                    match = each
-            if match:
-                return match["id"]
-            logger.debug(f"Advanced difflib search failed for '{title}'")
-
-    def get_details(self, tmdb_id: int, data_type: str) -> Dict[str, Any]:
+        )
+        for each in result:
+            each_title = each.get("original_title") or each.get("original_name") or ""
+            each["title"] = each_title.lower().strip()
+            if title == each["title"]:
+                return each["id"]
+        max_ratio, match = 0, None
+        matcher = SequenceMatcher(b=title)
+        for each in result:
+            matcher.set_seq1(each["title"])
+            ratio = matcher.ratio()
+            if ratio > 0.99:
+                return each["id"]
+            if ratio > max_ratio and ratio >= 0.85:
+                max_ratio = ratio
+                match = each
+        if match:
+            return match["id"]
+        logger.debug(f"Advanced difflib search failed for '{title}'")
+
+    async def get_details(
+        self,
+        tmdb_id: int,
+        data_type: str,
+        seasons: Optional[Iterable[int]] = None,
+        fresh: bool = False,
+        language: Optional[str] = None,
+    ) -> Dict[str, Any]:
         """Get the details of a movie / series from the API
 
+        The details are always fetched in the base language, so every
+        language shares them through the response cache. Other languages
+        take their titles and overviews from the appended translations,
+        and series fetch their seasons once more for the episode names.
+
         Args:
             tmdb_id (int): The TMDB ID of the movie / series
             data_type (str): The type of the title
+            seasons (list, optional): The season numbers to include, all of
+                the seasons TMDB knows about if not given
+            fresh (bool): Bypass the response cache
+            language (str, optional): The language of the category
 
         Returns:
             dict: The details of the movie / series
+
+        Raises:
+            SearchError: TMDB does not know the title
+            ConnectionError: TMDB could not answer, the breaker included
         """
         type_name = "tv" if data_type == "series" else "movie"
-        url = f"https://api.themoviedb.org/3/{type_name}/{tmdb_id}"
-        params = {
-            "include_image_language": "en",
-            "append_to_response": "credits,images,external_ids,videos,reviews",
-        }
-        response = self.client.get(url, params=params).json()
-        length = len(response.get("seasons", []))
-        append_seasons = []
-        n_of_appends = ceil(length / 20)
-        x = 0
-        while x < n_of_appends:
-            append_seasons.append("")
-            for n in range((x * 20), ((x + 1) * 20)):
-                append_seasons[x] = append_seasons[x] + "season/" + str(n) + ","
-            append_seasons[x] = append_seasons[x][:-1]
-            x += 1
-        if type_name == "tv":
-            for n, append_season in enumerate(append_seasons):
-                params = {"append_to_response": append_season}
-                tmp_response = self.client.get(url, params=params).json()
-                season_keys = [k for k in tmp_response.keys() if "season/" in k]
-                for k in season_keys:
+        url = f"{settings.TMDB_API_URL}/{type_name}/{tmdb_id}"
+        if type_name == "tv" and seasons is None:
+            _, response = await self.get_json(url, fresh=fresh)
+            seasons = [s["season_number"] for s in response.get("seasons", [])]
+        batches = plan_details(data_type, seasons)
+        responses = await asyncio.gather(
+            *(
+                self.get_json(
+                    url,
+                    params={
+                        "include_image_language": "en",
+                        "append_to_response": ",".join(batch),
+                    },
+                    fresh=fresh,
+                )
+                for batch in batches
+            )
+        )
+        for status, _ in responses:
+            if status == 404:
+                raise SearchError(f"TMDB has no {type_name} with the ID {tmdb_id}")
+            if status != 200:
+                raise ConnectionError(
+                    f"TMDB answered the {type_name} {tmdb_id} with status code {status}"
+                )
+        _, response = responses[0]
+        for _, tmp_response in responses[1:]:
+            for k in tmp_response.keys():
+                if k.startswith("season/"):
                     response[k] = tmp_response[k]
-        else:
-            response = self.client.get(
-                url,
-                params={
-                    "include_image_language": "en",
-                    "append_to_response": "credits,images,external_ids,videos,reviews",
-                },
-            ).json()
-        # This limits the number of seasons to 17 seasons
-        # More requests need to be made in the event of additional seasons
-        # The data from those requests need to then be merged and returned
+        if is_base_language(language):
+            return response
+        response = translate(response, language)
+        if type_name == "tv" and seasons:
+            await self.translate_seasons(response, url, seasons, language, fresh)
         return response
+
+    async def translate_seasons(
+        self,
+        response: Dict[str, Any],
+        url: str,
+        seasons: Iterable[int],
+        language: str,
+        fresh: bool = False,
+    ):
+        """Overlay the season and episode names of a language on a series
+
+        Args:
+            response (dict): The series details, updated in place
+            url (str): The API url of the series
+            seasons (list): The season numbers to translate
+            language (str): The language of the category
+            fresh (bool): Bypass the response cache
+        """
+        appends = [f"season/{n}" for n in sorted(set(seasons))]
+        responses = await asyncio.gather(
+            *(
+                self.get_json(
+                    url,
+                    params={
+                        "language": language,
+                        "append_to_response": ",".join(appends[i : i + MAX_APPENDS]),
+                    },
+                    fresh=fresh,
+                )
+                for i in range(0, len(appends), MAX_APPENDS)
+            )
+        )
+        for status, translated in responses:
+            if status != 200:
+                continue
+            for key in appends:
+                season, local = response.get(key), translated.get(key)
+                if not season or not local:
+                    continue
+                for field in ("name", "overview"):
+                    season[field] = local.get(field) or season.get(field)
+                names = {e["episode_number"]: e for e in local.get("episodes", [])}
+                for episode in season.get("episodes", []):
+                    if local_episode := names.get(episode["episode_number"]):
+                        for field in ("name", "overview"):
+                            if local_episode.get(field):
+                                episode[field] = local_episode[field]
+
+    async def get_changes(self, data_type: str, start_date: datetime) -> Set[int]:
+        """Get the IDs of the titles changed on TMDB since a date
+
+        Args:
+            data_type (str): The type of the titles
+            start_date (datetime): The oldest change, at most 14 days ago
+
+        Returns:
+            set: The changed TMDB IDs
+        """
+        type_name = "tv" if data_type == "series" else "movie"
+        url = f"{settings.TMDB_API_URL}/{type_name}/changes"
+        params = {"start_date": start_date.strftime("%Y-%m-%d"), "page": 1}
+        changed: Set[int] = set()
+        while True:
+            response = await self.get(url, params=params)
+            if response.status_code != 200:
+                logger.warning(
+                    f"Could not get the {data_type} changes: {response.status_code}"
+                )
+                break
+            data = response.json()
+            changed.update(item["id"] for item in data.get("results", []))
+            if params["page"] >= data.get("total_pages", 1):
+                break
+            params["page"] += 1
+        return changed
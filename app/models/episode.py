@@ -1,4 +1,3 @@
-import re
 from app import logger
 from datetime import datetime
 from dateutil.parser import isoparse
@@ -11,6 +10,10 @@ class Episode:
         "path",
         "parent",
         "modified_time",
+        "mime_type",
+        "size",
+        "hashes",
+        "subtitles",
         "tmdb_id",
         "name",
         "overview",
@@ -27,6 +30,10 @@ class Episode:
             "path": self.path,
             "parent": self.parent,
             "modified_time": self.modified_time,
+            "mime_type": self.mime_type,
+            "size": self.size,
+            "hashes": self.hashes,
+            "subtitles": self.subtitles,
             "tmdb_id": self.tmdb_id,
             "name": self.name,
             "overview": self.overview,
@@ -43,6 +50,10 @@ class Episode:
         self.path: str = file_metadata["path"]
         self.parent: dict = file_metadata["parent"]
         self.modified_time: datetime = isoparse(file_metadata["modified_time"])
+        self.mime_type: str = file_metadata.get("mime_type")
+        self.size: int = file_metadata.get("size", -1)
+        self.hashes: dict = file_metadata.get("hashes", {})
+        self.subtitles: list = file_metadata.get("subtitles", [])
 
         parsed_data = self.parse_episode_filename(self.file_name)
         try:
@@ -83,19 +94,6 @@ class Episode:
         self.thumbnail_path: str = episode_metadata["still_path"]
 
     def parse_episode_filename(self, name: str) -> dict:
-        reg_exps = [
-            r".+?s ?(?P<season>\d{0,2})e ?(?P<episode>\d{0,4}).+",
-            r".+?e ?(?P<episode>\d{0,2})s ?(?P<season>\d{0,4}).+",
-            r".+?e ?(?P<episode>\d{0,4})",
-        ]
-        for exp in reg_exps:
-            if match := re.match(exp, name, flags=2):
-                data = match.groupdict()
-                if not data.get("season"):
-                    data["season"] = 1
-                if data.get("episode"):
-                    data["episode"] = int(data["episode"])
-                data["season"] = int(data["season"])
-                return data
-        else:
-            return {}
+        from app.utils.parser import episode_numbers
+
+        return episode_numbers(name)
@@ -10,6 +10,10 @@ class Movie:
         "path",
         "parent",
         "modified_time",
+        "mime_type",
+        "size",
+        "hashes",
+        "subtitles",
         "number_of_files",
         "rclone_index",
         "tmdb_id",
@@ -43,6 +47,10 @@ class Movie:
             "path": self.path,
             "parent": self.parent,
             "modified_time": self.modified_time,
+            "mime_type": self.mime_type,
+            "size": self.size,
+            "hashes": self.hashes,
+            "subtitles": self.subtitles,
             "number_of_files": self.number_of_files,
             "rclone_index": self.rclone_index,
             "tmdb_id": self.tmdb_id,
@@ -76,6 +84,10 @@ class Movie:
         self.path: list = [file_metadata["path"]]
         self.parent: list = [file_metadata["parent"]]
         self.modified_time: list = [isoparse(file_metadata["modified_time"])]
+        self.mime_type: list = [file_metadata.get("mime_type")]
+        self.size: list = [file_metadata.get("size", -1)]
+        self.hashes: list = [file_metadata.get("hashes", {})]
+        self.subtitles: list = [file_metadata.get("subtitles", [])]
         self.number_of_files: int = 1
         self.rclone_index: int = rclone_index
 
@@ -114,6 +126,10 @@ class Movie:
         self.path.append(file_metadata["path"])
         self.parent.append(file_metadata["parent"])
         self.modified_time.append(isoparse(file_metadata["modified_time"]))
+        self.mime_type.append(file_metadata.get("mime_type"))
+        self.size.append(file_metadata.get("size", -1))
+        self.hashes.append(file_metadata.get("hashes", {}))
+        self.subtitles.append(file_metadata.get("subtitles", []))
         self.number_of_files += 1
 
     def get_logo(self, media_metadata: dict) -> str:
@@ -13,6 +13,37 @@ class _Settings(BaseSettings):
     DEVELOPMENT: bool = getenv("DESTER_DEV", "").lower() == "true"
 
     RCLONE_LISTEN_PORT: int = int(getenv("RCLONE_LISTEN_PORT", "35530"))
+    RCLONE_SHARDS: int = int(getenv("RCLONE_SHARDS", "1"))
+    RCLONE_JOB_TIMEOUT: int = int(getenv("RCLONE_JOB_TIMEOUT", "3600"))
+    RCLONE_WARMUP_CONCURRENCY: int = int(getenv("RCLONE_WARMUP_CONCURRENCY", "2"))
+
+    SUBTITLE_CACHE_TTL: int = int(getenv("SUBTITLE_CACHE_TTL", "604800"))
+
+    LOCAL_WATCH: bool = getenv("LOCAL_WATCH", "true").lower() == "true"
+    LOCAL_WATCH_DEBOUNCE: float = float(getenv("LOCAL_WATCH_DEBOUNCE", "5"))
+
+    TMDB_API_URL: str = getenv("TMDB_API_URL", "https://api.themoviedb.org/3")
+    TMDB_RATE_LIMIT: float = float(getenv("TMDB_RATE_LIMIT", "40"))
+    TMDB_CONCURRENCY: int = int(getenv("TMDB_CONCURRENCY", "20"))
+    TMDB_MAX_RETRIES: int = int(getenv("TMDB_MAX_RETRIES", "5"))
+    TMDB_EXPORT_BATCH: int = int(getenv("TMDB_EXPORT_BATCH", "10000"))
+    TMDB_EXPORT_SYNC_INTERVAL: int = int(getenv("TMDB_EXPORT_SYNC_INTERVAL", "3600"))
+    TMDB_CACHE: bool = getenv("TMDB_CACHE", "true").lower() == "true"
+    TMDB_CACHE_GRACE: int = int(getenv("TMDB_CACHE_GRACE", "2592000"))
+
+    IDENTIFY_CACHE_TTL: int = int(getenv("IDENTIFY_CACHE_TTL", "2592000"))
+    IDENTIFY_MISS_TTL: int = int(getenv("IDENTIFY_MISS_TTL", "86400"))
+
+    METADATA_REFRESH_INTERVAL: int = int(getenv("METADATA_REFRESH_INTERVAL", "3600"))
+    METADATA_WORKERS: int = int(getenv("METADATA_WORKERS", "0"))
+    METADATA_WORKER_BATCH: int = int(getenv("METADATA_WORKER_BATCH", "256"))
+    METADATA_BATCH: int = int(getenv("METADATA_BATCH", "100"))
+    METADATA_QUEUE_SIZE: int = int(getenv("METADATA_QUEUE_SIZE", "4"))
+    METADATA_WRITE_BATCH: int = int(getenv("METADATA_WRITE_BATCH", "500"))
+
+    OUTBOUND_BACKOFF: float = float(getenv("OUTBOUND_BACKOFF", "0.5"))
+    OUTBOUND_BREAKER_THRESHOLD: int = int(getenv("OUTBOUND_BREAKER_THRESHOLD", "5"))
+    OUTBOUND_BREAKER_RESET: float = float(getenv("OUTBOUND_BREAKER_RESET", "30"))
 
     MONGODB_DOMAIN: str = getenv("MONGODB_DOMAIN")
     MONGODB_USERNAME: str = getenv("MONGODB_USERNAME")
@@ -1,3 +1,5 @@
+from .run_sync import run_sync
+from .process_pool import map_batches
 from .time_formatter import time_formatter
 from .data import (
     parse_filename, clean_file_name, parse_episode_filename,
@@ -1,11 +1,13 @@
-import re
+import asyncio
 from app import logger
 from copy import deepcopy
 from functools import reduce
-from pymongo import InsertOne
 from app.models import Movie, Serie
 from collections import defaultdict
-from typing import Any, Dict, Optional
+from app.core.tmdb import SearchError
+from app.utils.process_pool import map_batches
+from typing import Any, Dict, List, Tuple, Iterable, Optional
+from app.utils.parser import clean, parse_names, match_title, episode_numbers
 
 
 def group_by(key, seq):
@@ -42,143 +44,219 @@ def sort_by_type(metadata: Dict[str, Any] = {}) -> Dict[str, Any]:
     return data
 
 
+def index_hashes(
+    groups: Dict[tuple, List[Tuple[int, str]]],
+    files: List[Dict[str, Any]],
+    rclone_index: int,
+):
+    """Add the files of a category to a map of their content keys
+
+    Only the category and path of each file are kept, so the map stays
+    small however many files are scanned.
+
+    Args:
+        groups (dict): (hash type, hash, size) to (rclone index, path) pairs
+        files (list): File records with "hashes" and "size" keys
+        rclone_index (int): The category of the files
+    """
+    for file in files:
+        for hash_type, value in (file.get("hashes") or {}).items():
+            if value:
+                groups[(hash_type, value, file.get("size"))].append(
+                    (rclone_index, file["path"])
+                )
+
+
+def find_duplicates(
+    groups: Dict[tuple, List[Tuple[int, str]]]
+) -> List[List[Tuple[int, str]]]:
+    """Get the files sharing a provider hash
+
+    Args:
+        groups (dict): A map filled by index_hashes
+
+    Returns:
+        list: Groups of two or more files with the same content
+    """
+    duplicates: List[List[Tuple[int, str]]] = []
+    seen = set()
+    for group in groups.values():
+        key = tuple(sorted(group))
+        if len(group) > 1 and key not in seen:
+            seen.add(key)
+            duplicates.append(group)
+    return duplicates
+
+
 def parse_filename(name: str, data_type: str):
-    reg_exps = (
-        [
-            # (2019) The Mandalorian
-            r"^[\(\[\{](?P<year>\d{4})[\)\]\}]\s(?P<title>[^.]+).*$",
-            # The Mandalorian (2019)
-            r"^(?P<title>.*)\s[\(\[\{](?P<year>\d{4})[\)\]\}].*$",
-            # The.Mandalorian.2019.1080p.WEBRip
-            r"^(?P<title>(?:(?!\.\d{4}).)*)\.(?P<year>\d{4}).*$",
-            # The Mandalorian
-            r"^(?P<year>)(?P<title>.*)$",
-        ]
-        if data_type == "series"
-        else [
-            # (2008) Iron Man.mkv
-            r"^[\(\[\{](?P<year>\d{4})[\)\]\}]\s(?P<title>[^.]+).*(?P<extention>\..*)?$",
-            # Iron Man (2008).mkv
-            r"^(?P<title>.*)\s[\(\[\{](?P<year>\d{4})[\)\]\}].*(?P<extention>\..*)?$",
-            # Iron.Man.2008.1080p.WEBRip.DDP5.1.Atmos.x264.mkv
-            # r"^(?P<title>(?:(?!\.\d{4}).)*)\.(?P<year>\d{4}).*(?P<extention>\..*)?$",
-            r"^(?P<title>(?:(?!\.\d{4}).)*)\.(?P<year>\d{4}).*?(?P<extention>\.\w+)?$",
-            # Iron Man.mkv
-            r"^(?P<year>)(?P<title>.*).*(?P<extention>\..*?)?",
-        ]
-    )
-    for exp in reg_exps:
-        if match := re.match(exp, name):
-            data = match.groupdict()
-            data["title"] = data["title"].strip().replace(".", " ")
-            return data
-    else:
-        return {}
+    return match_title(name, data_type)
 
 
 def parse_episode_filename(name: str):
-    reg_exps = [
-        r".+?s ?(?P<season>\d{0,2})e ?(?P<episode>\d{0,4}).+",
-        r".+?e ?(?P<episode>\d{0,2})s ?(?P<season>\d{0,4}).+",
-        r".+?e ?(?P<episode>\d{0,4})",
-    ]
-    for exp in reg_exps:
-        if match := re.match(exp, name, flags=2):
-            data = match.groupdict()
-            if not data.get("season"):
-                data["season"] = 1
-            if data.get("episode"):
-                data["episode"] = int(data["episode"])
-            data["season"] = int(data["season"])
-            return data
-    else:
-        return {}
+    return episode_numbers(name)
 
 
 def clean_file_name(name: str) -> str:
-    reg_exps = [
-        r"\((?:\D.+?|.+?\D)\)|\[(?:\D.+?|.+?\D)\]",  # (2016), [2016], etc
-        r"\(?(?:240|360|480|720|1080|1440|2160)p?\)?",  # 1080p, 720p, etc
-        r"\b(?:mp4|mkv|wmv|m4v|mov|avi|flv|webm|flac|mka|m4a|aac|ogg)\b",  # file types
-        r"season ?\d+?",  # season 1, season 2, etc
-        # more stuffs
-        r"(?:S\d{1,3}|\d+?bit|dsnp|web\-dl|ddp\d+? ? \d|hevc|hdrip|\-?Vyndros)",
-        # URLs in filenames
-        r"^(?:https?:\/\/)?(?:www.)?[a-z0-9]+\.[a-z]+(?:\/[a-zA-Z0-9#]+\/?)*$",
-    ]
-    for reg in reg_exps:
-        name = re.sub(reg, "", name, flags=re.I)
-    return name.strip().rstrip(".-_")
-
-
-def generate_movie_metadata(
-    tmdb, data: Dict[str, Any], rclone_index: int
-) -> Dict[str, Any]:
-    advanced_search_list = []
-    identified_list: Dict[int, Movie] = {}
-    for drive_meta in data:
-        original_name = drive_meta["name"]
-        cleaned_title = clean_file_name(original_name)
-        name_year = parse_filename(cleaned_title, "movies")
-        name = name_year.get("title")
-        year = name_year.get("year")
-        tmdb_id = tmdb.find_media_id(name, "movies", year=year)
-        if not tmdb_id:
-            advanced_search_list.append((name, year))
-            logger.info(f"Could not identify: {name}")
-            continue
-        logger.info(
-            f"Successfully identified: {name} {f'({year})' if year else ''}    ID: {tmdb_id}"
-        )
-        identified_match = identified_list.get(tmdb_id)
-        if identified_match:
-            identified_match.append_file(drive_meta)
-        else:
-            movie_info = tmdb.get_details(tmdb_id, "movies")
-            curr_metadata: Movie = Movie(drive_meta, movie_info, rclone_index)
-            identified_list[tmdb_id] = curr_metadata
-    for name, year in advanced_search_list:
-        logger.debug(f"Advanced search identifying: {cleaned_title}")
-        tmdb_id = tmdb.find_media_id(name, "movies", year=year, use_api=False)
-        if not tmdb_id:
-            logger.info(f"Advanced search could not identify: '{name}'")
-            continue
-        logger.info(
-            f"Advanced search successfully identified: {name} {f'({year})' if year else ''}    ID: {tmdb_id}"
-        )
-        identified_match = identified_list.get(tmdb_id)
-        if identified_match:
-            identified_match.append_file(drive_meta)
-        else:
-            movie_info = tmdb.get_details(tmdb_id, "movies")
-            curr_metadata: Movie = Movie(drive_meta, movie_info, rclone_index)
-            identified_list[tmdb_id] = curr_metadata
+    return clean(name)
+
+
+def build_movies(
+    items: List[Tuple[List[Dict[str, Any]], Dict[str, Any]]], rclone_index: int
+) -> List[Optional[Dict[str, Any]]]:
+    """Build the documents of movies from their files and TMDB details
+
+    Returns:
+        list: The document of each movie, None where TMDB lacks a field
+    """
     metadata = []
-    for item in identified_list.values():
-        metadata.append(InsertOne(item.__dict__()))
+    for files, movie_info in items:
+        try:
+            curr_metadata: Movie = Movie(files[0], movie_info, rclone_index)
+            for drive_meta in files[1:]:
+                curr_metadata.append_file(drive_meta)
+            metadata.append(curr_metadata.__dict__())
+        except (KeyError, TypeError, ValueError):
+            metadata.append(None)
     return metadata
 
 
-def generate_series_metadata(
-    tmdb, data: Dict[str, Any], rclone_index: int
-) -> Dict[str, Any]:
+def build_series(
+    items: List[Tuple[Dict[str, Any], Dict[str, Any]]], rclone_index: int
+) -> List[Optional[Dict[str, Any]]]:
+    """Build the documents of series from their directories and TMDB details
+
+    Returns:
+        list: The document of each series, None where TMDB lacks a field
+    """
     metadata = []
-    for drive_meta in data:
-        original_name = drive_meta["name"]
-        cleaned_title = clean_file_name(original_name)
-        name_year = parse_filename(cleaned_title, "series")
-        name = name_year.get("title")
-        year = name_year.get("year")
-        tmdb_id = tmdb.find_media_id(name, "series", year=year)
+    for drive_meta, series_info in items:
+        try:
+            metadata.append(Serie(drive_meta, series_info, rclone_index).__dict__())
+        except (KeyError, TypeError, ValueError):
+            metadata.append(None)
+    return metadata
+
+
+def built(
+    items: List[Tuple[Any, Dict[str, Any]]], docs: List[Optional[Dict[str, Any]]]
+) -> List[Tuple[Any, Dict[str, Any]]]:
+    """Pair built documents with their files, logging the ones that failed"""
+    result = []
+    for (files, info), doc in zip(items, docs):
+        if doc is None:
+            logger.warning(f"Could not build the metadata of TMDB ID {info.get('id')}")
+            continue
+        result.append((files, doc))
+    return result
+
+
+async def identify(
+    tmdb, data: List[Dict[str, Any]], data_type: str
+) -> List[Optional[int]]:
+    """Find the TMDB IDs of scanned items, all in one batch"""
+    names = [drive_meta["name"] for drive_meta in data]
+    queries = [
+        (parsed.title, parsed.year)
+        for parsed in await map_batches(parse_names, names, data_type)
+    ]
+    tmdb_ids = await tmdb.identify_many(queries, data_type)
+    for (name, year), tmdb_id in zip(queries, tmdb_ids):
         if not tmdb_id:
-            tmdb_id = tmdb.find_media_id(name, "series", year=year, use_api=False)
-            if not tmdb_id:
-                logger.info(f"Could not identify: '{name}'")
-                continue
+            logger.info(f"Could not identify: '{name}'")
+            continue
         logger.info(
             f"Successfully identified: {name} {f'({year})' if year else ''}    ID: {tmdb_id}"
         )
-        series_info = tmdb.get_details(tmdb_id, "series")
-        curr_metadata: Serie = Serie(drive_meta, series_info, rclone_index)
-        metadata.append(InsertOne(curr_metadata.__dict__()))
-    return metadata
+    return tmdb_ids
+
+
+def fetched(results: Iterable[Tuple[int, Any, Any]]) -> List[Tuple[Any, Any]]:
+    """Drop the titles whose details are unusable, logging why
+
+    Only data errors skip a title. A transport error or an open breaker is
+    raised again, so a rebuild stops and keeps the live library rather than
+    swapping in one without those titles.
+    """
+    items = []
+    for tmdb_id, files, info in results:
+        if isinstance(info, (SearchError, KeyError, TypeError, ValueError)):
+            logger.warning(f"Could not get the details of TMDB ID {tmdb_id}: {info}")
+            continue
+        if isinstance(info, BaseException):
+            raise info
+        items.append((files, info))
+    return items
+
+
+async def fetch_movie_details(
+    tmdb,
+    data: List[Dict[str, Any]],
+    tmdb_ids: List[Optional[int]],
+    language: Optional[str] = None,
+) -> List[Tuple[List[Dict[str, Any]], Dict[str, Any]]]:
+    """Get the details of identified movies, with the files of each one"""
+    identified_list: Dict[int, List[Dict[str, Any]]] = {}
+    for drive_meta, tmdb_id in zip(data, tmdb_ids):
+        if tmdb_id:
+            identified_list.setdefault(tmdb_id, []).append(drive_meta)
+    # Every movie is fetched once, however many files it has
+    movies_info = await asyncio.gather(
+        *(
+            tmdb.get_details(tmdb_id, "movies", language=language)
+            for tmdb_id in identified_list
+        ),
+        return_exceptions=True,
+    )
+    return fetched(zip(identified_list, identified_list.values(), movies_info))
+
+
+async def fetch_series_details(
+    tmdb,
+    data: List[Dict[str, Any]],
+    tmdb_ids: List[Optional[int]],
+    language: Optional[str] = None,
+) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """Get the details of identified series, for the seasons on disk"""
+    identified = [
+        (drive_meta, tmdb_id) for drive_meta, tmdb_id in zip(data, tmdb_ids) if tmdb_id
+    ]
+    series_info = await asyncio.gather(
+        *(
+            tmdb.get_details(
+                tmdb_id,
+                "series",
+                [int(key) for key in drive_meta["seasons"] if key.isdigit()],
+                language=language,
+            )
+            for drive_meta, tmdb_id in identified
+        ),
+        return_exceptions=True,
+    )
+    return fetched(
+        (tmdb_id, drive_meta, info)
+        for (drive_meta, tmdb_id), info in zip(identified, series_info)
+    )
+
+
+async def generate_movie_metadata(
+    tmdb,
+    data: List[Dict[str, Any]],
+    rclone_index: int,
+    language: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    tmdb_ids = await identify(tmdb, data, "movies")
+    items = await fetch_movie_details(tmdb, data, tmdb_ids, language)
+    docs = await map_batches(build_movies, items, rclone_index)
+    return [doc for _, doc in built(items, docs)]
+
+
+async def generate_series_metadata(
+    tmdb,
+    data: List[Dict[str, Any]],
+    rclone_index: int,
+    language: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    tmdb_ids = await identify(tmdb, data, "series")
+    items = await fetch_series_details(tmdb, data, tmdb_ids, language)
+    docs = await map_batches(build_series, items, rclone_index)
+    return [doc for _, doc in built(items, docs)]
@@ -0,0 +1,113 @@
+import numpy as np
+from typing import List, Tuple
+from difflib import SequenceMatcher
+from app.core.identify import normalize_title
+from app.core.title_index import COMMON_TRIGRAM, trigram_hashes, get_title_index
+
+
+QUERY_CHUNK = 64
+# Trigram candidates confirmed with difflib per title
+CANDIDATES = 20
+
+
+def match_titles(
+    titles: List[str],
+    data_type: str,
+    limit: int = 3,
+    min_score: float = 0.3,
+    cutoff: float = 0.85,
+) -> List[List[Tuple[int, float]]]:
+    """Match many titles against the title index in one go
+
+    The posting lists of the trigrams of a whole chunk of titles are
+    concatenated, tagged with the title they were looked up for, and
+    counted with a single np.unique. That gives the shared trigrams of
+    every (title, candidate) pair, and from them the Jaccard similarity.
+
+    The vectorized Jaccard only narrows the index down to CANDIDATES per
+    title; difflib is the final scorer, and its ratio is what ranks and is
+    returned. Jaccard ignores the order of trigrams and rewards titles
+    contained in longer ones ("the matrix" shares half its trigrams with
+    "the matrix reloaded"), and no Jaccard threshold separates those from
+    true matches. Using the ratio and cutoff of TitleIndex.lookup keeps
+    the batched and single lookups agreeing on what a match is. That
+    leaves at most CANDIDATES difflib comparisons of short strings per
+    title. Exact titles score 1.0. Ties are broken by popularity; the
+    export has no release years, so those cannot take part.
+
+    Args:
+        titles (list): The titles to match
+        data_type (str): "movies" or "series"
+        limit (int): The most matches returned per title
+        min_score (float): The lowest Jaccard similarity of a candidate
+        cutoff (float): The lowest difflib ratio of a match
+
+    Returns:
+        list: For every title, (TMDB ID, ratio) pairs from best to worst
+    """
+    results: List[List[Tuple[int, float]]] = [[] for _ in titles]
+    index = get_title_index(data_type)
+    if index is None:
+        return results
+    queries: List[Tuple[int, str, np.ndarray]] = []
+    for i, title in enumerate(titles):
+        title = normalize_title(title)
+        if not title:
+            continue
+        exact = index.exact(title)
+        if exact:
+            exact.sort(key=lambda position: -index.popularity[position])
+            results[i] = [(int(index.ids[p]), 1.0) for p in exact[:limit]]
+            continue
+        queries.append((i, title, trigram_hashes(title)))
+
+    for start in range(0, len(queries), QUERY_CHUNK):
+        chunk = queries[start : start + QUERY_CHUNK]
+        sizes = np.array([len(hashes) for _, _, hashes in chunk], dtype=np.float32)
+        owners = np.repeat(np.arange(len(chunk)), sizes.astype(np.int64))
+        hashes = np.concatenate([hashes for _, _, hashes in chunk])
+        keys = np.searchsorted(index.trigram_keys, hashes)
+        found = keys < len(index.trigram_keys)
+        found[found] = index.trigram_keys[keys[found]] == hashes[found]
+        owners, keys = owners[found], keys[found]
+        starts = index.trigram_starts[keys].astype(np.int64)
+        lengths = index.trigram_starts[keys + 1].astype(np.int64) - starts
+        common = lengths > COMMON_TRIGRAM
+        owners, starts, lengths = owners[~common], starts[~common], lengths[~common]
+        if len(lengths) == 0:
+            continue
+        # Expand every (owner, posting list) into one row per posting
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        positions = index.postings[np.arange(offsets.size) + offsets]
+        pairs = np.repeat(owners, lengths).astype(np.uint64) << np.uint64(32)
+        pairs |= positions.astype(np.uint64)
+        pairs, shared = np.unique(pairs, return_counts=True)
+        owners = (pairs >> np.uint64(32)).astype(np.int64)
+        positions = (pairs & np.uint64(0xFFFFFFFF)).astype(np.int64)
+        union = sizes[owners] + index.trigram_counts[positions] - shared
+        scores = shared / union
+        keep = scores >= min_score
+        owners, positions, scores = owners[keep], positions[keep], scores[keep]
+        order = np.lexsort((-index.popularity[positions], -scores, owners))
+        owners, positions, scores = owners[order], positions[order], scores[order]
+        firsts = np.searchsorted(owners, np.arange(len(chunk)))
+        for row, (i, title, _) in enumerate(chunk):
+            first = firsts[row]
+            last = first
+            while (
+                last < len(owners) and owners[last] == row and last - first < CANDIDATES
+            ):
+                last += 1
+            matcher = SequenceMatcher(b=title)
+            matches = []
+            for k in range(first, last):
+                matcher.set_seq1(index[positions[k]])
+                ratio = matcher.ratio()
+                if ratio >= cutoff:
+                    matches.append((ratio, float(index.popularity[positions[k]]), k))
+            matches.sort(reverse=True)
+            results[i] = [
+                (int(index.ids[positions[k]]), round(ratio, 4))
+                for ratio, _, k in matches[:limit]
+            ]
+    return results
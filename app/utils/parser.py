@@ -0,0 +1,199 @@
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple, Iterable, Optional
+
+
+EXTENSIONS = r"(?:mp4|mkv|wmv|m4v|mov|avi|flv|webm|flac|mka|m4a|aac|ogg)"
+# Everything that is not part of a title, removed in one substitution
+CLEAN = re.compile(
+    "|".join(
+        [
+            r"\((?:\D.+?|.+?\D)\)|\[(?:\D.+?|.+?\D)\]",  # (2016), [2016], etc
+            r"\(?(?:240|360|480|720|1080|1440|2160)p?\)?",  # 1080p, 720p, etc
+            rf"\b{EXTENSIONS}\b",  # file types
+            r"season ?\d+?",  # season 1, season 2, etc
+            r"(?:S\d{1,3}|\d+?bit|dsnp|web\-dl|ddp\d+? ? \d|hevc|hdrip|\-?Vyndros)",
+            # URLs in filenames, "Title.mkv" is not one
+            rf"^(?:https?:\/\/)?(?:www.)?[a-z0-9]+\.(?!{EXTENSIONS}$)[a-z]+"
+            r"(?:\/[a-zA-Z0-9#]+\/?)*$",
+        ]
+    ),
+    re.I,
+)
+
+TITLE_PATTERNS: Dict[str, Tuple[re.Pattern, ...]] = {
+    "series": tuple(
+        re.compile(exp)
+        for exp in (
+            # (2019) The Mandalorian
+            r"^[\(\[\{](?P<year>\d{4})[\)\]\}]\s(?P<title>[^.]+).*$",
+            # The Mandalorian (2019)
+            r"^(?P<title>.*)\s[\(\[\{](?P<year>\d{4})[\)\]\}].*$",
+            # The.Mandalorian.2019.1080p.WEBRip
+            r"^(?P<title>(?:(?!\.\d{4}).)*)\.(?P<year>\d{4}).*$",
+            # The Mandalorian
+            r"^(?P<year>)(?P<title>.*)$",
+        )
+    ),
+    "movies": tuple(
+        re.compile(exp)
+        for exp in (
+            # (2008) Iron Man.mkv
+            r"^[\(\[\{](?P<year>\d{4})[\)\]\}]\s(?P<title>[^.]+).*(?P<extention>\..*)?$",
+            # Iron Man (2008).mkv
+            r"^(?P<title>.*)\s[\(\[\{](?P<year>\d{4})[\)\]\}].*(?P<extention>\..*)?$",
+            # Iron.Man.2008.1080p.WEBRip.DDP5.1.Atmos.x264.mkv
+            r"^(?P<title>(?:(?!\.\d{4}).)*)\.(?P<year>\d{4}).*?(?P<extention>\.\w+)?$",
+            # Iron Man.mkv
+            r"^(?P<year>)(?P<title>.*).*(?P<extention>\..*?)?",
+        )
+    ),
+}
+
+# Every marker of a release name, found in a single scan
+TOKENS = re.compile(
+    r"""
+    (?<![a-z\d])(?:
+        (?P<marker>s(?P<marker_season>\d{1,3})[ ._-]?e(?P<marker_episode>\d{1,4})
+            (?:[ ._-]?e\d{1,4})*)
+        |(?P<cross>(?P<cross_season>\d{1,2})x(?P<cross_episode>\d{2,3}))
+        |(?P<season>season[ ._-]?(?P<season_number>\d{1,3}))
+        |(?P<short_season>s(?P<short_season_number>\d{1,3}))
+        |(?P<episode>(?:episode|ep)[ ._-]?(?P<episode_number>\d{1,4}))
+        |(?P<short_episode>e(?P<short_episode_number>\d{1,4}))
+        |(?P<resolution>(?P<height>240|360|480|576|720|1080|1440|2160)[pi]|4k|uhd)
+        |(?P<tag>web[ .-]?dl|webrip|web|blu[ .-]?ray|bdrip|brrip|dvdrip|hdrip|hdtv
+            |remux|hdr10\+?|hdr|dovi|x26[45]|h[ .]?26[45]|hevc|avc|10bit|atmos
+            |ddp?[ .]?[257][ .][01]|aac|dts(?:-hd)?|truehd|proper|repack|extended
+            |imax|remastered|uncut|dsnp|amzn|nf|hmax|atvp)
+    )(?![a-z\d])
+    |(?P<absolute>(?<=\s-\s)(?!(?:19|20)\d\d(?![a-z\d]))
+        (?P<absolute_number>\d{1,4})(?![a-z\d]))
+    """,
+    re.I | re.X,
+)
+
+
+@dataclass(frozen=True)
+class ParsedName:
+    """Everything read from a file or folder name"""
+
+    title: str
+    year: Optional[int]
+    season: Optional[int]
+    episode: Optional[int]
+    resolution: Optional[str]
+    tags: Tuple[str, ...]
+
+
+def clean(name: str) -> str:
+    """Strip resolutions, extensions and release tags off a name"""
+    return CLEAN.sub("", name).strip().rstrip(".-_")
+
+
+def match_title(name: str, data_type: str) -> Dict[str, Any]:
+    """Split a cleaned name into its title and year
+
+    Returns:
+        dict: The title and the year, as strings, empty if nothing matched
+    """
+    for pattern in TITLE_PATTERNS[data_type]:
+        if match := pattern.match(name):
+            data = match.groupdict()
+            data["title"] = data["title"].strip().replace(".", " ")
+            return data
+    return {}
+
+
+def scan(name: str) -> Tuple[int, Dict[str, Any]]:
+    """Find the season, episode, resolution and tags of a name
+
+    The first marker of each kind wins; a lone absolute number ("Show -
+    05") only counts when nothing else names the episode. Release tags
+    are also words of real titles ("Charlotte's Web"), so only the other
+    markers end the title.
+
+    Returns:
+        tuple: Where the title ends, and the markers found
+    """
+    season = episode = absolute = resolution = None
+    tags: List[str] = []
+    end = len(name)
+    for match in TOKENS.finditer(name):
+        kind = match.lastgroup
+        if kind != "tag" and match.start() > 0:
+            end = min(end, match.start())
+        if kind == "marker" or kind == "cross":
+            if episode is None:
+                season = int(match[f"{kind}_season"])
+                episode = int(match[f"{kind}_episode"])
+        elif kind == "season" or kind == "short_season":
+            if season is None:
+                season = int(match[f"{kind}_number"])
+        elif kind == "episode" or kind == "short_episode":
+            if episode is None:
+                episode = int(match[f"{kind}_number"])
+        elif kind == "absolute":
+            if absolute is None:
+                absolute = int(match["absolute_number"])
+        elif kind == "resolution":
+            if resolution is None:
+                height = match["height"]
+                resolution = f"{height}p" if height else "2160p"
+        else:
+            tag = re.sub(r"[ .-]", "", match[kind].lower())
+            if tag not in tags:
+                tags.append(tag)
+    if episode is None:
+        episode = absolute
+    return end, {
+        "season": season,
+        "episode": episode,
+        "resolution": resolution,
+        "tags": tuple(tags),
+    }
+
+
+@lru_cache(maxsize=65536)
+def parse(name: str, data_type: str = "movies") -> ParsedName:
+    """Parse a release name
+
+    Args:
+        name (str): A file or folder name
+        data_type (str): "movies" or "series"
+
+    Returns:
+        ParsedName: The parts of the name
+    """
+    end, markers = scan(name)
+    title_year = match_title(clean(name[:end]), data_type)
+    year = title_year.get("year")
+    return ParsedName(
+        title=title_year.get("title") or "", year=int(year) if year else None, **markers
+    )
+
+
+def parse_names(names: Iterable[str], data_type: str = "movies") -> List[ParsedName]:
+    """Parse many release names, each distinct name only once
+
+    Args:
+        names (list): File or folder names
+        data_type (str): "movies" or "series"
+
+    Returns:
+        list: A ParsedName for each name, in order
+    """
+    return [parse(name, data_type) for name in names]
+
+
+def episode_numbers(name: str) -> Dict[str, int]:
+    """The season and episode of an episode file, season 1 if it has none
+
+    Returns:
+        dict: The season and the episode, empty if there is no episode
+    """
+    parsed = parse(name, "series")
+    if parsed.episode is None:
+        return {}
+    return {"season": parsed.season or 1, "episode": parsed.episode}
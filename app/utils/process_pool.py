@@ -0,0 +1,83 @@
+import os
+import math
+import asyncio
+import multiprocessing
+from app import logger
+from threading import Lock
+from app.settings import settings
+from typing import Any, List, Callable, Optional, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+pool: Optional[ProcessPoolExecutor] = None
+pool_lock = Lock()
+
+
+def worker_count() -> int:
+    return settings.METADATA_WORKERS or os.cpu_count() or 1
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """The shared pool for CPU bound metadata work, started on first use
+
+    By then the server runs many threads, and a forked child could inherit
+    a lock one of them was holding, so workers come from a fork server or
+    are spawned. They import the app again, without its log file.
+    """
+    global pool
+    with pool_lock:
+        if pool is None:
+            method = (
+                "forkserver"
+                if "forkserver" in multiprocessing.get_all_start_methods()
+                else "spawn"
+            )
+            pool = ProcessPoolExecutor(
+                max_workers=worker_count(),
+                mp_context=multiprocessing.get_context(method),
+            )
+        return pool
+
+
+def shutdown_process_pool():
+    global pool
+    with pool_lock:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+            pool = None
+
+
+async def map_batches(
+    fn: Callable[..., List[Any]], items: Sequence[Any], *args: Any
+) -> List[Any]:
+    """Run a batch function over items on the process pool
+
+    The items are split evenly between the workers, in chunks of at most
+    METADATA_WORKER_BATCH, so every worker gets a share while each chunk
+    costs a single round trip.
+
+    Args:
+        fn (callable): A module level function taking a list of items and
+            returning one result per item
+        items (list): The items
+        *args: Extra arguments passed with every chunk
+
+    Returns:
+        list: The results of every item, in order
+    """
+    if len(items) == 0:
+        return []
+    loop = asyncio.get_running_loop()
+    size = min(settings.METADATA_WORKER_BATCH, math.ceil(len(items) / worker_count()))
+    chunks = [list(items[i : i + size]) for i in range(0, len(items), size)]
+    try:
+        executor = get_process_pool()
+        results = await asyncio.gather(
+            *(loop.run_in_executor(executor, fn, chunk, *args) for chunk in chunks)
+        )
+    except BrokenProcessPool:
+        logger.warning(f"The process pool died running {fn.__name__}, restarting")
+        shutdown_process_pool()
+        results = [await asyncio.to_thread(fn, chunk, *args) for chunk in chunks]
+    return [result for chunk in results for result in chunk]
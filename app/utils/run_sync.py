@@ -0,0 +1,18 @@
+import asyncio
+from typing import Any, Coroutine
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run_sync(coroutine: Coroutine) -> Any:
+    """Run a coroutine to completion from synchronous code
+
+    Background tasks and watcher threads have no event loop, but the
+    startup rebuild runs while uvicorn's loop is already running, so the
+    coroutine gets a loop of its own on a separate thread in that case.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
@@ -0,0 +1,89 @@
+import re
+from collections import defaultdict
+from typing import Any, Dict, List
+
+
+TIMING_RE = re.compile(
+    r"^(\d{1,2}:\d{2}:\d{2})[,.](\d{1,3})\s*-->\s*(\d{1,2}:\d{2}:\d{2})[,.](\d{1,3})(.*)$"
+)
+LANGUAGE_RE = re.compile(r"^[a-z]{2,3}(?:[-_][a-z]{2,4})?$", flags=re.I)
+
+
+def subtitle_language(video_stem: str, subtitle_name: str) -> str:
+    """Guess the language tag of a sidecar, e.g. "Movie.en.srt" -> "en"
+
+    Args:
+        video_stem (str): The file name of the video without its extension
+        subtitle_name (str): The file name of the subtitle
+
+    Returns:
+        str: The language tag, "und" if there is none
+    """
+    stem = subtitle_name.rsplit(".", 1)[0]
+    if stem.lower().startswith(video_stem.lower()):
+        stem = stem[len(video_stem) :]
+    for token in re.split(r"[._\s\[\]()]+", stem):
+        if LANGUAGE_RE.match(token) and token.lower() not in ("sdh", "cc"):
+            return token.lower()
+    return "und"
+
+
+def match_subtitles(videos: List[Dict[str, Any]], subtitles: List[Dict[str, Any]]):
+    """Attach subtitle sidecars to the videos of the same directory
+
+    A subtitle goes to the video whose name it starts with. When a
+    directory holds a single video, every remaining subtitle goes to it.
+
+    Args:
+        videos (list): Video file records, get a "subtitles" key
+        subtitles (list): Subtitle file records
+    """
+    videos_by_dir: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for video in videos:
+        video.setdefault("subtitles", [])
+        videos_by_dir[video["path"].rpartition("/")[0]].append(video)
+    for subtitle in subtitles:
+        directory = subtitle["path"].rpartition("/")[0]
+        candidates = videos_by_dir.get(directory, [])
+        match = None
+        for video in candidates:
+            stem = video["name"].rsplit(".", 1)[0]
+            if subtitle["name"].lower().startswith(stem.lower()) and (
+                match is None or len(video["name"]) > len(match["name"])
+            ):
+                match = video
+        if match is None and len(candidates) == 1:
+            match = candidates[0]
+        if match is None:
+            continue
+        match["subtitles"].append(
+            {
+                **subtitle,
+                "language": subtitle_language(
+                    match["name"].rsplit(".", 1)[0], subtitle["name"]
+                ),
+            }
+        )
+
+
+def srt_to_vtt(srt: str) -> str:
+    """Convert SubRip subtitles to WebVTT
+
+    Args:
+        srt (str): The SRT document
+
+    Returns:
+        str: The WebVTT document
+    """
+    lines = ["WEBVTT", ""]
+    for line in (
+        srt.replace("\r\n", "\n").replace("\r", "\n").lstrip("\ufeff").split("\n")
+    ):
+        if match := TIMING_RE.match(line.strip()):
+            start, start_ms, end, end_ms, settings = match.groups()
+            line = (
+                f"{start.zfill(8)}.{start_ms.ljust(3, '0')} --> "
+                f"{end.zfill(8)}.{end_ms.ljust(3, '0')}{settings}"
+            )
+        lines.append(line)
+    return "\n".join(lines).rstrip("\n") + "\n"
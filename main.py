@@ -1,22 +1,26 @@
 import os
 import time
-import shlex
 import uvicorn
-from typing import Dict
-from shutil import which
-from sys import platform
-from io import TextIOWrapper
+from typing import Dict, List
 from asyncio.log import logger
 from app.api import main_router
 from app.settings import settings
 from fastapi import FastAPI, Request
-from app.core import MongoDB, RCloneAPI
-from app.core.cron import fetch_metadata
+from app.core.tmdb import schedule_export_sync
+from app.core.cron import start_warmup, fetch_metadata, schedule_refresh
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.cors import CORSMiddleware
-from subprocess import PIPE, STDOUT, DEVNULL, Popen, run
 from fastapi.responses import FileResponse, UJSONResponse
 from starlette.exceptions import HTTPException as StarletteHTTPException
+from app.core import (
+    MongoDB,
+    LocalAPI,
+    RCloneAPI,
+    RClonePool,
+    build_remote,
+    CATEGORY_SCAN_FIELDS,
+    build_streaming_profile,
+)
 
 
 if not settings.MONGODB_DOMAIN:
@@ -34,44 +38,21 @@ mongo = MongoDB(
     settings.MONGODB_DOMAIN, settings.MONGODB_USERNAME, settings.MONGODB_PASSWORD
 )
 rclone: Dict[int, RCloneAPI] = {}
+rclone_pool = RClonePool(settings.RCLONE_SHARDS, settings.RCLONE_LISTEN_PORT)
 
 
 def restart_rclone():
-    if platform in ["win32", "cygwin", "msys"]:
-        run(
-            shlex.split(
-                f"powershell.exe Stop-Process -Id (Get-NetTCPConnection -LocalPort {settings.RCLONE_LISTEN_PORT}).OwningProcess -Force"
-            ),
-            stdout=DEVNULL,
-            stderr=STDOUT,
-        )
-    elif platform in ["linux", "linux2"]:
-        run(
-            shlex.split(f"bash kill $(lsof -t -i:{settings.RCLONE_LISTEN_PORT})"),
-            stdout=DEVNULL,
-            stderr=STDOUT,
-        )
-    elif platform in ["darwin"]:
-        run(
-            shlex.split(f"kill $(lsof -t -i:{settings.RCLONE_LISTEN_PORT})"),
-            stdout=DEVNULL,
-            stderr=STDOUT,
-        )
-    else:
-        exit("Unsupported platform")
-    rclone_bin = which("rclone")
-    rclone_process = Popen(
-        shlex.split(
-            f"{rclone_bin} rcd --rc-no-auth --rc-serve --rc-addr localhost:{settings.RCLONE_LISTEN_PORT} --config rclone.conf",
-            posix=(platform not in ["win32", "cygwin", "msys"]),
-        ),
-        stdout=PIPE,
-        stderr=STDOUT,
-    )
-    for line in TextIOWrapper(rclone_process.stdout, encoding="utf-8"):
-        if "Serving remote control on" in line:
-            time.sleep(1)
-            break
+    rclone_pool.restart()
+
+
+def restart_shard(shard: int):
+    for rc in rclone.values():
+        if rc.shard == shard:
+            rc.rc_serve()
+    start_warmup([key for key, rc in rclone.items() if rc.shard == shard])
+
+
+rclone_pool.on_restart.append(restart_shard)
 
 
 def rclone_setup(categories: list):
@@ -81,10 +62,90 @@ def rclone_setup(categories: list):
     with open("rclone.conf", "w+") as w:
         w.write(rclone_conf)
 
+    for rc in rclone.values():
+        rc.close()
+    rclone.clear()
     restart_rclone()
 
     for i, category in enumerate(categories):
-        rclone[i] = RCloneAPI(category, i)
+        rclone[i] = create_api(category, i)
+
+
+def create_api(category: dict, index: int) -> RCloneAPI:
+    if category.get("provider") == "local":
+        return LocalAPI(category, index)
+    return RCloneAPI(category, index, rclone_pool.shard_for(category))
+
+
+def rclone_update(categories: list) -> List[int]:
+    """Apply category changes to the running rclone shards
+
+    Only remotes that were added, changed or removed are touched, so
+    streams from the other remotes keep playing. Renamed categories are
+    updated in place, and a new streaming profile only restarts the server
+    of its remote; neither needs a rebuild.
+
+    Returns:
+        list: The rclone indexes whose metadata needs to be rebuilt
+    """
+    current: Dict[str, RCloneAPI] = {rc.fs[:-1]: rc for rc in rclone.values()}
+    updated: Dict[int, RCloneAPI] = {}
+    reindex: Dict[int, int] = {}
+    changed: List[int] = []
+    for i, category in enumerate(categories):
+        if category.get("provider") == "local":
+            remote = None
+            local_id = category.get("id") or category.get("path") or ""
+            name = "".join(c for c in local_id if c.isalnum())
+            shard = 0
+        else:
+            remote = build_remote(category, mongo.config)
+            if remote is None:
+                continue
+            name = remote[0]
+            shard = rclone_pool.shard_for(category)
+        rc = current.pop(name, None)
+        if rc is None:
+            logger.info(f"Adding remote {name}")
+            if remote is not None:
+                rclone_pool.set_remote(*remote, create=True)
+        elif rc.shard != shard or any(
+            rc.data.get(field) != category.get(field) for field in CATEGORY_SCAN_FIELDS
+        ):
+            logger.info(f"Updating remote {name}")
+            rc.close()
+            if remote is not None:
+                rclone_pool.set_remote(*remote, create=False)
+            # The documents stay until the rebuild of the category replaces them
+            if rc.index != i:
+                reindex[rc.index] = i
+        else:
+            if rc.index != i:
+                reindex[rc.index] = i
+                rc.index = i
+            # Names and streaming settings are applied in place
+            restart = build_streaming_profile(rc.data) != build_streaming_profile(
+                category
+            )
+            rc.data = category
+            if restart:
+                logger.info(f"Restarting the server of remote {name}")
+                rc.rc_serve_stop()
+                rc.rc_serve()
+            updated[i] = rc
+            continue
+        updated[i] = create_api(category, i)
+        changed.append(i)
+    for name, rc in current.items():
+        logger.info(f"Removing remote {name}")
+        rc.close()
+        if rc.provider != "local":
+            rclone_pool.delete_remote(name)
+        mongo.delete_metadata([rc.index])
+    mongo.reindex_metadata(reindex)
+    rclone.clear()
+    rclone.update(updated)
+    return changed
 
 
 def startup():
@@ -93,10 +154,15 @@ def startup():
     logger.debug("Initializing core modules...")
 
     if mongo.get_is_config_init() is True:
+        mongo.finish_metadata_swap()
+        schedule_export_sync()
+        schedule_refresh()
         categories = mongo.get_categories()
         rclone_setup(categories)
         if mongo.get_is_metadata_init() is False:
             fetch_metadata()
+        else:
+            start_warmup()
         logger.debug("Done.")
     else:
         # logic for first time setup
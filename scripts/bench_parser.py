@@ -0,0 +1,56 @@
+"""Check the accuracy and the speed of the filename parser
+
+Every name of parser_corpus.json is parsed and each field compared to the
+expected value, then the corpus is parsed over and over without the cache
+to measure the raw speed of the engine.
+
+    python scripts/bench_parser.py [rounds]
+"""
+
+import os
+import sys
+import json
+from time import perf_counter
+
+
+FIELDS = ("title", "year", "season", "episode", "resolution")
+
+
+def bench_parser(rounds: int = 200):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, root)
+    from app.utils.parser import parse
+
+    with open(os.path.join(root, "scripts", "parser_corpus.json")) as f:
+        corpus = json.load(f)
+
+    correct = dict.fromkeys(FIELDS, 0)
+    for entry in corpus:
+        parsed = parse(entry["name"], entry["type"])
+        for field in FIELDS:
+            value = getattr(parsed, field)
+            if field == "title":
+                ok = value.lower() == entry[field].lower()
+            else:
+                ok = value == entry[field]
+            correct[field] += ok
+            if not ok:
+                print(
+                    f"{field}: {entry['name']!r} gave {value!r}, not {entry[field]!r}"
+                )
+    print()
+    for field in FIELDS:
+        print(f"{field:>10}: {correct[field] / len(corpus):7.2%}")
+
+    names = [(entry["name"], entry["type"]) for entry in corpus]
+    started = perf_counter()
+    for _ in range(rounds):
+        parse.cache_clear()
+        for name, data_type in names:
+            parse(name, data_type)
+    elapsed = perf_counter() - started
+    print(f"\n{len(names) * rounds / elapsed:,.0f} names/s uncached")
+
+
+if __name__ == "__main__":
+    bench_parser(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
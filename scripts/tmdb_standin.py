@@ -0,0 +1,178 @@
+"""A local stand-in for the TMDB API
+
+It answers the change feeds, the details of movies and series (appends and
+seasons included) and searches with generated titles, so the refresh job
+and rebuilds can run without a TMDB account or network access. Every
+details request gets a new popularity and rating, like a live title would.
+
+    python scripts/tmdb_standin.py [port] [changed IDs...]
+    TMDB_API_URL=http://localhost:8790/3 python main.py
+
+With --check, the generated details are built into Movie and Serie
+documents the way refresh_metadata does, then the server exits.
+"""
+
+import os
+import sys
+import json
+import zlib
+import random
+from urllib.parse import parse_qs, urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+PAGE_SIZE = 100
+NOT_FOUND = {
+    "status_code": 34,
+    "status_message": "The resource you requested could not be found.",
+}
+
+
+def media(tmdb_id: int, data_type: str) -> dict:
+    """The fields movies and series share"""
+    return {
+        "id": tmdb_id,
+        "popularity": round(random.uniform(1, 500), 3),
+        "vote_average": round(random.uniform(1, 10), 1),
+        "tagline": "",
+        "overview": f"The overview of {data_type} {tmdb_id}",
+        "genres": [{"id": 18, "name": "Drama"}],
+        "homepage": "",
+        "backdrop_path": f"/backdrop{tmdb_id}.jpg",
+        "poster_path": f"/poster{tmdb_id}.jpg",
+        "credits": {"cast": [], "crew": []},
+        "images": {"logos": [], "backdrops": [], "posters": []},
+        "external_ids": {"imdb_id": f"tt{tmdb_id:07d}"},
+        "videos": {"results": []},
+        "reviews": {"results": []},
+        "translations": {"translations": []},
+    }
+
+
+def season(tmdb_id: int, number: int) -> dict:
+    return {
+        "_id": f"{tmdb_id}-{number}",
+        "name": f"Season {number}",
+        "overview": "",
+        "air_date": "2020-01-01",
+        "season_number": number,
+        "poster_path": f"/season{tmdb_id}-{number}.jpg",
+        "episodes": [
+            {
+                "id": tmdb_id * 1000 + number * 100 + episode,
+                "name": f"Episode {episode}",
+                "overview": "",
+                "air_date": "2020-01-01",
+                "episode_number": episode,
+                "vote_average": 7.0,
+                "still_path": "",
+            }
+            for episode in range(1, 11)
+        ],
+    }
+
+
+def details(data_type: str, tmdb_id: int, appends: list) -> dict:
+    result = media(tmdb_id, data_type)
+    if data_type == "movie":
+        result.update(
+            {
+                "title": f"Movie {tmdb_id}",
+                "original_title": f"Movie {tmdb_id}",
+                "status": "Released",
+                "revenue": 0,
+                "release_date": "2020-01-01",
+            }
+        )
+        return result
+    result.update(
+        {
+            "name": f"Series {tmdb_id}",
+            "original_name": f"Series {tmdb_id}",
+            "status": "Returning Series",
+            "first_air_date": "2020-01-01",
+            "number_of_episodes": 20,
+            "number_of_seasons": 2,
+            "last_episode_to_air": None,
+            "next_episode_to_air": None,
+            "seasons": [{"season_number": n} for n in (1, 2)],
+        }
+    )
+    for append in appends:
+        if append.startswith("season/"):
+            result[append] = season(tmdb_id, int(append.split("/")[1]))
+    return result
+
+
+def changes(changed: list, page: int) -> dict:
+    start = (page - 1) * PAGE_SIZE
+    return {
+        "results": [
+            {"id": i, "adult": False} for i in changed[start : start + PAGE_SIZE]
+        ],
+        "page": page,
+        "total_pages": max(1, -(-len(changed) // PAGE_SIZE)),
+        "total_results": len(changed),
+    }
+
+
+def handler(changed: list):
+    class StandIn(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            parts = url.path.strip("/").split("/")
+            if parts and parts[0] == "3":
+                parts = parts[1:]
+            status, body = 404, NOT_FOUND
+            if len(parts) == 2 and parts[0] in ("movie", "tv"):
+                if parts[1] == "changes":
+                    status, body = 200, changes(changed, int(query.get("page", 1)))
+                elif parts[1].isdigit():
+                    appends = query.get("append_to_response", "").split(",")
+                    status, body = 200, details(parts[0], int(parts[1]), appends)
+            elif len(parts) == 2 and parts[0] == "search":
+                title = query.get("query", "")
+                tmdb_id = zlib.crc32(title.encode()) % 1000000 + 1
+                status, body = 200, {"page": 1, "results": [{"id": tmdb_id}]}
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            return
+
+    return StandIn
+
+
+def check():
+    """Build documents from the generated details like the refresh job"""
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from app.models import Movie, Serie
+
+    stub = {
+        "id": "",
+        "name": "",
+        "path": "",
+        "parent": {},
+        "modified_time": "1970-01-01T00:00:00+00:00",
+        "seasons": {},
+    }
+    Movie(stub, details("movie", 1, []), -1)
+    serie = {**stub, "seasons": {"1": {**stub, "episodes": []}}}
+    Serie(serie, details("tv", 2, ["season/1"]), -1)
+    print("The stand-in details build movies and series")
+
+
+if __name__ == "__main__":
+    if "--check" in sys.argv:
+        check()
+        sys.exit()
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8790
+    changed = [int(arg) for arg in sys.argv[2:]]
+    server = ThreadingHTTPServer(("localhost", port), handler(changed))
+    print(f"TMDB stand-in on http://localhost:{port}/3")
+    server.serve_forever()